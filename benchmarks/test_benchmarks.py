@@ -0,0 +1,46 @@
+"""
+pytest-benchmark version of the benchmark_rrules command, needs pytest-django
+
+    pytest benchmarks --ds=<settings> --benchmark-autosave
+    pytest benchmarks --ds=<settings> --benchmark-compare --benchmark-compare-fail=min:20%
+"""
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+pytest.importorskip('pytest_django')
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from djangorrules import benchmark as rrules_benchmark
+
+RECURRENCES = 100
+OPERATIONS = [
+    'to_dateutil_ruleset', 'to_dateutil_ruleset_cached', 'load_and_build_rulesets',
+    'between_1m', 'between_12m', 'between_120m', 'rule_to_text', 'rule_clean', 'formset_validation',
+]
+
+
+@pytest.fixture(scope='module')
+def operations(django_db_setup, django_db_blocker):
+    with django_db_blocker.unblock():
+        recurrences = rrules_benchmark.seed(RECURRENCES)
+        yield rrules_benchmark.operations(recurrences)
+        for recurrence in recurrences:
+            recurrence.delete()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('name', OPERATIONS)
+def test_operation(benchmark, operations, name):
+    func, setup = operations[name]
+    with CaptureQueriesContext(connection) as context:
+        if setup is not None:
+            setup()
+        func()
+    benchmark.extra_info['queries'] = len(context.captured_queries)
+    if setup is None:
+        benchmark(func)
+    else:
+        benchmark.pedantic(func, setup=setup, rounds=5)
+
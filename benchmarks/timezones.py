@@ -0,0 +1,91 @@
+"""
+micro-benchmark of the timezone lookup when building 10k rules
+
+    python benchmarks/timezones.py
+
+compares a pytz.timezone() call per rule (the old behaviour) with the shared
+registry of djangorrules.timezones, with pytz and with zoneinfo
+"""
+import os
+import sys
+import timeit
+from datetime import date, datetime, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import django
+from django.conf import settings
+
+settings.configure(INSTALLED_APPS=['multiselectfield', 'djangorrules'], USE_TZ=True)
+django.setup()
+
+import pytz
+from django.test import override_settings
+
+from djangorrules.models import Recurrence, Rule
+from djangorrules.timezones import get_timezone
+
+RULES = 10000
+TIMEZONES = ['America/La_Paz', 'Europe/Madrid', 'Asia/Tokyo', 'America/New_York']
+
+
+def make_rules():
+    recurrences = [Recurrence(timezone=name, start_time=time(10, 0)) for name in TIMEZONES]
+    return [
+        Rule(recurrence=recurrences[i % len(recurrences)], freq=Rule.WEEKLY, interval=1, wkst=0,
+             dtstart=date(2020, 1, 1), byweekday=['MO', 'WE'], freq_type=Rule.COUNT, count=10)
+        for i in range(RULES)
+    ]
+
+
+def lookup_uncached(rules):
+    for rule in rules:
+        pytz.timezone(rule.recurrence.timezone)
+
+
+def lookup_registry(rules):
+    for rule in rules:
+        get_timezone(rule.recurrence.timezone)
+
+
+def localize_uncached(rules):
+    for rule in rules:
+        recurrence = rule.recurrence
+        pytz.timezone(recurrence.timezone).localize(datetime.combine(rule.dtstart, recurrence.start_time))
+
+
+def localize_registry(rules):
+    for rule in rules:
+        rule.recurrence.localize_date(rule.dtstart)
+
+
+def build_uncached(rules):
+    for rule in rules:
+        rule.build_dateutil_rule(pytz.timezone(rule.recurrence.timezone), rule.recurrence.start_time)
+
+
+def build_registry(rules):
+    for rule in rules:
+        rule.to_dateutil_rule
+
+
+def report(name, func):
+    best = min(timeit.repeat(func, number=1, repeat=5))
+    print(f'{name:<40} {best * 1000:8.1f} ms')
+
+
+def main():
+    rules = make_rules()
+    report('lookup, pytz.timezone() per rule', lambda: lookup_uncached(rules))
+    report('lookup, registry', lambda: lookup_registry(rules))
+    report('localize, pytz.timezone() per rule', lambda: localize_uncached(rules))
+    report('localize, registry (pytz)', lambda: localize_registry(rules))
+    report('build rrule, pytz.timezone() per rule', lambda: build_uncached(rules))
+    report('build rrule, registry (pytz)', lambda: build_registry(rules))
+    with override_settings(DJANGORRULES_USE_ZONEINFO=True):
+        report('localize, registry (zoneinfo)', lambda: localize_registry(rules))
+        report('build rrule, registry (zoneinfo)', lambda: build_registry(rules))
+
+
+if __name__ == '__main__':
+    main()
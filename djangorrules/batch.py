@@ -0,0 +1,130 @@
+"""
+parallel expansion of many recurrences into the Occurrence table
+
+the parent reads a compact picklable spec of every recurrence, (pk, ical_text),
+and sends chunks of specs to a ProcessPoolExecutor. the workers only parse the
+text with from_ical() and expand it, no ORM is used outside the parent, which
+writes the occurrences back with bulk_create
+"""
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+
+import django
+from django.apps import apps
+from django.db import transaction
+from django.utils import timezone
+
+from .conf import app_settings
+from .ical import from_ical
+from .materialize import retention_start
+
+
+def recurrence_specs(queryset, chunk_size=500):
+    """
+    yield lists of (pk, ical_text) specs, recurrences saved before ical_text
+    existed get their text built from the prefetched rules and dates
+    """
+    chunk = []
+    missing = []
+    for pk, ical_text in queryset.order_by('pk').values_list('pk', 'ical_text').iterator(chunk_size=chunk_size):
+        if ical_text:
+            chunk.append((pk, ical_text))
+        else:
+            missing.append(pk)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    for recurrence in queryset.model.objects.filter(pk__in=missing).with_ruleset_data().iterator(
+            chunk_size=chunk_size):
+        chunk.append((recurrence.pk, recurrence.to_ical()))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def expand_spec(spec, until, since=None):
+    """
+    (recurrence_id, utc_start, local_date, is_exception) of every occurrence of a spec from since
+    up to until, the same rows of Recurrence.refresh_occurrences()
+    """
+    pk, ical_text = spec
+    rule_set = from_ical(ical_text)
+    r_dates = set(rule_set._rdate)
+    rows = []
+    for dt in rule_set if since is None else rule_set.xafter(since, inc=True):
+        if dt > until:
+            break
+        rows.append((pk, dt, dt.date(), dt in r_dates))
+    return rows
+
+
+def expand_chunk(specs, until, since=None):
+    return [row for spec in specs for row in expand_spec(spec, until, since)]
+
+
+def _init_worker():
+    # spawned workers (not forked) import the app without the parent's state
+    if not apps.ready:
+        django.setup()
+
+
+def _write(pks, rows, batch_size, until, since):
+    from .models import Occurrence, Recurrence
+
+    occurrences = [
+        Occurrence(recurrence_id=pk, utc_start=dt, local_date=local_date, is_exception=is_exception)
+        for pk, dt, local_date, is_exception in rows
+    ]
+    with transaction.atomic():
+        stale = Occurrence.objects.filter(recurrence_id__in=pks)
+        if since is not None:
+            stale = stale.filter(utc_start__gte=since)
+        stale.delete()
+        Occurrence.objects.bulk_create(occurrences, batch_size=batch_size)
+        Recurrence.objects.filter(pk__in=pks).update(expanded_until=until)
+    return len(occurrences)
+
+
+def expand_recurrences(queryset=None, workers=None, horizon=None, chunk_size=500, batch_size=1000):
+    """
+    rebuild the occurrences of the recurrences up to now + horizon days (by default
+    DJANGORRULES_OCCURRENCE_HORIZON) with workers processes (by default one per core),
+    every chunk of chunk_size recurrences is written in its own transaction.
+    workers=0 expands in the current process. returns (recurrences, occurrences)
+    """
+    from .models import Recurrence
+
+    queryset = Recurrence.objects.all() if queryset is None else queryset
+    horizon = app_settings.OCCURRENCE_HORIZON if horizon is None else horizon
+    workers = os.cpu_count() if workers is None else workers
+    until = timezone.now() + timedelta(days=horizon)
+    since = retention_start()
+    chunks = recurrence_specs(queryset, chunk_size)
+    recurrences = occurrences = 0
+
+    if not workers:
+        for chunk in chunks:
+            recurrences += len(chunk)
+            occurrences += _write([pk for pk, text in chunk], expand_chunk(chunk, until, since), batch_size,
+                                  until, since)
+        return recurrences, occurrences
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        # at most two chunks per worker are in flight, so the parent memory stays bounded
+        pending = {}
+        for chunk in chunks:
+            pending[executor.submit(expand_chunk, chunk, until, since)] = [pk for pk, text in chunk]
+            if len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pks = pending.pop(future)
+                    recurrences += len(pks)
+                    occurrences += _write(pks, future.result(), batch_size, until, since)
+        for future in list(pending):
+            pks = pending.pop(future)
+            recurrences += len(pks)
+            occurrences += _write(pks, future.result(), batch_size, until, since)
+    return recurrences, occurrences
@@ -0,0 +1,207 @@
+"""
+benchmark of ruleset construction, expansion, text rendering and validation
+
+seed() creates recurrences with every rule shape, run() times each operation
+and counts its queries, the results are plain dicts so they can be saved as JSON
+and compared across commits with compare(), see the benchmark_rrules command
+"""
+import platform
+import time as timer
+from datetime import date, datetime, time, timedelta
+
+import django
+import pytz
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .cache import ruleset_cache
+from .ical import _parse
+from .models import Recurrence, RDate, Rule
+from .validators import rule_values, validate_many
+
+# (freq, year_month_mode, extra fields) of the seeded rules
+RULE_SHAPES = [
+    (Rule.DAILY, None, {'interval': 2}),
+    (Rule.DAILY, None, {'bymonth': ['1', '6'], 'freq_type': Rule.COUNT, 'count': 100}),
+    (Rule.WEEKLY, None, {'byweekday': ['MO', 'WE', 'FR']}),
+    (Rule.WEEKLY, None, {'interval': 2, 'byweekday': ['TU'], 'freq_type': Rule.UNTIL,
+                         'until_date': date(2030, 1, 1)}),
+    (Rule.MONTHLY, Rule.BY_DATE, {'bymonthday': ['1', '15']}),
+    (Rule.MONTHLY, Rule.BY_DATE, {'bymonthday': ['-1']}),
+    (Rule.MONTHLY, Rule.BY_DAY, {'byweekday': ['1MO', '-1FR']}),
+    (Rule.MONTHLY, Rule.BY_DAY, {'byweekday': ['MO', 'TU', 'WE', 'TH', 'FR'], 'bysetpos': ['-1']}),
+    (Rule.YEARLY, Rule.BY_DATE, {'bymonth': ['3'], 'bymonthday': ['15']}),
+    (Rule.YEARLY, Rule.BY_DAY, {'bymonth': ['11'], 'byweekday': ['4TH']}),
+    (Rule.YEARLY, Rule.BY_DAY, {'bymonth': ['1'], 'byweekday': ['MO', 'TU', 'WE', 'TH', 'FR'],
+                                'bysetpos': ['1', '-1']}),
+]
+TIMEZONES = ['UTC', 'America/La_Paz', 'Europe/Madrid', 'Asia/Tokyo']
+START = date(2020, 1, 1)
+WINDOWS = {'1m': 31, '12m': 366, '120m': 3653}
+
+
+def seed(count):
+    """
+    create count recurrences, each with one rule of RULE_SHAPES,
+    every third recurrence gets an excluded and an included date
+    """
+    recurrences = []
+    for i in range(count):
+        recurrence = Recurrence.objects.create(timezone=TIMEZONES[i % len(TIMEZONES)], start_time=time(9 + i % 8))
+        freq, mode, extra = RULE_SHAPES[i % len(RULE_SHAPES)]
+        fields = {'interval': 1, 'freq_type': Rule.FOREVER}
+        fields.update(extra)
+        Rule.objects.create(recurrence=recurrence, dtstart=START, freq=freq, year_month_mode=mode, **fields)
+        if i % 3 == 0:
+            RDate.objects.create(recurrence=recurrence, naive_dt=START + timedelta(days=40), exclude=True)
+            RDate.objects.create(recurrence=recurrence, naive_dt=START + timedelta(days=45))
+        recurrences.append(recurrence)
+    return recurrences
+
+
+def measure(func, repeat, setup=None):
+    """
+    best and mean seconds of repeat runs of func, the queries are counted in the first run
+    """
+    times = []
+    queries = 0
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        with CaptureQueriesContext(connection) as context:
+            start = timer.perf_counter()
+            func()
+            times.append(timer.perf_counter() - start)
+        if i == 0:
+            queries = len(context.captured_queries)
+    return {'best': min(times), 'mean': sum(times) / len(times), 'queries': queries}
+
+
+def _cold_cache():
+    ruleset_cache.clear()
+    _parse.cache_clear()
+
+
+def _formset_data(rules):
+    from .forms import RuleForm
+
+    data = {
+        'form-TOTAL_FORMS': str(len(rules)),
+        'form-INITIAL_FORMS': '0',
+    }
+    for i, rule in enumerate(rules):
+        for name in RuleForm._meta.fields:
+            value = getattr(rule, 'recurrence_id' if name == 'recurrence' else name, None)
+            if value is None or value is False:
+                continue
+            if isinstance(value, list):
+                data[f'form-{i}-{name}'] = [str(item) for item in value]
+            else:
+                data[f'form-{i}-{name}'] = str(value)
+    return data
+
+
+def operations(recurrences):
+    """
+    name -> (func, setup) of every measured operation
+    """
+    from .forms import RulseFormSet
+
+    pks = [recurrence.pk for recurrence in recurrences]
+    loaded = list(Recurrence.objects.filter(pk__in=pks).with_ruleset_data())
+    rules = list(Rule.objects.filter(recurrence_id__in=pks))
+    rule_sets = [recurrence.to_dateutil_ruleset() for recurrence in loaded]
+    after = pytz.utc.localize(datetime.combine(START, time()))
+    data = _formset_data(rules[:1000])
+    rule_dicts = [rule_values(rule) for rule in rules]
+
+    def build():
+        for recurrence in loaded:
+            recurrence.to_dateutil_ruleset()
+
+    def load_and_build():
+        for recurrence in Recurrence.objects.filter(pk__in=pks).with_ruleset_data():
+            recurrence.to_dateutil_ruleset()
+
+    def between(days):
+        before = after + timedelta(days=days)
+
+        def func():
+            for rule_set in rule_sets:
+                rule_set.between(after, before)
+        return func
+
+    def expand_compact():
+        before = after + timedelta(days=WINDOWS['120m'])
+        for recurrence in loaded:
+            recurrence.expand_compact(after, before)
+
+    def histogram():
+        Recurrence.objects.filter(pk__in=pks).histogram(START, START + timedelta(days=WINDOWS['12m']), tz='UTC')
+
+    def rule_to_text():
+        for rule in rules:
+            rule.rule_to_text()
+
+    def clean():
+        for rule in rules:
+            rule.clean()
+
+    def batch_validation():
+        validate_many(rule_dicts)
+
+    def formset():
+        RulseFormSet(data, queryset=Rule.objects.none()).is_valid()
+
+    result = {
+        'to_dateutil_ruleset': (build, _cold_cache),
+        'to_dateutil_ruleset_cached': (build, None),
+        'load_and_build_rulesets': (load_and_build, _cold_cache),
+    }
+    for name, days in WINDOWS.items():
+        result[f'between_{name}'] = (between(days), None)
+    result.update({
+        'expand_compact_120m': (expand_compact, None),
+        'histogram_12m': (histogram, None),
+        'rule_to_text': (rule_to_text, None),
+        'rule_clean': (clean, None),
+        'validate_many': (batch_validation, None),
+        'formset_validation': (formset, None),
+    })
+    return result
+
+
+def run(recurrences, repeat=5, only=None):
+    """
+    {'meta': ..., 'results': {operation: {'best', 'mean', 'queries'}}} of the seeded recurrences
+    """
+    results = {}
+    for name, (func, setup) in operations(recurrences).items():
+        if only and name not in only:
+            continue
+        results[name] = measure(func, repeat, setup)
+    return {
+        'meta': {
+            'recurrences': len(recurrences),
+            'repeat': repeat,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold=0.2):
+    """
+    (operation, baseline, current, ratio) of the operations slower than
+    baseline * (1 + threshold) or running more queries
+    """
+    regressions = []
+    for name, new in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        ratio = new['best'] / old['best'] if old['best'] else 1
+        if ratio > 1 + threshold or new['queries'] > old['queries']:
+            regressions.append((name, old, new, ratio))
+    return regressions
@@ -0,0 +1,127 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+from .conf import app_settings
+from .utils import copy_ruleset
+
+
+class RulesetCache:
+    """
+    cache of compiled rulesets keyed by recurrence pk and version
+
+    the first tier is a process-local LRU of DJANGORRULES_RULESET_CACHE_SIZE entries,
+    the optional second tier is the django cache named by DJANGORRULES_RULESET_CACHE_BACKEND.
+    the version of the recurrence is bumped each time its rules or dates change,
+    so an old entry is never read again and is dropped by the LRU eviction
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.backend_hits = 0
+        self.backend_misses = 0
+
+    @staticmethod
+    def make_key(recurrence, cache=False):
+        # the digest of ical_text guards against a version reused after a rollback,
+        # the tz module because a ruleset holds the tzinfos of pytz or zoneinfo
+        digest = hashlib.md5(recurrence.ical_text.encode()).hexdigest()
+        tz_module = 'zoneinfo' if app_settings.USE_ZONEINFO else 'pytz'
+        return f"djangorrules:ruleset:{recurrence.pk}:{recurrence.version}:{digest}:{tz_module}:{int(cache)}"
+
+    @property
+    def backend(self):
+        alias = app_settings.RULESET_CACHE_BACKEND
+        return caches[alias] if alias else None
+
+    def get_or_build(self, recurrence, build, cache=False):
+        """
+        return the compiled ruleset of the recurrence, build() is called on a miss
+        """
+        key = self.make_key(recurrence, cache)
+        with self._lock:
+            rule_set = self._entries.get(key)
+            if rule_set is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy_ruleset(rule_set, cache)
+            self.misses += 1
+
+        backend = self.backend
+        # a ruleset with cache=True holds a lock and can't be pickled
+        if backend is not None and not cache:
+            rule_set = backend.get(key)
+            if rule_set is None:
+                self.backend_misses += 1
+            else:
+                self.backend_hits += 1
+        if rule_set is None:
+            rule_set = build()
+            if backend is not None and not cache:
+                backend.set(key, rule_set, app_settings.RULESET_CACHE_TIMEOUT)
+        self._store(key, rule_set)
+        return copy_ruleset(rule_set, cache)
+
+    def _store(self, key, rule_set):
+        max_size = app_settings.RULESET_CACHE_SIZE
+        if not max_size:
+            return
+        with self._lock:
+            self._entries[key] = rule_set
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'backend_hits': self.backend_hits,
+            'backend_misses': self.backend_misses,
+            'size': len(self._entries),
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.backend_hits = self.backend_misses = 0
+
+
+class RuleTextCache:
+    """
+    process-local LRU of the rendered rule texts, keyed by the rendered field values,
+    language and short, with at most DJANGORRULES_TEXT_CACHE_SIZE entries
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+            return text
+
+    def set(self, key, text):
+        max_size = app_settings.TEXT_CACHE_SIZE
+        if not max_size:
+            return
+        with self._lock:
+            self._entries[key] = text
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+ruleset_cache = RulesetCache()
+rule_text_cache = RuleTextCache()
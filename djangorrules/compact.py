@@ -0,0 +1,123 @@
+"""
+compact occurrences, epoch seconds instead of datetimes
+
+CompactOccurrences keeps the sorted occurrences of a recurrence as an array('q')
+(or a numpy int64 array) of seconds since epoch and the timezone once, 8 bytes
+per occurrence instead of an aware datetime. the datetimes are only built when
+an item is read, between() slices by binary search without copying the buffer
+
+recurrences whose rules are all simple (see fastpath.simple_rule) are expanded
+with numpy without any datetime, the others are expanded by dateutil one
+occurrence at a time
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+import pytz
+
+from . import fastpath
+from .utils import xbetween
+
+
+def to_datetime(seconds, tzinfo):
+    """
+    aware datetime of epoch seconds in tzinfo
+    """
+    return datetime.fromtimestamp(seconds, pytz.utc).astimezone(tzinfo)
+
+
+class CompactOccurrences:
+    """
+    read only sequence of the aware datetimes of a buffer of epoch seconds
+    """
+
+    def __init__(self, seconds, tzinfo, recurrence_id=None):
+        # a memoryview slices an array('q') without copying it, numpy slices are views already
+        self.seconds = memoryview(seconds) if isinstance(seconds, array) else seconds
+        self.tzinfo = tzinfo
+        self.recurrence_id = recurrence_id
+
+    def __len__(self):
+        return len(self.seconds)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return CompactOccurrences(self.seconds[index], self.tzinfo, self.recurrence_id)
+        return to_datetime(int(self.seconds[index]), self.tzinfo)
+
+    def __iter__(self):
+        for seconds in self.seconds:
+            yield to_datetime(int(seconds), self.tzinfo)
+
+    def __repr__(self):
+        return f'<CompactOccurrences recurrence={self.recurrence_id} occurrences={len(self)}>'
+
+    @property
+    def nbytes(self):
+        return self.seconds.nbytes
+
+    def _search(self, value, side):
+        if fastpath.np is not None and isinstance(self.seconds, fastpath.np.ndarray):
+            return int(fastpath.np.searchsorted(self.seconds, value, side=side))
+        return (bisect_left if side == 'left' else bisect_right)(self.seconds, value)
+
+    def between(self, after, before, inc=False):
+        """
+        the occurrences between after and before like rruleset.between, a view of the same buffer
+        """
+        after, before = after.timestamp(), before.timestamp()
+        if inc:
+            start, end = self._search(after, 'left'), self._search(before, 'right')
+        else:
+            start, end = self._search(after, 'right'), self._search(before, 'left')
+        return self[start:max(start, end)]
+
+    def to_datetimes(self):
+        return list(self)
+
+
+def _simple_seconds(recurrence, after, before, inc):
+    """
+    int64 array with the epoch seconds of the occurrences, None when a rule isn't simple
+    """
+    np = fastpath.np
+    dt_tz = recurrence.get_timezone()
+    included = []
+    excluded = []
+    for rule in recurrence.rules.all():
+        simple = fastpath.simple_rule(rule, dt_tz, recurrence.start_time)
+        if simple is None:
+            return None
+        local = fastpath.expand_array(simple, after, before, inc).astype('int64') // fastpath.SECOND
+        seconds = local - int(simple.dtstart.utcoffset().total_seconds())
+        (excluded if rule.exclude else included).append(seconds)
+    dates = [[], []]
+    for day in recurrence.r_dates.all():
+        dt = recurrence.localize_date(day.naive_dt)
+        if (after <= dt <= before) if inc else (after < dt < before):
+            dates[day.exclude].append(int(dt.timestamp()))
+    included.append(np.array(dates[False], dtype='int64'))
+    excluded.append(np.array(dates[True], dtype='int64'))
+    return np.setdiff1d(np.concatenate(included), np.concatenate(excluded))
+
+
+def _dateutil_seconds(recurrence, after, before, inc):
+    rule_set = recurrence.to_dateutil_ruleset()
+    return array('q', (int(dt.timestamp()) for dt in xbetween(rule_set, after, before, inc)))
+
+
+def expand(recurrence, after, before, inc=False, use_numpy=None):
+    """
+    CompactOccurrences of the recurrence between after and before, backed by a numpy
+    array when numpy is installed (unless use_numpy is False) otherwise by an array('q'),
+    use_numpy=True without numpy falls back to dateutil
+    """
+    use_numpy = fastpath.np is not None and use_numpy is not False
+    if not use_numpy:
+        seconds = _dateutil_seconds(recurrence, after, before, inc)
+    else:
+        seconds = _simple_seconds(recurrence, after, before, inc)
+        if seconds is None:
+            seconds = fastpath.np.frombuffer(_dateutil_seconds(recurrence, after, before, inc), dtype='int64')
+    return CompactOccurrences(seconds, recurrence.get_timezone(), recurrence.pk)
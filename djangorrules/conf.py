@@ -0,0 +1,38 @@
+from django.conf import settings
+
+
+class AppSettings:
+    """
+    djangorrules settings, every value can be overridden in the project
+    settings with the DJANGORRULES_ prefix e.g. DJANGORRULES_OCCURRENCE_HORIZON = 90
+    """
+    defaults = {
+        # days after now materialized in the Occurrence table
+        'OCCURRENCE_HORIZON': 365,
+        # days before now kept when the occurrences are rebuilt, None keeps them since the start
+        'OCCURRENCE_RETENTION': None,
+        # compiled rulesets kept in the process-local cache, 0 disables it
+        'RULESET_CACHE_SIZE': 1000,
+        # alias of a django cache used as second tier of the ruleset cache
+        'RULESET_CACHE_BACKEND': None,
+        # timeout of the second tier, None keeps the entries until they are evicted
+        'RULESET_CACHE_TIMEOUT': None,
+        # rendered rule texts kept in the process-local cache, 0 disables it
+        'TEXT_CACHE_SIZE': 10000,
+        # threads of the pool used by the async API to expand rulesets
+        'EXPANSION_WORKERS': 4,
+        # use zoneinfo instead of pytz, see djangorrules.timezones
+        'USE_ZONEINFO': False,
+        # dotted path of a stats backend, see djangorrules.instrumentation
+        'INSTRUMENTATION_BACKEND': None,
+        # kwargs of the instrumentation backend
+        'INSTRUMENTATION_OPTIONS': {},
+    }
+
+    def __getattr__(self, name):
+        if name not in self.defaults:
+            raise AttributeError(name)
+        return getattr(settings, f'DJANGORRULES_{name}', self.defaults[name])
+
+
+app_settings = AppSettings()
@@ -0,0 +1,132 @@
+"""
+conflicts between the occurrences of a recurrence and many others
+
+RecurrenceQuerySet.conflicts_with() prunes the candidates in three steps before
+expanding anything:
+
+    windows        SQL, the rules and dates active while the recurrence is
+    masks          SQL, the rules with a month and a weekday of the recurrence
+                   (with a day of margin, the timezones can differ)
+    periodicity    python, two simple rules can only meet on the days of their
+                   intersection, which repeats every lcm of both periods
+                   (see fastpath.intersect)
+
+only the survivors are expanded. two occurrences conflict when they start at
+the same time or, with a duration, when they overlap. when the timeout is over
+ConflictsTimeout is raised with the conflicts found in the candidates checked
+"""
+import heapq
+import time
+from datetime import timedelta
+
+from . import fastpath
+
+
+class ConflictsTimeout(Exception):
+    """
+    the timeout was over before every candidate was checked, conflicts holds the
+    ones found so far, sorted like the result but not always the first ones
+    """
+
+    def __init__(self, conflicts, checked):
+        super().__init__(f'timeout after {checked} candidates')
+        self.conflicts = conflicts
+        self.checked = checked
+
+
+def window(recurrence, after, before):
+    """
+    (start, end) of the occurrences of the recurrence between after and before
+    from its stored rules and dates, None when it has none there
+    """
+    starts = []
+    ends = []
+    for rule in recurrence.rules.all():
+        if not rule.exclude:
+            starts.append(rule.utc_dtstart)
+            ends.append(rule.utc_last_occurrence or before)
+    for day in recurrence.r_dates.all():
+        if not day.exclude:
+            starts.append(day.utc_dt)
+            ends.append(day.utc_dt)
+    if not starts:
+        return None
+    start, end = max(after, min(starts)), min(before, max(ends))
+    return (start, end) if start <= end else None
+
+
+def simple_rules(recurrence):
+    """
+    SimpleRules of the inclusive rules, None when a rule isn't simple or the recurrence
+    includes dates. the exrules and exdates are left out, they only remove occurrences
+    """
+    if any(not day.exclude for day in recurrence.r_dates.all()):
+        return None
+    dt_tz = recurrence.get_timezone()
+    rules = []
+    for rule in recurrence.rules.all():
+        if rule.exclude:
+            continue
+        simple = fastpath.simple_rule(rule, dt_tz, recurrence.start_time)
+        if simple is None:
+            return None
+        rules.append(simple)
+    return rules
+
+
+def may_coincide(first, second, after, before):
+    """
+    False when no rule of first (a list of SimpleRules) has an occurrence
+    at the same time as a rule of second between after and before
+    """
+    for a in first:
+        for b in second:
+            both = fastpath.intersect(a, b)
+            if both is None or fastpath.count_between(both, after, before, inc=True):
+                return True
+    return False
+
+
+def overlapping(first, second, duration=None):
+    """
+    the datetimes of first (sorted) that start with or, with a duration,
+    overlap an occurrence of second (sorted)
+    """
+    if not duration:
+        second = set(second)
+        return [dt for dt in first if dt in second]
+    result = []
+    i = 0
+    for dt in first:
+        # skip the occurrences of second that end before dt
+        while i < len(second) and second[i] + duration <= dt:
+            i += 1
+        if i < len(second) and second[i] < dt + duration:
+            result.append(dt)
+    return result
+
+
+def find_conflicts(recurrence, candidates, after, before, limit=10, duration=None, timeout=None):
+    """
+    first limit (recurrence_id, datetime) pairs, sorted by datetime, of the occurrences
+    of the recurrence between after and before that conflict with a candidate.
+    raises ConflictsTimeout when timeout seconds have passed before the last candidate
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    own = recurrence.to_dateutil_ruleset().between(after, before, inc=True)
+    if not own:
+        return []
+    own_rules = simple_rules(recurrence) if not duration else None
+    margin = duration or timedelta()
+    found = []
+    for checked, candidate in enumerate(candidates):
+        if deadline is not None and time.monotonic() > deadline:
+            raise ConflictsTimeout([(pk, dt) for dt, pk in found], checked)
+        if own_rules is not None:
+            other_rules = simple_rules(candidate)
+            if other_rules is not None and not may_coincide(own_rules, other_rules, after, before):
+                continue
+        occurrences = candidate.to_dateutil_ruleset().between(own[0] - margin, own[-1] + margin, inc=True)
+        conflicts = overlapping(own, occurrences, duration)[:limit]
+        found = heapq.nsmallest(limit, found + [(dt, candidate.pk) for dt in conflicts])
+    return [(pk, dt) for dt, pk in found]
@@ -0,0 +1,126 @@
+"""
+difference between two versions of a recurrence
+
+the ical texts of both versions (see djangorrules.ical) are split in components,
+a DTSTART with its RRULE or EXRULE, or an RDATE or EXDATE line. only the components
+that changed can change the occurrences, so both rulesets are only expanded over
+the window covered by them:
+
+    RDATE/EXDATE        the date
+    RRULE/EXRULE        from its start to its last occurrence (the horizon if it never ends)
+    UNTIL or COUNT      from the first to the last of both ends, the occurrences before
+                        the first end are the same
+
+Recurrence.sync() applies the delta to the Occurrence table instead of rebuilding it and
+sends occurrences_changed(sender=Recurrence, recurrence, start, end, added, removed)
+"""
+from collections import namedtuple
+
+from django.dispatch import Signal
+
+from .ical import from_ical
+
+occurrences_changed = Signal()
+
+# added and removed are sorted lists of (aware datetime, is_exception), an occurrence
+# that becomes (or stops being) an included date is removed and added again
+Delta = namedtuple('Delta', ['start', 'end', 'added', 'removed'])
+
+EMPTY = Delta(None, None, [], [])
+
+
+def components(text):
+    """
+    set of the components of an ical text, rules keep their DTSTART line
+    """
+    result = set()
+    dtstart = None
+    for line in text.splitlines():
+        if line.startswith('DTSTART'):
+            dtstart = line
+        elif line.startswith(('RRULE', 'EXRULE')):
+            result.add(f'{dtstart}\n{line}')
+        elif line:
+            result.add(line)
+    return result
+
+
+def _end_key(component):
+    # the component without its UNTIL and COUNT, rules with the same key only differ in their end
+    dtstart, _, rule = component.partition('\n')
+    parts = [part for part in rule.split(';') if not part.startswith(('UNTIL=', 'COUNT='))]
+    return dtstart, ';'.join(parts)
+
+
+def _span(component, until):
+    """
+    (first, last) datetimes a component can change, last is None after until
+    """
+    rule_set = from_ical(component)
+    rules = rule_set._rrule + rule_set._exrule
+    if not rules:
+        dt = (rule_set._rdate + rule_set._exdate)[0]
+        return dt, dt
+    rule = rules[0]
+    if rule._until is not None:
+        return rule._dtstart, rule._until
+    if rule._count is not None:
+        last = None
+        for last in rule:
+            if last > until:
+                return rule._dtstart, None
+        return rule._dtstart, last or rule._dtstart
+    return rule._dtstart, None
+
+
+def affected_window(old_text, new_text, until):
+    """
+    (start, end) of the occurrences that may differ up to until, None when no component changed
+    """
+    old = components(old_text)
+    new = components(new_text)
+    removed = old - new
+    added = new - old
+    if not removed and not added:
+        return None
+    spans = []
+    by_key = {_end_key(component): component for component in added if '\n' in component}
+    for component in removed:
+        other = by_key.pop(_end_key(component), None) if '\n' in component else None
+        if other is None:
+            spans.append(_span(component, until))
+            continue
+        # only the end changed
+        (_, old_end), (_, new_end) = _span(component, until), _span(other, until)
+        added.discard(other)
+        if old_end is None or new_end is None:
+            spans.append((min(end for end in (old_end, new_end, until) if end is not None), None))
+        else:
+            spans.append((min(old_end, new_end), max(old_end, new_end)))
+    spans.extend(_span(component, until) for component in added)
+    start = min(first for first, last in spans)
+    end = min(until, max(until if last is None else last for first, last in spans))
+    return start, end
+
+
+def _occurrences(text, start, end):
+    rule_set = from_ical(text)
+    r_dates = set(rule_set._rdate)
+    return {(dt, dt in r_dates) for dt in rule_set.between(start, end, inc=True)}
+
+
+def diff(old_text, new_text, until, since=None):
+    """
+    Delta between two ical texts of a recurrence up to until, from since when given
+    """
+    window = affected_window(old_text, new_text, until)
+    if window is None:
+        return EMPTY
+    start, end = window
+    if since is not None:
+        start = max(start, since)
+    if start > end:
+        return EMPTY
+    old = _occurrences(old_text, start, end) if old_text else set()
+    new = _occurrences(new_text, start, end) if new_text else set()
+    return Delta(start, end, sorted(new - old), sorted(old - new))
@@ -0,0 +1,31 @@
+"""
+bounded thread pool for CPU-bound expansion called from async code,
+DJANGORRULES_EXPANSION_WORKERS threads are shared by every request
+so a large recurrence can't stall the event loop or start unbounded work
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .conf import app_settings
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=app_settings.EXPANSION_WORKERS,
+                                           thread_name_prefix='djangorrules')
+        return _executor
+
+
+async def run_in_pool(func, *args, **kwargs):
+    """
+    await func(*args, **kwargs) run in the expansion pool
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), partial(func, *args, **kwargs))
@@ -0,0 +1,326 @@
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from math import gcd
+
+import pytz
+
+from .timezones import is_pytz, localize
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional
+    np = None
+
+EPOCH = date(1970, 1, 1)
+# the arrays hold microseconds
+SECOND = 10 ** 6
+DAY = 86400 * SECOND
+
+DAYS = 'days'
+MONTHS = 'months'
+
+# occurrences of a simple rule are the dates base + k * period + offset
+# for every k >= 0 and offset in offsets, skipping the first `skipped` ones,
+# all of them at the time of dtstart with the utc offset of dtstart.
+# base and period are days for DAILY and WEEKLY rules and months
+# (base is year * 12 + month - 1) for MONTHLY rules
+SimpleRule = namedtuple('SimpleRule', [
+    'dtstart', 'unit', 'base', 'period', 'offsets', 'skipped', 'count', 'until'
+])
+
+
+def simple_rule(rule, dt_tz, start_time, monthly=False):
+    """
+    SimpleRule of a DAILY or WEEKLY Rule with interval, optional plain byweekday
+    (MO, WE but not 1MO) and count or until, None for any other shape
+    (bymonth, bymonthday, bysetpos, nth-weekday) that must be expanded by dateutil.
+    with monthly == True MONTHLY rules by date are accepted too when
+    their month days exist in every month (1 to 28).
+    the arithmetic follows the fixed utc offset of pytz, zoneinfo timezones always return None
+    """
+    if rule.bymonth or rule.bysetpos or not is_pytz(dt_tz):
+        return None
+    if rule.freq == rule.MONTHLY and monthly:
+        return _monthly_rule(rule, dt_tz, start_time)
+    if rule.freq not in (rule.DAILY, rule.WEEKLY) or rule.bymonthday:
+        return None
+    dtstart = _dtstart(rule, dt_tz, start_time)
+    start = dtstart.date()
+    if rule.freq == rule.DAILY:
+        if rule.byweekday:
+            return None
+        base = start
+        period = rule.interval
+        offsets = (0,)
+    else:
+        weekdays = rule.compiled_kwargs['byweekday'] or ()
+        if any(n for day, n in weekdays):
+            return None
+        weekdays = {day for day, n in weekdays} or {start.weekday()}
+        # dateutil counts the weeks from the week of dtstart starting at wkst
+        base = start - timedelta(days=(start.weekday() - rule.wkst) % 7)
+        period = 7 * rule.interval
+        offsets = tuple(sorted((day - rule.wkst) % 7 for day in weekdays))
+    skipped = sum(1 for offset in offsets if base + timedelta(days=offset) < start)
+    return SimpleRule(dtstart, DAYS, (base - EPOCH).days, period, offsets, skipped, rule.count or None,
+                      _until(rule, dt_tz, start_time))
+
+
+def _monthly_rule(rule, dt_tz, start_time):
+    if rule.byweekday:
+        return None
+    dtstart = _dtstart(rule, dt_tz, start_time)
+    days = sorted(set(rule.compiled_kwargs['bymonthday'] or [dtstart.day]))
+    if not all(1 <= day <= 28 for day in days):
+        return None
+    offsets = tuple(day - 1 for day in days)
+    skipped = sum(1 for day in days if day < dtstart.day)
+    return SimpleRule(dtstart, MONTHS, dtstart.year * 12 + dtstart.month - 1, rule.interval, offsets, skipped,
+                      rule.count or None, _until(rule, dt_tz, start_time))
+
+
+def _dtstart(rule, dt_tz, start_time):
+    # the same values passed to rrule() in Rule.build_dateutil_rule
+    return localize(dt_tz, datetime.combine(rule.dtstart, start_time)).replace(microsecond=0)
+
+
+def _until(rule, dt_tz, start_time):
+    if rule.freq_type == rule.UNTIL:
+        return localize(dt_tz, datetime.combine(rule.until_date, start_time))
+    return None
+
+
+def _local_naive(simple, dt):
+    """
+    dt as a naive time with the utc offset of dtstart,
+    the offset dateutil gives to every occurrence
+    """
+    return dt.astimezone(pytz.utc).replace(tzinfo=None) + simple.dtstart.utcoffset()
+
+
+def _local_microseconds(simple, dt):
+    """
+    microseconds since epoch of dt as a naive time with the utc offset of dtstart
+    """
+    return (_local_naive(simple, dt) - datetime(1970, 1, 1)) // timedelta(microseconds=1)
+
+
+def expand_array(simple, after, before, inc=False):
+    """
+    occurrences of the SimpleRule between after and before (like rrule.between)
+    as a datetime64[us] array of naive times at the utc offset of dtstart
+    """
+    dtstart = simple.dtstart
+    time_of_day = (dtstart.hour * 3600 + dtstart.minute * 60 + dtstart.second) * SECOND
+    base = simple.base * DAY + time_of_day
+    period = simple.period * DAY
+    width = len(simple.offsets)
+    offsets = np.array(simple.offsets, dtype=np.int64) * DAY
+
+    low = _local_microseconds(simple, after)
+    high = _local_microseconds(simple, before)
+    until = None if simple.until is None else _local_microseconds(simple, simple.until)
+    first = max(0, (low - base - int(offsets[-1])) // period)
+    end = high if until is None else min(high, until)
+    last = (end - base) // period
+    if simple.count is not None:
+        last = min(last, (simple.count + simple.skipped) // width)
+    if last < first:
+        return np.empty(0, dtype='datetime64[us]')
+
+    periods = np.arange(first, last + 1, dtype=np.int64)
+    values = (base + periods[:, None] * period + offsets[None, :]).ravel()
+    index = (periods[:, None] * width + np.arange(width)[None, :]).ravel() - simple.skipped
+    mask = index >= 0
+    if simple.count is not None:
+        mask &= index < simple.count
+    if until is not None:
+        mask &= values <= until
+    if inc:
+        mask &= (values >= low) & (values <= high)
+    else:
+        mask &= (values > low) & (values < high)
+    return values[mask].astype('datetime64[us]')
+
+
+def to_datetimes(values, tzinfo):
+    """
+    aware datetimes of a datetime64 array returned by expand_array
+    """
+    return [dt.replace(tzinfo=tzinfo) for dt in values.tolist()]
+
+
+def expand_rule(rule, dt_tz, start_time, after, before, inc=False):
+    """
+    list of the occurrences of the rule between after and before, the same
+    list of rrule.between(), with numpy for simple rules and dateutil otherwise
+    """
+    simple = simple_rule(rule, dt_tz, start_time) if np is not None else None
+    if simple is None:
+        return rule.build_dateutil_rule(dt_tz, start_time).between(after, before, inc=inc)
+    return to_datetimes(expand_array(simple, after, before, inc), simple.dtstart.tzinfo)
+
+
+def last_occurrence(simple):
+    """
+    aware datetime of the last occurrence (until when it isn't an occurrence itself),
+    None if the rule never ends
+    """
+    last = simple.until
+    if simple.count is not None:
+        k, i = divmod(simple.count - 1 + simple.skipped, len(simple.offsets))
+        day = _period_start(simple, k) + timedelta(days=simple.offsets[i])
+        value = datetime.combine(day, simple.dtstart.time()).replace(tzinfo=simple.dtstart.tzinfo)
+        last = value if last is None else min(last, value)
+    return last
+
+
+def never(simple):
+    """
+    SimpleRule without occurrences
+    """
+    return simple._replace(count=0)
+
+
+def intersect(a, b, max_period=3660):
+    """
+    SimpleRule of the occurrences (the same instants) of both DAYS rules, in the
+    timezone of a. the period of the result is the lcm of both periods,
+    None when it's longer than max_period days or any rule is by month
+    """
+    if a.unit != DAYS or b.unit != DAYS:
+        return None
+    # the instants can only match when both times of day are a whole number of days apart
+    shift = _local_naive(a, b.dtstart) - datetime.combine(b.dtstart.date(), a.dtstart.time())
+    if shift % timedelta(days=1):
+        return never(a)
+    shift = shift // timedelta(days=1)
+    period = a.period * b.period // gcd(a.period, b.period)
+    if period > max_period:
+        return None
+    a_offsets = set(a.offsets)
+    b_offsets = set(b.offsets)
+    offsets = tuple(
+        r for r in range(period)
+        if r % a.period in a_offsets and (r + a.base - b.base - shift) % b.period in b_offsets
+    )
+    if not offsets:
+        return never(a)
+    start = max((a.dtstart.date() - EPOCH).days, (b.dtstart.date() - EPOCH).days + shift)
+    base = a.base + (start - a.base) // period * period
+    ends = [end for end in (last_occurrence(a), last_occurrence(b)) if end is not None]
+    dtstart = datetime.combine(EPOCH + timedelta(days=start), a.dtstart.time()).replace(tzinfo=a.dtstart.tzinfo)
+    skipped = sum(1 for offset in offsets if base + offset < start)
+    return SimpleRule(dtstart, DAYS, base, period, offsets, skipped, None, min(ends) if ends else None)
+
+
+def _period_start(simple, k):
+    if simple.unit == DAYS:
+        return EPOCH + timedelta(days=simple.base + k * simple.period)
+    year, month = divmod(simple.base + k * simple.period, 12)
+    return date(year, month + 1, 1)
+
+
+def _period_index(simple, day):
+    """
+    index of the last period starting on or before day, negative before dtstart
+    """
+    if simple.unit == DAYS:
+        return ((day - EPOCH).days - simple.base) // simple.period
+    return (day.year * 12 + day.month - 1 - simple.base) // simple.period
+
+
+def _raw_count(simple, limit, inclusive):
+    """
+    number of occurrences (without count and until) before the naive limit
+    """
+    k = _period_index(simple, limit.date())
+    if k < 0:
+        return 0
+    start = _period_start(simple, k)
+    time_of_day = simple.dtstart.time()
+    within = 0
+    for offset in simple.offsets:
+        value = datetime.combine(start + timedelta(days=offset), time_of_day)
+        if value < limit or (inclusive and value == limit):
+            within += 1
+    return max(0, k * len(simple.offsets) + within - simple.skipped)
+
+
+def count_upto(simple, dt, inclusive=True):
+    """
+    number of occurrences before dt (or equal to dt if inclusive),
+    computed with arithmetic, without walking from dtstart
+    """
+    total = _raw_count(simple, _local_naive(simple, dt), inclusive)
+    if simple.until is not None:
+        total = min(total, _raw_count(simple, _local_naive(simple, simple.until), True))
+    if simple.count is not None:
+        total = min(total, simple.count)
+    return total
+
+
+def count_between(simple, after, before, inc=False):
+    """
+    number of occurrences of rrule.between(after, before, inc)
+    """
+    if inc:
+        total = count_upto(simple, before) - count_upto(simple, after, inclusive=False)
+    else:
+        total = count_upto(simple, before, inclusive=False) - count_upto(simple, after)
+    return max(0, total)
+
+
+def count_upto_array(simple, limits):
+    """
+    count_upto(simple, limit, inclusive=False) of every limit of an int64 array
+    of utc microseconds since epoch, needs numpy
+    """
+    dtstart = simple.dtstart
+    time_of_day = (dtstart.hour * 3600 + dtstart.minute * 60 + dtstart.second) * SECOND
+    local = limits + dtstart.utcoffset() // timedelta(microseconds=1)
+    offsets = time_of_day + np.array(simple.offsets, dtype=np.int64) * DAY
+    if simple.unit == DAYS:
+        period = simple.period * DAY
+        # occurrences base + k * period + offset < limit for k >= 0, of every offset
+        totals = np.maximum(0, -((simple.base * DAY + offsets[None, :] - local[:, None]) // period)).sum(axis=1)
+    else:
+        months = local.astype('datetime64[us]').astype('datetime64[M]').astype(np.int64)
+        month_start = months.astype('datetime64[M]').astype('datetime64[us]').astype(np.int64)
+        elapsed = months + 1970 * 12 - simple.base
+        # every occurrence of the periods started in the previous months, and
+        # the ones before the limit when a period starts in the month of the limit
+        totals = np.maximum(0, (elapsed - 1) // simple.period + 1) * len(simple.offsets)
+        within = (month_start[:, None] + offsets[None, :] < local[:, None]).sum(axis=1)
+        totals += np.where((elapsed >= 0) & (elapsed % simple.period == 0), within, 0)
+    totals = np.maximum(0, totals - simple.skipped)
+    if simple.until is not None:
+        totals = np.minimum(totals, count_upto(simple, simple.until))
+    if simple.count is not None:
+        totals = np.minimum(totals, simple.count)
+    return totals
+
+
+def contains(simple, dt):
+    """
+    True if dt is an occurrence, like dt in rrule
+    """
+    value = _local_naive(simple, dt)
+    if value.time() != simple.dtstart.time() or value < simple.dtstart.replace(tzinfo=None):
+        return False
+    k = _period_index(simple, value.date())
+    offset = (value.date() - _period_start(simple, k)).days
+    if offset not in simple.offsets:
+        return False
+    # the number of occurrences up to dt includes dt itself
+    return count_upto(simple, dt) > count_upto(simple, dt, inclusive=False)
+
+
+def rule_contains(rule, dt_tz, start_time, dt):
+    """
+    dt in rrule of the rule, with arithmetic for the simple shapes
+    """
+    simple = simple_rule(rule, dt_tz, start_time, monthly=True)
+    if simple is None:
+        return dt in rule.build_dateutil_rule(dt_tz, start_time)
+    return contains(simple, dt)
@@ -5,6 +5,7 @@ from django.utils.translation import gettext_lazy as _
 # from crispy_forms.helper import FormHelper
 from django_select2.forms import Select2MultipleWidget
 from .models import Recurrence, Rule
+from .validators import missing_fields
 
 
 class HTML5DateInput(forms.DateInput):
@@ -171,18 +172,8 @@ class BaseRuleFormSet(BaseModelFormSet):
         for form in self.forms:
             if self.can_delete and self._should_delete_form(form):
                 continue
-            freq = form.cleaned_data.get('freq')
-            mode = form.cleaned_data.get('year_month_mode', None)
             freq_type = form.cleaned_data.get('freq_type', None)
-            if freq == Rule.YEARLY or freq == Rule.MONTHLY:
-                if mode == RuleForm.BY_DATE:
-                    self.required_field(['bymonthday'], form)
-                elif mode == RuleForm.BY_DAY:
-                    self.required_field(['byweekday'], form)
-                else:
-                    self.required_field(['year_month_mode'], form)
-            elif freq == Rule.WEEKLY:
-                self.required_field(['byweekday'], form)
+            self.required_field(missing_fields(form.cleaned_data), form)
 
             # if freq_type == Rule.OCCURRENCES:
             #     self.required_field(["count"], form)
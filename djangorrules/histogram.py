@@ -0,0 +1,151 @@
+"""
+number of occurrences per day, week or month of many recurrences
+
+the simple rules (see fastpath.simple_rule) are counted with arithmetic at every
+bucket edge (with numpy when it's installed), several rules and the exrules are combined with inclusion-exclusion:
+
+    |(R1 | R2) - X| = |R1| + |R2| - |R1 & R2| - |R1 & X| - |R2 & X| + |R1 & R2 & X|
+
+where every intersection is a SimpleRule too (see fastpath.intersect), the dates
+are added or subtracted one by one. any other recurrence is expanded
+"""
+from array import array
+from bisect import bisect_right
+from datetime import date, datetime, time, timedelta
+from itertools import combinations
+
+import pytz
+from django.utils import timezone
+
+from . import fastpath
+from .timezones import get_timezone, localize
+
+DAY = 'day'
+WEEK = 'week'
+MONTH = 'month'
+BUCKETS = (DAY, WEEK, MONTH)
+# inclusion-exclusion needs 2 ** rules - 1 terms, larger recurrences are expanded
+MAX_RULES = 4
+EPOCH = pytz.utc.localize(datetime(1970, 1, 1))
+
+
+def _next_edge(day, bucket, start):
+    if bucket == DAY:
+        return day + timedelta(days=1)
+    if bucket == WEEK:
+        return day + timedelta(days=7 - (day - start).days % 7)
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def bucket_edges(start, end, bucket=DAY):
+    """
+    dates where the buckets between start and end (excluded) begin, plus end.
+    the weeks begin on the weekday of start and the months on the 1st,
+    the first and the last bucket can be shorter
+    """
+    if bucket not in BUCKETS:
+        raise ValueError(f'bucket must be one of {", ".join(BUCKETS)}')
+    edges = [start]
+    while edges[-1] < end:
+        edges.append(min(end, _next_edge(edges[-1], bucket, start)))
+    return edges
+
+
+def signed_terms(rules, exrules):
+    """
+    (sign, SimpleRule) terms whose signed counts add up to the count of the rules
+    minus the exrules, None when an intersection can't be computed
+    """
+    terms = []
+    for size in range(1, len(rules) + 1):
+        for included in combinations(rules, size):
+            for excluded_size in range(len(exrules) + 1):
+                for excluded in combinations(exrules, excluded_size):
+                    term = included[0]
+                    for other in included[1:] + excluded:
+                        term = fastpath.intersect(term, other)
+                        if term is None:
+                            return None
+                    terms.append((-1 if (size + excluded_size) % 2 == 0 else 1, term))
+    return terms
+
+
+def _simple_rules(recurrence, dt_tz):
+    rules = []
+    exrules = []
+    for rule in recurrence.rules.all():
+        simple = fastpath.simple_rule(rule, dt_tz, recurrence.start_time, monthly=True)
+        if simple is None:
+            return None
+        (exrules if rule.exclude else rules).append(simple)
+    if len(rules) + len(exrules) > MAX_RULES:
+        return None
+    return rules, exrules
+
+
+def _term_counts(term, edges, limits):
+    if limits is not None:
+        return fastpath.np.diff(fastpath.count_upto_array(term, limits))
+    totals = [fastpath.count_upto(term, edge, inclusive=False) for edge in edges]
+    return [current - previous for previous, current in zip(totals, totals[1:])]
+
+
+def add_counts(recurrence, edges, counts, limits=None):
+    """
+    add the occurrences of the recurrence between the first and the last of the
+    aware datetimes edges (excluded) to the counts of the buckets between them,
+    limits are the edges as an int64 array of utc microseconds when numpy is used
+    """
+    dt_tz = recurrence.get_timezone()
+    simple = _simple_rules(recurrence, dt_tz)
+    terms = signed_terms(*simple) if simple is not None else None
+    if terms is None:
+        for dt in recurrence.to_dateutil_ruleset().between(edges[0], edges[-1], inc=True):
+            if dt < edges[-1]:
+                counts[bisect_right(edges, dt) - 1] += 1
+        return
+
+    for sign, term in terms:
+        if limits is not None:
+            counts += sign * fastpath.np.asarray(_term_counts(term, edges, limits), dtype='int64')
+            continue
+        for i, count in enumerate(_term_counts(term, edges, limits)):
+            counts[i] += sign * count
+
+    rules, exrules = simple
+    included = set()
+    excluded = set()
+    for day in recurrence.r_dates.all():
+        (excluded if day.exclude else included).add(recurrence.localize_date(day.naive_dt))
+    for dt in included | excluded:
+        if not edges[0] <= dt < edges[-1]:
+            continue
+        in_rules = any(fastpath.contains(rule, dt) for rule in rules)
+        in_exrules = any(fastpath.contains(rule, dt) for rule in exrules)
+        if dt in excluded and in_rules and not in_exrules:
+            # counted by the rules
+            counts[bisect_right(edges, dt) - 1] -= 1
+        elif dt not in excluded and not in_rules and not in_exrules:
+            counts[bisect_right(edges, dt) - 1] += 1
+
+
+def histogram(recurrences, start, end, bucket=DAY, tz=None):
+    """
+    array with the number of occurrences of the recurrences per bucket between the
+    dates start and end (excluded) in tz (a name or a tzinfo, the current timezone by default)
+    """
+    if tz is None:
+        tz = timezone.get_current_timezone()
+    elif isinstance(tz, str):
+        tz = get_timezone(tz)
+    edges = [localize(tz, datetime.combine(day, time())) for day in bucket_edges(start, end, bucket)]
+    if fastpath.np is None:
+        counts = array('q', [0]) * (len(edges) - 1)
+        limits = None
+    else:
+        counts = fastpath.np.zeros(len(edges) - 1, dtype='int64')
+        limits = fastpath.np.array([(edge - EPOCH) // timedelta(microseconds=1) for edge in edges], dtype='int64')
+    if len(edges) > 1:
+        for recurrence in recurrences:
+            add_counts(recurrence, edges, counts, limits)
+    return counts if limits is None else array('q', counts.tobytes())
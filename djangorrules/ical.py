@@ -0,0 +1,129 @@
+"""
+compact RFC 5545 text of a recurrence
+
+every rule of a recurrence has its own start date, so each RRULE/EXRULE line
+is preceded by the DTSTART it applies to:
+
+    DTSTART;TZID=America/La_Paz:20200101T100000
+    RRULE:FREQ=WEEKLY;INTERVAL=1;WKST=MO;COUNT=10;BYDAY=MO,WE
+    RDATE;TZID=America/La_Paz:20200105T100000
+    EXDATE;TZID=America/La_Paz:20200108T100000
+
+from_ical() only needs the text, so the rruleset can be built without the ORM
+"""
+from datetime import datetime
+from functools import lru_cache
+
+import pytz
+from dateutil.rrule import rruleset, rrulestr
+
+from .timezones import get_timezone, localize
+from .utils import copy_ruleset
+
+DATETIME_FORMAT = '%Y%m%dT%H%M%S'
+FREQ_NAMES = ('YEARLY', 'MONTHLY', 'WEEKLY', 'DAILY')
+WEEKDAY_NAMES = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+
+
+def rule_to_ical(rule, tzname, start_time):
+    """
+    DTSTART and RRULE (or EXRULE) lines of a Rule
+    """
+    kwargs = rule.compiled_kwargs
+    parts = [
+        f'FREQ={FREQ_NAMES[rule.freq]}',
+        f'INTERVAL={rule.interval}',
+        f'WKST={WEEKDAY_NAMES[rule.wkst]}',
+    ]
+    if rule.count:
+        parts.append(f'COUNT={rule.count}')
+    if rule.freq_type == rule.UNTIL and rule.until_date:
+        until = localize(get_timezone(tzname), datetime.combine(rule.until_date, start_time))
+        parts.append(f"UNTIL={until.astimezone(pytz.utc).strftime(DATETIME_FORMAT)}Z")
+    if kwargs['bymonth']:
+        parts.append(f"BYMONTH={','.join(map(str, kwargs['bymonth']))}")
+    if kwargs['bymonthday']:
+        parts.append(f"BYMONTHDAY={','.join(map(str, kwargs['bymonthday']))}")
+    if rule.byweekday:
+        parts.append(f"BYDAY={','.join(rule.byweekday)}")
+    if kwargs['bysetpos']:
+        parts.append(f"BYSETPOS={','.join(map(str, kwargs['bysetpos']))}")
+    dtstart = datetime.combine(rule.dtstart, start_time).strftime(DATETIME_FORMAT)
+    return [
+        f'DTSTART;TZID={tzname}:{dtstart}',
+        f"{'EXRULE' if rule.exclude else 'RRULE'}:{';'.join(parts)}",
+    ]
+
+
+def recurrence_to_ical(tzname, start_time, rules, r_dates):
+    lines = []
+    for rule in rules:
+        lines.extend(rule_to_ical(rule, tzname, start_time))
+    for day in r_dates:
+        dt = datetime.combine(day.naive_dt, start_time).strftime(DATETIME_FORMAT)
+        lines.append(f"{'EXDATE' if day.exclude else 'RDATE'};TZID={tzname}:{dt}")
+    return '\n'.join(lines)
+
+
+def _parse_datetime(params, value):
+    naive = datetime.strptime(value.rstrip('Z'), DATETIME_FORMAT)
+    if value.endswith('Z'):
+        return pytz.utc.localize(naive)
+    for param in params:
+        name, _, tzname = param.partition('=')
+        if name == 'TZID':
+            return localize(get_timezone(tzname), naive)
+    return naive
+
+
+@lru_cache(maxsize=1024)
+def _parse(text):
+    rule_set = rruleset()
+    dtstart = None
+    for line in text.splitlines():
+        if not line:
+            continue
+        head, _, value = line.partition(':')
+        name, *params = head.split(';')
+        if name == 'DTSTART':
+            dtstart = _parse_datetime(params, value)
+        elif name == 'RRULE':
+            rule_set.rrule(rrulestr(value, dtstart=dtstart))
+        elif name == 'EXRULE':
+            rule_set.exrule(rrulestr(value, dtstart=dtstart))
+        elif name == 'RDATE':
+            for item in value.split(','):
+                rule_set.rdate(_parse_datetime(params, item))
+        elif name == 'EXDATE':
+            for item in value.split(','):
+                rule_set.exdate(_parse_datetime(params, item))
+        else:
+            raise ValueError(f'unsupported property {name}')
+    return rule_set
+
+
+def from_ical(text, cache=False):
+    """
+    rruleset of a text written by recurrence_to_ical(),
+    the parsed rulesets are cached by text
+    """
+    return copy_ruleset(_parse(text), cache)
+
+
+def occurrences_to_vcalendar(occurrences, dtstamp):
+    """
+    yield the lines of a VCALENDAR with a VEVENT for every (recurrence_id, datetime)
+    pair, the times are written in UTC
+    """
+    stamp = dtstamp.astimezone(pytz.utc).strftime(DATETIME_FORMAT)
+    yield 'BEGIN:VCALENDAR'
+    yield 'VERSION:2.0'
+    yield 'PRODID:-//djangorrules//occurrences//EN'
+    for pk, dt in occurrences:
+        start = dt.astimezone(pytz.utc).strftime(DATETIME_FORMAT)
+        yield 'BEGIN:VEVENT'
+        yield f'UID:{pk}-{start}Z@djangorrules'
+        yield f'DTSTAMP:{stamp}Z'
+        yield f'DTSTART:{start}Z'
+        yield 'END:VEVENT'
+    yield 'END:VCALENDAR'
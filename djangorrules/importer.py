@@ -0,0 +1,275 @@
+"""
+bulk import of recurrences with their rules and dates
+
+every row is a dict like:
+
+    {
+        'timezone': 'America/La_Paz',
+        'start_time': '10:00',
+        'rules': [
+            'DTSTART:20200101\\nRRULE:FREQ=WEEKLY;BYDAY=MO,WE;COUNT=10',
+            {'freq': Rule.MONTHLY, 'dtstart': '2020-01-01', 'year_month_mode': Rule.BY_DATE, 'bymonthday': ['1']},
+        ],
+        'r_dates': ['2020-01-05', {'naive_dt': '2020-01-08', 'exclude': True}],
+    }
+
+a rule is an RRULE (or EXRULE) line preceded by its DTSTART line, as written by
+djangorrules.ical, or a dict of Rule fields. a DTSTART with a time or a TZID must
+agree with the start_time and the timezone of the row. the rules are validated like
+the forms (clean_fields() and clean()), the fields derived by save() are computed
+in python and the valid rows are inserted with bulk_create, save() and sync()
+never run
+"""
+from datetime import datetime, timedelta
+
+import pytz
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from .batch import expand_spec
+from .conf import app_settings
+from .ical import FREQ_NAMES, WEEKDAY_NAMES
+from .materialize import retention_start
+from .models import Occurrence, Recurrence, RDate, Rule
+from .timezones import get_timezone, localize
+from .validators import MULTIPLE_FIELDS
+
+# RRULE properties supported by Rule and the field they are stored in
+RRULE_FIELDS = {
+    'FREQ': 'freq',
+    'INTERVAL': 'interval',
+    'WKST': 'wkst',
+    'COUNT': 'count',
+    'UNTIL': 'until_date',
+    'BYMONTH': 'bymonth',
+    'BYMONTHDAY': 'bymonthday',
+    'BYDAY': 'byweekday',
+    'BYSETPOS': 'bysetpos',
+}
+
+
+def _parse_until(value, tz, start_time):
+    """
+    until_date of an UNTIL value, the last day whose occurrence at start_time
+    is not after UNTIL when it has a time
+    """
+    if 'T' not in value:
+        return datetime.strptime(value, '%Y%m%d').date()
+    dt = datetime.strptime(value.rstrip('Z'), '%Y%m%dT%H%M%S')
+    if value.endswith('Z'):
+        # UNTIL is written in utc by rule_to_ical, until_date is the local date
+        until = pytz.utc.localize(dt)
+        day = until.astimezone(tz).date()
+        if start_time is not None and localize(tz, datetime.combine(day, start_time)) > until:
+            day -= timedelta(days=1)
+        return day
+    if start_time is not None and dt.time() < start_time:
+        return dt.date() - timedelta(days=1)
+    return dt.date()
+
+
+def _convert(key, item, convert):
+    try:
+        return convert(item)
+    except (KeyError, ValueError):
+        raise ValueError(f'unsupported {key} {item}')
+
+
+def _parse_dtstart(params, value, tz, start_time):
+    if 'T' not in value:
+        return _convert('DTSTART', value, lambda item: datetime.strptime(item, '%Y%m%d').date())
+    dt = _convert('DTSTART', value, lambda item: datetime.strptime(item.rstrip('Z'), '%Y%m%dT%H%M%S'))
+    for param in params:
+        name, sep, tzname = param.partition('=')
+        if name.upper() == 'TZID' and _convert('TZID', tzname, get_timezone) is not tz:
+            raise ValueError(f'DTSTART timezone {tzname} is not the timezone of the recurrence')
+    if value.endswith('Z'):
+        dt = pytz.utc.localize(dt).astimezone(tz).replace(tzinfo=None)
+    if start_time is not None and dt.time() != start_time:
+        raise ValueError(f'DTSTART time {dt.time()} is not the start time of the recurrence')
+    return dt.date()
+
+
+def parse_rrule(text, tz, start_time=None):
+    """
+    Rule fields of a DTSTART and RRULE (or EXRULE) text, raise ValueError on an unknown
+    or unsupported property or value, or a DTSTART with a timezone other than tz or a time
+    other than start_time (the recurrence keeps them, not the rules)
+    """
+    fields = {'interval': 1}
+    for line in text.strip().splitlines():
+        name, sep, value = line.strip().partition(':')
+        name, *params = name.split(';')
+        name = name.upper()
+        if name == 'DTSTART':
+            fields['dtstart'] = _parse_dtstart(params, value, tz, start_time)
+            continue
+        if name not in ('RRULE', 'EXRULE'):
+            raise ValueError(f'unsupported line {name}')
+        fields['exclude'] = name == 'EXRULE'
+        for part in value.split(';'):
+            key, sep, item = part.partition('=')
+            key = key.upper()
+            if key not in RRULE_FIELDS:
+                raise ValueError(f'unsupported property {key}')
+            if key == 'FREQ':
+                fields['freq'] = _convert(key, item, lambda item: FREQ_NAMES.index(item.upper()))
+            elif key == 'WKST':
+                fields['wkst'] = _convert(key, item, lambda item: WEEKDAY_NAMES.index(item.upper()))
+            elif key == 'UNTIL':
+                fields['until_date'] = _convert(key, item, lambda item: _parse_until(item, tz, start_time))
+            elif key == 'BYDAY':
+                fields['byweekday'] = [day.lstrip('+').upper() for day in item.split(',')]
+            elif RRULE_FIELDS[key] in MULTIPLE_FIELDS:
+                fields[RRULE_FIELDS[key]] = item.split(',')
+            else:
+                fields[RRULE_FIELDS[key]] = _convert(key, item, int)
+    if 'freq' not in fields:
+        raise ValueError('FREQ is required')
+    if 'dtstart' not in fields:
+        raise ValueError('DTSTART is required')
+    if fields['freq'] in (Rule.YEARLY, Rule.MONTHLY):
+        fields['year_month_mode'] = Rule.BY_DAY if fields.get('byweekday') else Rule.BY_DATE
+    return fields
+
+
+def _rule_fields(value, tz, start_time):
+    if isinstance(value, str):
+        fields = parse_rrule(value, tz, start_time)
+    else:
+        fields = dict(value)
+        fields.setdefault('interval', 1)
+    for name in MULTIPLE_FIELDS:
+        if fields.get(name):
+            fields[name] = [str(item) for item in fields[name]]
+    if 'freq_type' not in fields:
+        if fields.get('count'):
+            fields['freq_type'] = Rule.COUNT
+        elif fields.get('until_date'):
+            fields['freq_type'] = Rule.UNTIL
+        else:
+            fields['freq_type'] = Rule.FOREVER
+    return fields
+
+
+def _messages(prefix, error):
+    if isinstance(error, ValidationError) and hasattr(error, 'error_dict'):
+        return [
+            f'{prefix}.{field}: {message}' if field != '__all__' else f'{prefix}: {message}'
+            for field, messages in error.message_dict.items() for message in messages
+        ]
+    if isinstance(error, ValidationError):
+        return [f'{prefix}: {message}' for message in error.messages]
+    return [f'{prefix}: {error}']
+
+
+def _exclude(model, *names):
+    # the derived fields are computed after the validation
+    return [field.name for field in model._meta.fields if not field.editable] + list(names)
+
+
+def build_row(row):
+    """
+    unsaved (recurrence, rules, r_dates) of a row with every field computed,
+    raise ValidationError with the messages of the row
+    """
+    errors = []
+    recurrence = Recurrence(timezone=row.get('timezone'), start_time=row.get('start_time'))
+    try:
+        recurrence.clean_fields(exclude=_exclude(Recurrence))
+    except ValidationError as error:
+        raise ValidationError(_messages('recurrence', error))
+    tz = get_timezone(recurrence.timezone)
+    for name in ('rules', 'r_dates'):
+        if not isinstance(row.get(name) or [], (list, tuple)):
+            errors.append(f'{name}: must be a list')
+    if errors:
+        raise ValidationError(errors)
+
+    rules = []
+    for i, value in enumerate(row.get('rules') or []):
+        try:
+            rule = Rule(**_rule_fields(value, tz, recurrence.start_time))
+            rule.clean_fields(exclude=_exclude(Rule, 'recurrence'))
+            rule.clean()
+        except (ValidationError, ValueError, TypeError) as error:
+            errors.extend(_messages(f'rules[{i}]', error))
+            continue
+        rule.set_derived_fields(tz, recurrence.start_time)
+        rules.append(rule)
+
+    r_dates = []
+    for i, value in enumerate(row.get('r_dates') or []):
+        try:
+            r_date = RDate(**value) if isinstance(value, dict) else RDate(naive_dt=value)
+            r_date.clean_fields(exclude=_exclude(RDate, 'recurrence'))
+            if not r_date.naive_dt:
+                raise ValidationError({'naive_dt': _('this field is required')})
+        except (ValidationError, TypeError) as error:
+            errors.extend(_messages(f'r_dates[{i}]', error))
+            continue
+        r_date.utc_dt = recurrence.localize_date(r_date.naive_dt)
+        r_dates.append(r_date)
+
+    if errors:
+        raise ValidationError(errors)
+    recurrence.ical_text = recurrence.to_ical(rules, r_dates)
+    recurrence.next_occurrence_utc = Recurrence.from_ical(recurrence.ical_text).after(timezone.now(), inc=True)
+    recurrence.version = 1
+    return recurrence, rules, r_dates
+
+
+def _insert(built, batch_size, until):
+    recurrences = [recurrence for recurrence, rules, r_dates in built]
+    for recurrence in recurrences:
+        recurrence.expanded_until = until
+    if connection.features.can_return_rows_from_bulk_insert:
+        Recurrence.objects.bulk_create(recurrences, batch_size=batch_size)
+    else:
+        # the pks of bulk_create are needed by the rules and dates
+        for recurrence in recurrences:
+            recurrence.save()
+    rules = []
+    r_dates = []
+    occurrences = []
+    since = retention_start()
+    for recurrence, recurrence_rules, recurrence_dates in built:
+        for item in recurrence_rules + recurrence_dates:
+            item.recurrence = recurrence
+        rules.extend(recurrence_rules)
+        r_dates.extend(recurrence_dates)
+        if until is not None:
+            occurrences.extend(
+                Occurrence(recurrence=recurrence, utc_start=dt, local_date=local_date, is_exception=is_exception)
+                for pk, dt, local_date, is_exception
+                in expand_spec((recurrence.pk, recurrence.ical_text), until, since)
+            )
+    Rule.objects.bulk_create(rules, batch_size=batch_size)
+    RDate.objects.bulk_create(r_dates, batch_size=batch_size)
+    Occurrence.objects.bulk_create(occurrences, batch_size=batch_size)
+
+
+def import_recurrences(rows, batch_size=1000, skip_invalid=True, occurrences=True):
+    """
+    validate and insert the rows in one transaction, returns (recurrences, errors)
+    with the created recurrences in row order and {row index: [messages]}.
+    with skip_invalid=False nothing is inserted when a row has errors,
+    occurrences=False leaves the Occurrence table to expand_recurrences()
+    """
+    built = []
+    errors = {}
+    for index, row in enumerate(rows):
+        try:
+            built.append(build_row(row))
+        except ValidationError as error:
+            errors[index] = error.messages
+    if errors and not skip_invalid:
+        return [], errors
+
+    until = timezone.now() + timedelta(days=app_settings.OCCURRENCE_HORIZON) if occurrences else None
+    with transaction.atomic():
+        for start in range(0, len(built), batch_size):
+            _insert(built[start:start + batch_size], batch_size, until)
+    return [recurrence for recurrence, rules, r_dates in built], errors
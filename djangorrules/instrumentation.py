@@ -0,0 +1,183 @@
+"""
+opt-in instrumentation of ruleset building and expansion
+
+every measured call sends the ruleset_measured signal and passes the same
+metrics to the backend named by DJANGORRULES_INSTRUMENTATION_BACKEND:
+
+    operation     'to_dateutil_ruleset', 'to_dateutil_rule', 'refresh_occurrences'...
+    recurrence_id pk of the recurrence, None for querysets
+    seconds       wall time
+    queries       queries run during the call
+    rules         rules and exrules of the ruleset (when known)
+    r_dates       rdates and exdates of the ruleset (when known)
+    occurrences   occurrences generated (expansion calls only)
+
+nothing is measured while the signal has no receivers and no backend is set
+"""
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.signals import setting_changed
+from django.db import connection
+from django.dispatch import Signal, receiver
+from django.utils.module_loading import import_string
+
+from .conf import app_settings
+
+ruleset_measured = Signal()
+
+_backend = []
+
+
+def get_backend():
+    """
+    instance of DJANGORRULES_INSTRUMENTATION_BACKEND created with
+    DJANGORRULES_INSTRUMENTATION_OPTIONS, None when instrumentation is off
+    """
+    if not _backend:
+        path = app_settings.INSTRUMENTATION_BACKEND
+        _backend.append(import_string(path)(**app_settings.INSTRUMENTATION_OPTIONS) if path else None)
+    return _backend[0]
+
+
+@receiver(setting_changed)
+def _reset_backend(setting, **kwargs):
+    if setting in ('DJANGORRULES_INSTRUMENTATION_BACKEND', 'DJANGORRULES_INSTRUMENTATION_OPTIONS'):
+        _backend.clear()
+
+
+def is_enabled():
+    return ruleset_measured.has_listeners() or get_backend() is not None
+
+
+class _QueryCounter:
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_queries():
+    """
+    yield a counter of the queries run in the block
+    """
+    counter = _QueryCounter()
+    with connection.execute_wrapper(counter):
+        yield counter
+
+
+def emit(operation, recurrence_id, seconds, queries, rules=None, r_dates=None, occurrences=None):
+    """
+    send the metrics of a call to the signal receivers and the backend
+    """
+    metrics = {
+        'operation': operation,
+        'recurrence_id': recurrence_id,
+        'seconds': seconds,
+        'queries': queries,
+        'rules': rules,
+        'r_dates': r_dates,
+        'occurrences': occurrences,
+    }
+    ruleset_measured.send(sender=None, **metrics)
+    backend = get_backend()
+    if backend is not None:
+        backend.record(**metrics)
+
+
+@contextmanager
+def measure(operation, recurrence_id=None):
+    """
+    measure the block, the caller can fill rules, r_dates and occurrences
+    of the yielded dict, the dict is yielded even when instrumentation is off.
+    don't yield from a generator inside the block, the query counter must
+    be removed before any other code runs queries
+    """
+    metrics = {'rules': None, 'r_dates': None, 'occurrences': None}
+    if not is_enabled():
+        yield metrics
+        return
+    start = time.perf_counter()
+    with count_queries() as counter:
+        yield metrics
+    emit(operation, recurrence_id, time.perf_counter() - start, counter.count, **metrics)
+
+
+def ruleset_size(rule_set):
+    """
+    (rules, dates) of a dateutil rruleset
+    """
+    return len(rule_set._rrule) + len(rule_set._exrule), len(rule_set._rdate) + len(rule_set._exdate)
+
+
+class InMemoryBackend:
+    """
+    totals by operation and the slowest calls, read them with stats()
+    """
+
+    def __init__(self, slowest=20):
+        self.slowest = slowest
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.operations = {}
+            self.slowest_calls = []
+
+    def record(self, operation, seconds, queries, **metrics):
+        with self._lock:
+            totals = self.operations.setdefault(operation, {
+                'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'queries': 0, 'occurrences': 0,
+            })
+            totals['calls'] += 1
+            totals['seconds'] += seconds
+            totals['max_seconds'] = max(totals['max_seconds'], seconds)
+            totals['queries'] += queries
+            totals['occurrences'] += metrics.get('occurrences') or 0
+            call = dict(metrics, operation=operation, seconds=seconds, queries=queries)
+            self.slowest_calls.append(call)
+            self.slowest_calls.sort(key=lambda item: item['seconds'], reverse=True)
+            del self.slowest_calls[self.slowest:]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'operations': {name: dict(totals) for name, totals in self.operations.items()},
+                'slowest': list(self.slowest_calls),
+            }
+
+
+class StatsdBackend:
+    """
+    send the metrics to a StatsD server over UDP, e.g.
+
+        djangorrules.to_dateutil_ruleset.time:1.52|ms
+        djangorrules.to_dateutil_ruleset.queries:2|c
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='djangorrules'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def format(self, operation, seconds, queries, **metrics):
+        name = f'{self.prefix}.{operation}'
+        lines = [f'{name}.time:{seconds * 1000:.3f}|ms', f'{name}.queries:{queries}|c']
+        for key in ('rules', 'r_dates', 'occurrences'):
+            if metrics.get(key) is not None:
+                lines.append(f'{name}.{key}:{metrics[key]}|h')
+        return '\n'.join(lines)
+
+    def record(self, **metrics):
+        try:
+            self.socket.sendto(self.format(**metrics).encode(), self.address)
+        except OSError:
+            # the metrics must never break the request
+            pass
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from djangorrules.models import Recurrence
+
+
+class Command(BaseCommand):
+    help = "move the next occurrence of the due recurrences after now"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        updated = Recurrence.objects.advance_due(batch_size=options['batch_size'])
+        self.stdout.write(f"{updated} recurrence(s) advanced")
@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from djangorrules import benchmark
+
+
+class Command(BaseCommand):
+    help = "time ruleset construction, expansion, rule_to_text and validation on seeded recurrences"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recurrences', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--only', nargs='*', help="names of the operations to run")
+        parser.add_argument('--output', help="write the results to this JSON file")
+        parser.add_argument('--compare', help="JSON file of a previous run, fails on regressions")
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help="slowdown allowed by --compare, 0.2 is 20%%")
+
+    def handle(self, *args, **options):
+        # the seeded recurrences are rolled back
+        with transaction.atomic():
+            recurrences = benchmark.seed(options['recurrences'])
+            report = benchmark.run(recurrences, options['repeat'], options['only'])
+            transaction.set_rollback(True)
+
+        for name, result in report['results'].items():
+            self.stdout.write(f"{name:<30} best {result['best'] * 1000:10.2f} ms  "
+                              f"mean {result['mean'] * 1000:10.2f} ms  queries {result['queries']}")
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                regressions = benchmark.compare(json.load(baseline), report, options['threshold'])
+            for name, old, new, ratio in regressions:
+                self.stderr.write(f"{name}: {old['best'] * 1000:.2f} ms -> {new['best'] * 1000:.2f} ms "
+                                  f"({ratio:.2f}x), queries {old['queries']} -> {new['queries']}")
+            if regressions:
+                raise CommandError(f"{len(regressions)} regression(s)")
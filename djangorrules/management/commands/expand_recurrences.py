@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from djangorrules.batch import expand_recurrences
+from djangorrules.models import Recurrence
+
+
+class Command(BaseCommand):
+    help = "rebuild the occurrences of every recurrence in parallel processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help="worker processes, one per core by default, 0 runs in this process")
+        parser.add_argument('--horizon', type=int, default=None,
+                            help="days after now, DJANGORRULES_OCCURRENCE_HORIZON by default")
+        parser.add_argument('--chunk-size', type=int, default=500, help="recurrences sent to a worker at once")
+        parser.add_argument('--batch-size', type=int, default=1000, help="bulk_create batch size")
+        parser.add_argument('--ids', type=int, nargs='*', help="only these recurrences")
+
+    def handle(self, *args, **options):
+        queryset = Recurrence.objects.all()
+        if options['ids']:
+            queryset = queryset.filter(pk__in=options['ids'])
+        recurrences, occurrences = expand_recurrences(
+            queryset,
+            workers=options['workers'],
+            horizon=options['horizon'],
+            chunk_size=options['chunk_size'],
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write(f"{occurrences} occurrence(s) of {recurrences} recurrence(s) written")
@@ -0,0 +1,36 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from djangorrules.importer import import_recurrences
+
+
+class Command(BaseCommand):
+    help = "import recurrences from a JSON list of rows, see djangorrules.importer"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="JSON file, - reads stdin")
+        parser.add_argument('--batch-size', type=int, default=1000, help="bulk_create batch size")
+        parser.add_argument('--all-or-nothing', action='store_true', help="import nothing when a row has errors")
+        parser.add_argument('--no-occurrences', action='store_true',
+                            help="don't materialize the occurrences, run expand_recurrences later")
+
+    def handle(self, *args, **options):
+        if options['path'] == '-':
+            rows = json.load(sys.stdin)
+        else:
+            with open(options['path']) as file:
+                rows = json.load(file)
+        recurrences, errors = import_recurrences(
+            rows,
+            batch_size=options['batch_size'],
+            skip_invalid=not options['all_or_nothing'],
+            occurrences=not options['no_occurrences'],
+        )
+        for index, messages in errors.items():
+            for message in messages:
+                self.stderr.write(f"row {index}: {message}")
+        self.stdout.write(f"{len(recurrences)} recurrence(s) imported, {len(errors)} row(s) with errors")
+        if errors and options['all_or_nothing']:
+            raise CommandError("nothing was imported")
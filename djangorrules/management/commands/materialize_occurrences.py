@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from djangorrules.materialize import extend_horizon
+
+
+class Command(BaseCommand):
+    help = "extend the materialized occurrences of the recurrences behind now + horizon, resumable"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horizon', type=int, default=None,
+                            help="days after now, DJANGORRULES_OCCURRENCE_HORIZON by default")
+        parser.add_argument('--slack', type=float, default=1,
+                            help="days a recurrence can be behind the horizon before it's extended")
+        parser.add_argument('--chunk-size', type=int, default=100, help="recurrences per transaction")
+        parser.add_argument('--rate', type=float, default=None, help="max recurrences per second")
+        parser.add_argument('--batch-size', type=int, default=1000, help="bulk_create batch size")
+        parser.add_argument('--forever', action='store_true', help="keep running, a pass every --interval")
+        parser.add_argument('--interval', type=float, default=60, help="seconds between passes with --forever")
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                recurrences = occurrences = 0
+                for chunk_recurrences, chunk_occurrences in extend_horizon(
+                        horizon=options['horizon'],
+                        slack=options['slack'],
+                        chunk_size=options['chunk_size'],
+                        rate=options['rate'],
+                        batch_size=options['batch_size']):
+                    recurrences += chunk_recurrences
+                    occurrences += chunk_occurrences
+                self.stdout.write(f"{occurrences} occurrence(s) of {recurrences} recurrence(s) materialized")
+                if not options['forever']:
+                    return
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            # every finished chunk is committed, the next run resumes from the recurrences still behind
+            self.stdout.write("interrupted")
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from djangorrules.models import Recurrence
+
+
+class Command(BaseCommand):
+    help = "localize again the utc fields and the occurrences, run it after DJANGORRULES_USE_ZONEINFO changed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ids', type=int, nargs='*', help="only these recurrences")
+
+    def handle(self, *args, **options):
+        queryset = Recurrence.objects.all()
+        if options['ids']:
+            queryset = queryset.filter(pk__in=options['ids'])
+        count = 0
+        for recurrence in queryset.with_ruleset_data().iterator(chunk_size=100):
+            recurrence.recompute()
+            count += 1
+        self.stdout.write(f"{count} recurrence(s) recomputed")
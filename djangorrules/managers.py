@@ -0,0 +1,255 @@
+import asyncio
+import heapq
+import math
+import time
+from datetime import datetime, timedelta
+from itertools import islice, repeat
+
+import pytz
+
+from django.db import models
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import instrumentation
+from .conf import app_settings
+from .conflicts import find_conflicts, window
+from .executor import run_in_pool
+from .histogram import bucket_edges, histogram
+from .utils import date_bits, widen_masks, xbetween
+
+
+class RecurrenceQuerySet(models.QuerySet):
+
+    def with_ruleset_data(self):
+        """
+        prefetch the rules and dates, to_dateutil_ruleset() of the
+        resulting recurrences doesn't run any query
+        """
+        return self.prefetch_related('rules', 'r_dates')
+
+    def active_between(self, after, before):
+        """
+        recurrences that may have occurrences between after and before,
+        pruned in SQL with the stored start and last occurrence of the rules
+        and the dates, the result can contain recurrences without occurrences
+        in the range (e.g. excluded by an exrule) but never misses one
+        """
+        rule_model = self.model.rules.rel.related_model
+        r_date_model = self.model.r_dates.rel.related_model
+        rules = rule_model.objects.filter(exclude=False, utc_dtstart__lte=before).filter(
+            Q(utc_last_occurrence__isnull=True) | Q(utc_last_occurrence__gte=after)
+        )
+        r_dates = r_date_model.objects.filter(exclude=False, utc_dt__gte=after, utc_dt__lte=before)
+        return self.filter(
+            Q(pk__in=rules.values('recurrence_id')) | Q(pk__in=r_dates.values('recurrence_id'))
+        )
+
+    def may_fire_on(self, day):
+        """
+        recurrences with an inclusive rule that may fire on the given date, see RuleQuerySet.may_fire_on
+        """
+        rule_model = self.model.rules.rel.related_model
+        rules = rule_model.objects.filter(exclude=False).may_fire_on(day)
+        return self.filter(pk__in=rules.values('recurrence_id'))
+
+    def due(self, now=None, within=None):
+        """
+        recurrences with the next occurrence before now + within
+        """
+        limit = now or timezone.now()
+        if within:
+            limit += within
+        return self.filter(next_occurrence_utc__lte=limit)
+
+    def advance_due(self, now=None, batch_size=1000):
+        """
+        move the next occurrence of every due recurrence after now,
+        returns the number of updated recurrences
+        """
+        now = now or timezone.now()
+        batch = []
+        updated = 0
+        for recurrence in self.due(now).iterator():
+            recurrence.next_occurrence_utc = recurrence.to_dateutil_ruleset().after(now)
+            batch.append(recurrence)
+            if len(batch) == batch_size:
+                self.model.objects.bulk_update(batch, ['next_occurrence_utc'])
+                updated += len(batch)
+                batch = []
+        if batch:
+            self.model.objects.bulk_update(batch, ['next_occurrence_utc'])
+            updated += len(batch)
+        return updated
+
+    def occurrences_between(self, after, before, inc=False):
+        """
+        yield (recurrence_id, datetime) pairs with the occurrences of every
+        recurrence between after and before sorted by datetime, the recurrences
+        are pruned with active_between() and rules and dates are prefetched
+        so the queries don't grow with the number of recurrences
+        """
+        # the query counter only wraps the building, the caller can run
+        # queries between two occurrences. the time includes the caller's
+        enabled = instrumentation.is_enabled()
+        start = time.perf_counter()
+        streams = []
+        with instrumentation.count_queries() as counter:
+            for recurrence in self.active_between(after, before).with_ruleset_data():
+                rule_set = recurrence.to_dateutil_ruleset()
+                streams.append(zip(xbetween(rule_set, after, before, inc), repeat(recurrence.pk)))
+        occurrences = 0
+        try:
+            for dt, pk in heapq.merge(*streams):
+                occurrences += 1
+                yield pk, dt
+        finally:
+            if enabled:
+                instrumentation.emit('occurrences_between', None, time.perf_counter() - start, counter.count,
+                                     occurrences=occurrences)
+
+    def expand_compact(self, after, before, inc=False, use_numpy=None):
+        """
+        yield the CompactOccurrences (see djangorrules.compact) of every
+        recurrence with occurrences between after and before
+        """
+        for recurrence in self.active_between(after, before).with_ruleset_data().iterator(chunk_size=500):
+            yield recurrence.expand_compact(after, before, inc, use_numpy)
+
+    def histogram(self, start, end, bucket='day', tz=None):
+        """
+        array('q') with the number of occurrences per day, week or month between the dates
+        start and end (excluded) in tz, the simple rules are counted without expanding them,
+        see djangorrules.histogram
+        """
+        # the recurrences are pruned with a day of margin, the buckets do the exact cut
+        edges = bucket_edges(start, end, bucket)
+        after = pytz.utc.localize(datetime.combine(edges[0], datetime.min.time())) - timedelta(days=1)
+        before = pytz.utc.localize(datetime.combine(edges[-1], datetime.min.time())) + timedelta(days=1)
+        recurrences = self.active_between(after, before).with_ruleset_data()
+        return histogram(recurrences.iterator(chunk_size=500), start, end, bucket, tz)
+
+    def conflicts_with(self, recurrence, after=None, before=None, limit=10, duration=None, timeout=None):
+        """
+        first limit (recurrence_id, datetime) pairs with the occurrences of the recurrence
+        between after (now by default) and before (after + DJANGORRULES_OCCURRENCE_HORIZON days)
+        that start with, or overlap for duration, an occurrence of these recurrences.
+        the candidates are pruned by their windows and masks in SQL and by the periods of
+        their rules before expanding them, see djangorrules.conflicts. raises
+        conflicts.ConflictsTimeout when timeout seconds are over before every candidate was checked
+        """
+        after = after or timezone.now()
+        before = before or after + timedelta(days=app_settings.OCCURRENCE_HORIZON)
+        recurrence = self.model.objects.with_ruleset_data().get(pk=recurrence.pk)
+        bounds = window(recurrence, after, before)
+        if bounds is None:
+            return []
+        after, before = bounds
+        margin = duration or timedelta()
+
+        rule_model = self.model.rules.rel.related_model
+        r_date_model = self.model.r_dates.rel.related_model
+        rules = rule_model.objects.filter(exclude=False, utc_dtstart__lte=before + margin).filter(
+            Q(utc_last_occurrence__isnull=True) | Q(utc_last_occurrence__gte=after - margin)
+        )
+        # the local dates of the same instant are up to 2 days apart, plus the duration
+        days = 2 + math.ceil(margin / timedelta(days=1))
+        if days < 28:
+            month_mask = weekday_mask = 0
+            for rule in recurrence.rules.all():
+                if not rule.exclude:
+                    month_mask |= rule.month_mask
+                    weekday_mask |= rule.weekday_mask
+            for day in recurrence.r_dates.all():
+                if not day.exclude:
+                    month_bit, weekday_bit, monthday_bits = date_bits(day.naive_dt)
+                    month_mask |= month_bit
+                    weekday_mask |= weekday_bit
+            month_mask, weekday_mask = widen_masks(month_mask, weekday_mask, days)
+            rules = rules.annotate(
+                month_match=F('month_mask').bitand(month_mask),
+                weekday_match=F('weekday_mask').bitand(weekday_mask),
+            ).filter(month_match__gt=0, weekday_match__gt=0)
+        r_dates = r_date_model.objects.filter(exclude=False, utc_dt__gte=after - margin, utc_dt__lte=before + margin)
+        candidates = self.exclude(pk=recurrence.pk).filter(
+            Q(pk__in=rules.values('recurrence_id')) | Q(pk__in=r_dates.values('recurrence_id'))
+        ).with_ruleset_data()
+        return find_conflicts(recurrence, candidates.iterator(chunk_size=500), after, before, limit, duration,
+                              timeout)
+
+    async def aoccurrences_between(self, after, before, inc=False, chunk_size=256):
+        """
+        async version of occurrences_between(), the recurrences are read with the
+        async ORM (Django 4.1+) and every recurrence is expanded lazily in chunks of
+        chunk_size occurrences in the bounded expansion pool (see djangorrules.executor),
+        the event loop only merges the chunks with a heap
+        """
+        recurrences = [recurrence async for recurrence in self.active_between(after, before).with_ruleset_data()]
+        expanded = [_aexpand(recurrence, after, before, inc, chunk_size) for recurrence in recurrences]
+        firsts = await asyncio.gather(*(_anext(occurrences) for occurrences in expanded))
+        heap = [(dt, recurrence.pk, i) for i, (recurrence, dt) in enumerate(zip(recurrences, firsts)) if dt is not None]
+        heapq.heapify(heap)
+        while heap:
+            dt, pk, i = heap[0]
+            yield pk, dt
+            dt = await _anext(expanded[i])
+            if dt is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (dt, pk, i))
+
+
+async def _aexpand(recurrence, after, before, inc, chunk_size):
+    """
+    yield the occurrences of the recurrence between after and before,
+    every chunk is expanded in the expansion pool
+    """
+    occurrences = await run_in_pool(lambda: xbetween(recurrence.to_dateutil_ruleset(), after, before, inc))
+    while True:
+        chunk = await run_in_pool(list, islice(occurrences, chunk_size))
+        for dt in chunk:
+            yield dt
+        if len(chunk) < chunk_size:
+            return
+
+
+async def _anext(occurrences):
+    try:
+        return await occurrences.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+class RuleQuerySet(models.QuerySet):
+
+    def may_fire_on(self, day):
+        """
+        rules that may have an occurrence on the given (local) date, checked in SQL
+        with the month, weekday and monthday bitmasks and the start and last occurrence
+        of the rules. interval and bysetpos are not checked so the result can contain
+        rules without an occurrence on that date but never misses one
+        """
+        month_bit, weekday_bit, monthday_bits = date_bits(day)
+        # the local date can be a day before or after the utc date
+        start = pytz.utc.localize(datetime.combine(day, datetime.min.time())) - timedelta(days=1)
+        return self.filter(
+            dtstart__lte=day,
+        ).filter(
+            Q(utc_last_occurrence__isnull=True) | Q(utc_last_occurrence__gte=start)
+        ).annotate(
+            month_match=F('month_mask').bitand(month_bit),
+            weekday_match=F('weekday_mask').bitand(weekday_bit),
+            monthday_match=F('monthday_mask').bitand(monthday_bits),
+        ).filter(month_match__gt=0, weekday_match__gt=0, monthday_match__gt=0)
+
+
+class OccurrenceQuerySet(models.QuerySet):
+
+    def between(self, after, before, inc=False):
+        """
+        occurrences starting between after and before, with inc == True
+        the limits are included like in rruleset.between
+        """
+        if inc:
+            return self.filter(utc_start__gte=after, utc_start__lte=before)
+        return self.filter(utc_start__gt=after, utc_start__lt=before)
@@ -0,0 +1,109 @@
+"""
+rolling horizon of the materialized occurrences
+
+every recurrence stores in expanded_until the datetime its occurrences are
+materialized up to. extend_horizon() walks the recurrences behind now + horizon
+in pk order and appends their occurrences after the watermark, the watermark is
+moved in the same transaction as the occurrences so an interrupted run just
+resumes with the recurrences still behind, see the materialize_occurrences command
+"""
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .conf import app_settings
+
+
+def retention_start(now=None):
+    """
+    datetime the rebuilt occurrences begin at, now - DJANGORRULES_OCCURRENCE_RETENTION days,
+    None when every occurrence since the start of the recurrence is kept
+    """
+    retention = app_settings.OCCURRENCE_RETENTION
+    if retention is None:
+        return None
+    return (now or timezone.now()) - timedelta(days=retention)
+
+
+def behind(queryset, until):
+    """
+    recurrences materialized up to a datetime before until
+    """
+    return queryset.filter(Q(expanded_until__isnull=True) | Q(expanded_until__lt=until))
+
+
+def new_occurrences(recurrence, until, since=None):
+    """
+    unsaved occurrences of the recurrence after its watermark up to until,
+    from since (see retention_start()) when it has no watermark
+    """
+    from .models import Occurrence
+
+    rule_set = recurrence.to_dateutil_ruleset()
+    r_dates = set(rule_set._rdate)
+    occurrences = []
+    if recurrence.expanded_until is not None:
+        dates = rule_set.xafter(recurrence.expanded_until)
+    else:
+        dates = rule_set if since is None else rule_set.xafter(since, inc=True)
+    for dt in dates:
+        if dt > until:
+            break
+        occurrences.append(Occurrence(recurrence=recurrence, utc_start=dt, local_date=dt.date(),
+                                      is_exception=dt in r_dates))
+    return occurrences
+
+
+def _extend_chunk(queryset, after_pk, chunk_size, until, batch_size):
+    from .models import Occurrence, Recurrence
+
+    since = retention_start()
+    with transaction.atomic():
+        # the rows are locked, a concurrent Recurrence.sync() waits and diffs up to the new watermark
+        recurrences = list(queryset.filter(pk__gt=after_pk).order_by('pk').select_for_update()
+                           .with_ruleset_data()[:chunk_size])
+        occurrences = []
+        rebuilt = []
+        for recurrence in recurrences:
+            if recurrence.expanded_until is None:
+                rebuilt.append(recurrence.pk)
+            occurrences.extend(new_occurrences(recurrence, until, since))
+            recurrence.expanded_until = until
+        stale = Occurrence.objects.filter(recurrence_id__in=rebuilt)
+        if since is not None:
+            # the occurrences before the retention window are kept, like refresh_occurrences()
+            stale = stale.filter(utc_start__gte=since)
+        stale.delete()
+        Occurrence.objects.bulk_create(occurrences, batch_size=batch_size)
+        Recurrence.objects.bulk_update(recurrences, ['expanded_until'], batch_size=batch_size)
+    return recurrences, len(occurrences)
+
+
+def extend_horizon(queryset=None, horizon=None, slack=1, chunk_size=100, rate=None, batch_size=1000):
+    """
+    extend the occurrences of the recurrences up to now + horizon days (by default
+    DJANGORRULES_OCCURRENCE_HORIZON), only the recurrences more than slack days behind
+    are processed. every chunk of chunk_size recurrences is written in its own transaction,
+    rate limits the recurrences per second. yields (recurrences, occurrences) per chunk
+    """
+    from .models import Recurrence
+
+    queryset = Recurrence.objects.all() if queryset is None else queryset
+    horizon = app_settings.OCCURRENCE_HORIZON if horizon is None else horizon
+    until = timezone.now() + timedelta(days=horizon)
+    queryset = behind(queryset, until - timedelta(days=slack))
+    started = time.monotonic()
+    processed = 0
+    after_pk = 0
+    while True:
+        recurrences, occurrences = _extend_chunk(queryset, after_pk, chunk_size, until, batch_size)
+        if not recurrences:
+            return
+        after_pk = recurrences[-1].pk
+        processed += len(recurrences)
+        yield len(recurrences), occurrences
+        if rate:
+            time.sleep(max(0.0, processed / rate - (time.monotonic() - started)))
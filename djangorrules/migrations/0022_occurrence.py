@@ -0,0 +1,35 @@
+# Generated by Django 4.1.13 on 2026-10-18 00:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangorrules', '0021_auto_20201209_1616'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Occurrence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('utc_start', models.DateTimeField()),
+                ('local_date', models.DateField()),
+                ('is_exception', models.BooleanField(default=False)),
+                ('recurrence', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occurrences', related_query_name='occurrence', to='djangorrules.recurrence')),
+            ],
+            options={
+                'ordering': ['utc_start'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='occurrence',
+            index=models.Index(fields=['utc_start', 'recurrence'], name='djangorrule_utc_sta_8ce552_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='occurrence',
+            index=models.Index(fields=['recurrence', 'utc_start'], name='djangorrule_recurre_3e2af8_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-18 01:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangorrules', '0022_occurrence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recurrence',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
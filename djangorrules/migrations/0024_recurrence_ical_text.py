@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-18 01:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangorrules', '0023_recurrence_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recurrence',
+            name='ical_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+    ]
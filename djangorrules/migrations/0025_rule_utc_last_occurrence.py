@@ -0,0 +1,30 @@
+# Generated by Django 4.1.13 on 2026-10-18 01:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangorrules', '0024_recurrence_ical_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rule',
+            name='utc_last_occurrence',
+            field=models.DateTimeField(blank=True, default=None, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='rdate',
+            index=models.Index(fields=['exclude', 'utc_dt'], name='djangorrule_exclude_ba58bf_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rule',
+            index=models.Index(fields=['exclude', 'utc_dtstart', 'utc_last_occurrence'], name='djangorrule_exclude_244672_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rule',
+            index=models.Index(fields=['exclude', 'utc_last_occurrence', 'utc_dtstart'], name='djangorrule_exclude_2e0dda_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-18 01:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangorrules', '0025_rule_utc_last_occurrence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recurrence',
+            name='next_occurrence_utc',
+            field=models.DateTimeField(blank=True, db_index=True, default=None, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-18 01:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangorrules', '0026_recurrence_next_occurrence_utc'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rule',
+            name='compiled',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+    ]
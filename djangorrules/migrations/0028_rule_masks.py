@@ -0,0 +1,28 @@
+# Generated by Django 4.1.13 on 2026-10-18 01:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangorrules', '0027_rule_compiled'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rule',
+            name='month_mask',
+            field=models.PositiveSmallIntegerField(default=4095, editable=False),
+        ),
+        migrations.AddField(
+            model_name='rule',
+            name='monthday_mask',
+            field=models.BigIntegerField(default=4611686018427387903, editable=False),
+        ),
+        migrations.AddField(
+            model_name='rule',
+            name='weekday_mask',
+            field=models.PositiveSmallIntegerField(default=127, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-18 01:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangorrules', '0028_rule_masks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recurrence',
+            name='expanded_until',
+            field=models.DateTimeField(blank=True, default=None, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.1.13 on 2026-10-18 01:38
+
+from django.db import migrations
+import djangorrules.validators
+import multiselectfield.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangorrules', '0030_recurrence_expanded_until'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='rule',
+            name='bysetpos',
+            field=multiselectfield.db.fields.MultiSelectField(blank=True, choices=[(1, 'first occurrence'), (2, 'second occurrence'), (3, 'third occurrence'), (4, 'fourth occurrence'), (-1, 'last occurrence'), (-2, 'the penultimate occurrence'), (-3, 'antepenultimate occurrence')], default=None, max_length=16, null=True, validators=[djangorrules.validators.validate_bysetpos]),
+        ),
+    ]
@@ -0,0 +1,29 @@
+from datetime import datetime
+
+import pytz
+from django.db import migrations
+
+
+def localize_utc_dt(apps, schema):
+    """
+    utc_dt was stored as the naive date at the start time before the
+    dates were localized in the recurrence timezone
+    """
+    RDate = apps.get_model('djangorrules', 'rdate')
+    r_dates = list(RDate.objects.select_related('recurrence'))
+    for r_date in r_dates:
+        recurrence = r_date.recurrence
+        dt_tz = pytz.timezone(recurrence.timezone)
+        r_date.utc_dt = dt_tz.localize(datetime.combine(r_date.naive_dt, recurrence.start_time))
+    RDate.objects.bulk_update(r_dates, ['utc_dt'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangorrules', '0031_alter_rule_bysetpos'),
+    ]
+
+    operations = [
+        migrations.RunPython(localize_utc_dt, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,106 @@
+from datetime import datetime
+
+import pytz
+from dateutil.rrule import rruleset, rrulestr
+from django.db import migrations
+from django.utils import timezone
+
+# the format of djangorrules.ical, copied so the migration doesn't depend on the current code
+DATETIME_FORMAT = '%Y%m%dT%H%M%S'
+FREQ_NAMES = ('YEARLY', 'MONTHLY', 'WEEKLY', 'DAILY')
+WEEKDAY_NAMES = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+UNTIL = 'until'
+
+
+def to_ical(recurrence):
+    """
+    ical_text of a historical recurrence, like djangorrules.ical.recurrence_to_ical
+    """
+    dt_tz = pytz.timezone(recurrence.timezone)
+    start_time = recurrence.start_time
+    lines = []
+    for rule in recurrence.rules.all():
+        parts = [f'FREQ={FREQ_NAMES[rule.freq]}', f'INTERVAL={rule.interval}', f'WKST={WEEKDAY_NAMES[rule.wkst]}']
+        if rule.count:
+            parts.append(f'COUNT={rule.count}')
+        if rule.freq_type == UNTIL and rule.until_date:
+            until = dt_tz.localize(datetime.combine(rule.until_date, start_time))
+            parts.append(f"UNTIL={until.astimezone(pytz.utc).strftime(DATETIME_FORMAT)}Z")
+        for name, values in (('BYMONTH', rule.bymonth), ('BYMONTHDAY', rule.bymonthday)):
+            if values:
+                parts.append(f"{name}={','.join(str(int(value)) for value in values)}")
+        if rule.byweekday:
+            parts.append(f"BYDAY={','.join(rule.byweekday)}")
+        if rule.bysetpos:
+            parts.append(f"BYSETPOS={','.join(str(int(value)) for value in rule.bysetpos)}")
+        dtstart = datetime.combine(rule.dtstart, start_time).strftime(DATETIME_FORMAT)
+        lines.append(f'DTSTART;TZID={recurrence.timezone}:{dtstart}')
+        lines.append(f"{'EXRULE' if rule.exclude else 'RRULE'}:{';'.join(parts)}")
+    for day in recurrence.r_dates.all():
+        dt = datetime.combine(day.naive_dt, start_time).strftime(DATETIME_FORMAT)
+        lines.append(f"{'EXDATE' if day.exclude else 'RDATE'};TZID={recurrence.timezone}:{dt}")
+    return '\n'.join(lines)
+
+
+def parse_datetime(params, value):
+    naive = datetime.strptime(value.rstrip('Z'), DATETIME_FORMAT)
+    if value.endswith('Z'):
+        return pytz.utc.localize(naive)
+    for param in params:
+        name, _, tzname = param.partition('=')
+        if name == 'TZID':
+            return pytz.timezone(tzname).localize(naive)
+    return naive
+
+
+def from_ical(text):
+    """
+    rruleset of an ical_text, like djangorrules.ical.from_ical
+    """
+    rule_set = rruleset()
+    dtstart = None
+    for line in text.splitlines():
+        if not line:
+            continue
+        head, _, value = line.partition(':')
+        name, *params = head.split(';')
+        if name == 'DTSTART':
+            dtstart = parse_datetime(params, value)
+        elif name in ('RRULE', 'EXRULE'):
+            add = rule_set.rrule if name == 'RRULE' else rule_set.exrule
+            add(rrulestr(value, dtstart=dtstart))
+        else:
+            add = rule_set.rdate if name == 'RDATE' else rule_set.exdate
+            for item in value.split(','):
+                add(parse_datetime(params, item))
+    return rule_set
+
+
+def backfill(apps, schema):
+    """
+    ical_text and next_occurrence_utc of the recurrences saved before sync() kept them
+    """
+    Recurrence = apps.get_model('djangorrules', 'recurrence')
+    now = timezone.now()
+    recurrences = Recurrence.objects.filter(next_occurrence_utc__isnull=True).prefetch_related('rules', 'r_dates')
+    for recurrence in recurrences.iterator(chunk_size=500):
+        if not recurrence.ical_text:
+            recurrence.ical_text = to_ical(recurrence)
+        if not recurrence.ical_text:
+            continue
+        recurrence.next_occurrence_utc = from_ical(recurrence.ical_text).after(now, inc=True)
+        Recurrence.objects.filter(pk=recurrence.pk).update(
+            ical_text=recurrence.ical_text,
+            next_occurrence_utc=recurrence.next_occurrence_utc,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangorrules', '0032_localize_rdate_utc_dt'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+import json
+
+from django.db import migrations
+
+WEEKDAYS = {'MO': 0, 'TU': 1, 'WE': 2, 'TH': 3, 'FR': 4, 'SA': 5, 'SU': 6}
+
+
+def parse_byweekday(values):
+    """
+    [weekday, n] pairs of the byweekday strings, like Rule._parse_byweekday
+    """
+    pairs = []
+    for value in values:
+        n, code = value[:-2], value[-2:]
+        pairs.append([WEEKDAYS[code], int(n) if n else None])
+    return pairs
+
+
+def compile_rule(rule):
+    """
+    the JSON of Rule.compile() for a historical rule
+    """
+    return json.dumps({
+        'freq': rule.freq,
+        'interval': rule.interval,
+        'wkst': rule.wkst,
+        'count': rule.count or None,
+        'bymonth': [int(month) for month in rule.bymonth] if rule.bymonth else None,
+        'bymonthday': [int(day) for day in rule.bymonthday] if rule.bymonthday else None,
+        'byweekday': parse_byweekday(rule.byweekday) if rule.byweekday else None,
+        'bysetpos': [int(pos) for pos in rule.bysetpos] if rule.bysetpos else None,
+    }, separators=(',', ':'))
+
+
+def backfill(apps, schema):
+    """
+    compiled of the rules saved before the column was added
+    """
+    Rule = apps.get_model('djangorrules', 'rule')
+    rules = []
+    for rule in Rule.objects.filter(compiled='').iterator(chunk_size=500):
+        rule.compiled = compile_rule(rule)
+        rules.append(rule)
+        if len(rules) == 500:
+            Rule.objects.bulk_update(rules, ['compiled'])
+            rules = []
+    Rule.objects.bulk_update(rules, ['compiled'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangorrules', '0033_backfill_next_occurrence_utc'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
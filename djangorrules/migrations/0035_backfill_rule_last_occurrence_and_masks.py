@@ -0,0 +1,93 @@
+import json
+from collections import deque
+from datetime import datetime
+
+import pytz
+from dateutil.rrule import rrule, weekday
+from django.db import migrations
+from django.db.models import Q
+
+# the constants of Rule, copied so the migration doesn't depend on the current code
+YEARLY, MONTHLY, WEEKLY = 0, 1, 2
+UNTIL, COUNT = 'until', 'count'
+ALL_MONTHS = (1 << 12) - 1
+ALL_WEEKDAYS = (1 << 7) - 1
+ALL_MONTHDAYS = (1 << 62) - 1
+
+
+def monthday_bit(day):
+    return 1 << (day - 1) if day > 0 else 1 << (30 - day)
+
+
+def get_masks(rule, kwargs):
+    """
+    like Rule.get_masks()
+    """
+    bymonth, bymonthday, byweekday = kwargs['bymonth'], kwargs['bymonthday'], kwargs['byweekday']
+    fixed = not bymonthday and not byweekday
+    if rule.freq == YEARLY and fixed and not bymonth:
+        bymonth = [rule.dtstart.month]
+    if rule.freq in (YEARLY, MONTHLY) and fixed:
+        bymonthday = [rule.dtstart.day]
+    elif rule.freq == WEEKLY and fixed:
+        byweekday = [[rule.dtstart.weekday(), None]]
+
+    month_mask = sum(1 << (month - 1) for month in set(bymonth)) if bymonth else ALL_MONTHS
+    weekday_mask = sum(1 << day for day in {day for day, n in byweekday}) if byweekday else ALL_WEEKDAYS
+    monthday_mask = sum(monthday_bit(day) for day in set(bymonthday)) if bymonthday else ALL_MONTHDAYS
+    return month_mask, weekday_mask, monthday_mask
+
+
+def get_last_occurrence(rule, kwargs):
+    """
+    like Rule.get_last_occurrence() with the pytz timezone of the recurrence
+    """
+    recurrence = rule.recurrence
+    dt_tz = pytz.timezone(recurrence.timezone)
+    dtstart = dt_tz.localize(datetime.combine(rule.dtstart, recurrence.start_time))
+    if rule.freq_type == UNTIL and rule.until_date:
+        return dt_tz.localize(datetime.combine(rule.until_date, recurrence.start_time))
+    elif rule.freq_type == COUNT and rule.count:
+        byweekday = kwargs['byweekday']
+        occurrences = rrule(kwargs['freq'], dtstart=dtstart, interval=kwargs['interval'], wkst=kwargs['wkst'],
+                            count=kwargs['count'], bymonth=kwargs['bymonth'], bymonthday=kwargs['bymonthday'],
+                            bysetpos=kwargs['bysetpos'],
+                            byweekday=[weekday(day, n) for day, n in byweekday] if byweekday else None)
+        last = deque(occurrences, maxlen=1)
+        # a rule without occurrences never ends after its start
+        return last[0] if last else dtstart
+    return None
+
+
+def backfill(apps, schema):
+    """
+    utc_last_occurrence and the masks of the rules saved before the columns were added,
+    the rules are read with the compiled kwargs backfilled by 0034
+    """
+    Rule = apps.get_model('djangorrules', 'rule')
+    fields = ['utc_last_occurrence', 'month_mask', 'weekday_mask', 'monthday_mask']
+    missing = Rule.objects.filter(
+        Q(utc_last_occurrence__isnull=True, freq_type__in=[UNTIL, COUNT])
+        | Q(month_mask=ALL_MONTHS, weekday_mask=ALL_WEEKDAYS, monthday_mask=ALL_MONTHDAYS)
+    ).select_related('recurrence')
+    rules = []
+    for rule in missing.iterator(chunk_size=500):
+        kwargs = json.loads(rule.compiled)
+        rule.utc_last_occurrence = get_last_occurrence(rule, kwargs)
+        rule.month_mask, rule.weekday_mask, rule.monthday_mask = get_masks(rule, kwargs)
+        rules.append(rule)
+        if len(rules) == 500:
+            Rule.objects.bulk_update(rules, fields)
+            rules = []
+    Rule.objects.bulk_update(rules, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangorrules', '0034_backfill_rule_compiled'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
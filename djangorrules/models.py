@@ -1,16 +1,27 @@
-import re
-import pytz
-from datetime import datetime, time
+import json
+from datetime import datetime, time, timedelta
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.utils import dateformat, timezone
-from django.utils.translation import gettext_lazy as _, pgettext as _p
+from django.utils.translation import gettext_lazy as _
 
-from django.core.exceptions import ValidationError
 from multiselectfield import MultiSelectField
 from dateutil.rrule import weekday, rrule, rruleset, rrulestr
 
-from .utils import join_with_conjunction
+from . import compact, fastpath
+from .cache import ruleset_cache
+from .conf import app_settings
+from .diff import diff, occurrences_changed
+from .executor import run_in_pool
+from .instrumentation import measure, ruleset_size
+from .materialize import retention_start
+from .ical import from_ical, recurrence_to_ical
+from .managers import OccurrenceQuerySet, RecurrenceQuerySet, RuleQuerySet
+from .text import rule_text
+from .timezones import TimezoneChoices, get_timezone, localize
+from .utils import ALL_MONTHDAYS, ALL_MONTHS, ALL_WEEKDAYS, monthday_bit
+from .validators import rule_errors, rule_values, validate_bysetpos, weekday_pattern
 
 
 class Recurrence(models.Model):
@@ -66,11 +77,20 @@ class Recurrence(models.Model):
     # set a fixed time because all instances must have the same
     # hour time - otherwise the exclude rules not working correctly
     # TIME = time(hour=12, minute=0, second=0)
-    TIME_ZONE_LIST = [
-        (tz, tz) for tz in pytz.all_timezones
-    ]
+    TIME_ZONE_LIST = TimezoneChoices()
     start_time = models.TimeField()
     timezone = models.CharField(max_length=30, choices=TIME_ZONE_LIST)
+    # bumped every time the rules or dates change, see RulesetCache
+    version = models.PositiveIntegerField(default=0, editable=False)
+    # rules and dates as RFC 5545 text, rebuilt by sync()
+    ical_text = models.TextField(blank=True, default='', editable=False)
+    # None when the recurrence has no occurrences left, see RecurrenceQuerySet.due
+    next_occurrence_utc = models.DateTimeField(blank=True, null=True, default=None, editable=False,
+                                               db_index=True)
+    # the occurrences are materialized up to this datetime, see djangorrules.materialize
+    expanded_until = models.DateTimeField(blank=True, null=True, default=None, editable=False)
+
+    objects = RecurrenceQuerySet.as_manager()
 
     def __str__(self):
         return _("recurrence #%(pk)s timezone: %(timezone)s rules: %(rules)d rdates: %(dates)s") % {
@@ -80,34 +100,304 @@ class Recurrence(models.Model):
             'dates': self.r_dates.all().count()
         }
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        moved = not adding and Recurrence.objects.filter(pk=self.pk).exclude(
+            timezone=self.timezone, start_time=self.start_time).exists()
+        super().save(*args, **kwargs)
+        # a new recurrence has no rules or dates yet
+        if moved:
+            self.update_utc_fields()
+        if not adding:
+            self.sync()
+
+    def update_utc_fields(self):
+        """
+        localize again the utc fields of the rules and dates,
+        must be called after the timezone or the start time changed
+        """
+        dt_tz = self.get_timezone()
+        rules = list(self.rules.all())
+        for rule in rules:
+            rule.set_derived_fields(dt_tz, self.start_time)
+        Rule.objects.bulk_update(rules, ['utc_dtstart', 'utc_until', 'utc_last_occurrence'])
+        r_dates = list(self.r_dates.all())
+        for day in r_dates:
+            day.utc_dt = localize(dt_tz, datetime.combine(day.naive_dt, self.start_time))
+        RDate.objects.bulk_update(r_dates, ['utc_dt'])
+
+    def recompute(self):
+        """
+        localize again the utc fields, next_occurrence_utc and the materialized occurrences,
+        must be called after DJANGORRULES_USE_ZONEINFO changed (the ical_text stays the same),
+        see the recompute_recurrences command
+        """
+        self.update_utc_fields()
+        self.next_occurrence_utc = self.to_dateutil_ruleset().after(timezone.now(), inc=True)
+        Recurrence.objects.filter(pk=self.pk).update(next_occurrence_utc=self.next_occurrence_utc)
+        self.refresh_occurrences(until=self.expanded_until)
+
+    def sync(self):
+        """
+        update the data derived from rules and dates
+        must be called after a rule or a date of this recurrence was saved or deleted
+        """
+        with transaction.atomic():
+            # the stored text, this instance can be older than the saved rule or date. the row is
+            # locked so extend_horizon() can't move the watermark before the changes are applied
+            old_text, expanded_until = Recurrence.objects.filter(pk=self.pk).select_for_update().values_list(
+                'ical_text', 'expanded_until').first() or ('', None)
+            self.ical_text = self.to_ical()
+            self.next_occurrence_utc = self.from_ical(self.ical_text).after(timezone.now(), inc=True)
+            Recurrence.objects.filter(pk=self.pk).update(
+                version=F('version') + 1,
+                ical_text=self.ical_text,
+                next_occurrence_utc=self.next_occurrence_utc
+            )
+            self.refresh_from_db(fields=['version'])
+            if old_text and expanded_until:
+                self.apply_changes(old_text, until=expanded_until)
+            else:
+                # saved before ical_text existed or without rules and dates yet
+                self.refresh_occurrences()
+
+    def apply_changes(self, old_text, until=None):
+        """
+        update the materialized occurrences with the difference between old_text and ical_text
+        (see djangorrules.diff) up to until, by default expanded_until, sends occurrences_changed
+        when an occurrence was added or removed
+        """
+        until = until or self.expanded_until or timezone.now() + timedelta(days=app_settings.OCCURRENCE_HORIZON)
+        with measure('apply_changes', self.pk) as metrics:
+            delta = diff(old_text, self.ical_text, until, since=retention_start())
+            with transaction.atomic():
+                removed = [dt for dt, is_exception in delta.removed]
+                for start in range(0, len(removed), 500):
+                    self.occurrences.filter(utc_start__in=removed[start:start + 500]).delete()
+                Occurrence.objects.bulk_create([
+                    Occurrence(recurrence=self, utc_start=dt, local_date=dt.date(), is_exception=is_exception)
+                    for dt, is_exception in delta.added
+                ])
+            metrics['occurrences'] = len(delta.added) + len(delta.removed)
+        if delta.added or delta.removed:
+            occurrences_changed.send(
+                sender=Recurrence, recurrence=self, start=delta.start, end=delta.end,
+                added=delta.added, removed=delta.removed
+            )
+        return delta
+
+    def advance(self, now=None):
+        """
+        move next_occurrence_utc to the first occurrence after now
+        or after the current next occurrence, call it once the occurrence was fired
+        """
+        now = now or timezone.now()
+        if self.next_occurrence_utc and self.next_occurrence_utc > now:
+            now = self.next_occurrence_utc
+        self.next_occurrence_utc = self.to_dateutil_ruleset().after(now)
+        Recurrence.objects.filter(pk=self.pk).update(next_occurrence_utc=self.next_occurrence_utc)
+        return self.next_occurrence_utc
+
+    def count_between(self, after, before, inc=False):
+        """
+        number of occurrences between after and before, the same of
+        len(to_dateutil_ruleset().between(after, before, inc)).
+        a single DAILY, WEEKLY or MONTHLY by date rule is counted with arithmetic
+        (see fastpath.count_between) and the dates are checked one by one,
+        any other recurrence is expanded
+        """
+        rules = list(self.rules.all())
+        r_dates = list(self.r_dates.all())
+        recurrence_tz = self.get_timezone()
+        simple = None
+        if len(rules) == 1 and not rules[0].exclude:
+            simple = fastpath.simple_rule(rules[0], recurrence_tz, self.start_time, monthly=True)
+        if simple is None:
+            return len(self.to_dateutil_ruleset().between(after, before, inc=inc))
+
+        def in_range(dt):
+            return after <= dt <= before if inc else after < dt < before
+
+        included = {self.localize_date(day.naive_dt) for day in r_dates if not day.exclude}
+        excluded = {self.localize_date(day.naive_dt) for day in r_dates if day.exclude}
+        total = fastpath.count_between(simple, after, before, inc)
+        total += sum(1 for dt in included - excluded if in_range(dt) and not fastpath.contains(simple, dt))
+        total -= sum(1 for dt in excluded if in_range(dt) and fastpath.contains(simple, dt))
+        return total
+
+    def contains(self, dt):
+        """
+        True if dt is an occurrence of the recurrence, like dt in rruleset,
+        each rule is checked with arithmetic when it has a simple shape
+        """
+        rules = list(self.rules.all())
+        r_dates = list(self.r_dates.all())
+        recurrence_tz = self.get_timezone()
+
+        def in_rule(rule):
+            return fastpath.rule_contains(rule, recurrence_tz, self.start_time, dt)
+
+        if any(self.localize_date(day.naive_dt) == dt for day in r_dates if day.exclude):
+            return False
+        if any(in_rule(rule) for rule in rules if rule.exclude):
+            return False
+        if any(self.localize_date(day.naive_dt) == dt for day in r_dates if not day.exclude):
+            return True
+        return any(in_rule(rule) for rule in rules if not rule.exclude)
+
+    def expand_compact(self, after, before, inc=False, use_numpy=None):
+        """
+        occurrences between after and before as epoch seconds with the timezone, see djangorrules.compact
+        """
+        return compact.expand(self, after, before, inc, use_numpy)
+
+    def refresh_occurrences(self, until=None):
+        """
+        rebuild the materialized occurrences of this recurrence up to until,
+        by default now + DJANGORRULES_OCCURRENCE_HORIZON days, from now -
+        DJANGORRULES_OCCURRENCE_RETENTION days (the older ones are kept as they are)
+        """
+        if until is None:
+            until = timezone.now() + timedelta(days=app_settings.OCCURRENCE_HORIZON)
+        since = retention_start()
+        with measure('refresh_occurrences', self.pk) as metrics:
+            rule_set = self.to_dateutil_ruleset()
+            r_dates = {self.localize_date(day.naive_dt) for day in self.r_dates.filter(exclude=False)}
+            occurrences = []
+            for dt in rule_set if since is None else rule_set.xafter(since, inc=True):
+                if dt > until:
+                    break
+                occurrences.append(Occurrence(
+                    recurrence=self,
+                    utc_start=dt,
+                    local_date=dt.date(),
+                    is_exception=dt in r_dates
+                ))
+            with transaction.atomic():
+                stale = self.occurrences.all() if since is None else self.occurrences.filter(utc_start__gte=since)
+                stale.delete()
+                Occurrence.objects.bulk_create(occurrences)
+                Recurrence.objects.filter(pk=self.pk).update(expanded_until=until)
+            self.expanded_until = until
+            metrics['occurrences'] = len(occurrences)
+
     def to_dateutil_ruleset(self, cache=False):
         """
         get a dateutil rruleset object
         exdate method needs a datetime with same time part of dtstart
         because dtstart is the base for the recurrence
+
+        the compiled ruleset is cached by pk and version (see RulesetCache), on a miss
+        it's parsed from ical_text without queries, recurrences without ical_text
+        use the prefetched rules and dates when available
+        (see RecurrenceQuerySet.with_ruleset_data), otherwise runs 2 queries.
+        a held instance re-reads version and ical_text first (1 query) so a rule
+        saved after it was loaded is not missed, the instances of with_ruleset_data()
+        are used as the snapshot they were loaded with
+        """
+        if self.pk is not None and not self.has_ruleset_data():
+            self.set_stored_ical(Recurrence.objects.filter(pk=self.pk).values_list('version', 'ical_text').first())
+        return self._to_dateutil_ruleset(cache)
+
+    def _to_dateutil_ruleset(self, cache):
+        def build():
+            if self.ical_text:
+                return from_ical(self.ical_text, cache=cache)
+            return self.build_ruleset(self.rules.all(), self.r_dates.all(), cache=cache)
+
+        with measure('to_dateutil_ruleset', self.pk) as metrics:
+            if self.pk is None:
+                rule_set = build()
+            else:
+                rule_set = ruleset_cache.get_or_build(self, build, cache=cache)
+            metrics['rules'], metrics['r_dates'] = ruleset_size(rule_set)
+        return rule_set
+
+    def has_ruleset_data(self):
+        """
+        True if the rules and the dates were prefetched (see RecurrenceQuerySet.with_ruleset_data)
+        """
+        prefetched = getattr(self, '_prefetched_objects_cache', {})
+        return 'rules' in prefetched and 'r_dates' in prefetched
+
+    def set_stored_ical(self, values):
+        """
+        take the (version, ical_text) read from the database, None when the row is gone
+        """
+        if values is not None:
+            self.version, self.ical_text = values
+
+    async def aget_ruleset(self, cache=False):
+        """
+        async version of to_dateutil_ruleset(), the stored version and ical_text and
+        the rules and dates of a recurrence without ical_text are read with the async
+        ORM (Django 4.1+), the parsing and the building run in the expansion pool
+        (see djangorrules.executor)
+        """
+        if self.pk is not None and not self.has_ruleset_data():
+            self.set_stored_ical(
+                await Recurrence.objects.filter(pk=self.pk).values_list('version', 'ical_text').afirst()
+            )
+        if self.ical_text or self.pk is None:
+            return await run_in_pool(self._to_dateutil_ruleset, cache)
+        rules = [rule async for rule in self.rules.all()]
+        r_dates = [day async for day in self.r_dates.all()]
+
+        def build():
+            return self.build_ruleset(rules, r_dates, cache=cache)
+
+        return await run_in_pool(ruleset_cache.get_or_build, self, build, cache=cache)
+
+    def build_ruleset(self, rules, r_dates, cache=False):
+        """
+        build the rruleset from the given rules and dates of this recurrence,
+        the timezone and the start time are passed down to every rule
+        so no rule has to load its recurrence again
         """
-        recurrence_tz = pytz.timezone(self.timezone)
+        recurrence_tz = self.get_timezone()
         rule_set = rruleset(cache=cache)
-        rules = self.rules.all()
-        r_dates = self.r_dates.all()
-
-        if rules.exists():
-            for rule in rules:
-                dateutil_object = rule.to_dateutil_rule
-                if rule.exclude:
-                    rule_set.exrule(dateutil_object)
-                else:
-                    rule_set.rrule(dateutil_object)
-        if r_dates.exists():
-            for day in r_dates:
-                dt = datetime.combine(day.naive_dt, self.start_time)
-                dt = recurrence_tz.localize(dt)
-                if day.exclude:
-                    rule_set.exdate(dt)
-                else:
-                    rule_set.rdate(dt)
+        for rule in rules:
+            dateutil_object = rule.build_dateutil_rule(recurrence_tz, self.start_time)
+            if rule.exclude:
+                rule_set.exrule(dateutil_object)
+            else:
+                rule_set.rrule(dateutil_object)
+        for day in r_dates:
+            dt = localize(recurrence_tz, datetime.combine(day.naive_dt, self.start_time))
+            if day.exclude:
+                rule_set.exdate(dt)
+            else:
+                rule_set.rdate(dt)
         return rule_set
 
+    def to_ical(self, rules=None, r_dates=None):
+        """
+        RFC 5545 text of the rules and dates, see djangorrules.ical
+        """
+        rules = self.rules.all() if rules is None else rules
+        r_dates = self.r_dates.all() if r_dates is None else r_dates
+        return recurrence_to_ical(self.timezone, self.start_time, rules, r_dates)
+
+    @staticmethod
+    def from_ical(text, cache=False):
+        """
+        rruleset of a text returned by to_ical(), doesn't need the database
+        """
+        return from_ical(text, cache=cache)
+
+    def get_timezone(self):
+        """
+        tzinfo of the recurrence, from the shared registry (see djangorrules.timezones)
+        """
+        return get_timezone(self.timezone)
+
+    def localize_date(self, date):
+        """
+        aware datetime of the given date at the recurrence start time
+        """
+        dt = datetime.combine(date, self.start_time)
+        return localize(self.get_timezone(), dt)
+
 
 class Rule(models.Model):
     """
@@ -381,153 +671,90 @@ class Rule(models.Model):
     bymonthday = MultiSelectField(choices=ORDINAL_MONTHDAY, blank=True, null=True, default=None)
     byweekday = MultiSelectField(choices=CONSTANT_WEEKDAYS, blank=True, null=True, default=None, max_length=300)
     bysetpos = MultiSelectField(blank=True, null=True, default=None, choices=BYSETPOS_NTH,
-                                validators=[MinValueValidator(MIN_BYSETPOS), MaxValueValidator(MAX_BYSETPOS)])
+                                validators=[validate_bysetpos])
     freq_type = models.CharField(choices=FREQ_TYPE, max_length=30, default=FOREVER)
     count = models.PositiveIntegerField(blank=True, null=True, default=None, validators=[MinValueValidator(1)])
     until_date = models.DateField(blank=True, null=True, default=None)
     utc_until = models.DateTimeField(blank=True, null=True, default=None, editable=False)
+    # None when the rule repeats forever, see RecurrenceQuerySet.active_between
+    utc_last_occurrence = models.DateTimeField(blank=True, null=True, default=None, editable=False)
+    # normalized rrule kwargs as JSON, rebuilt by save(), see from_compiled()
+    compiled = models.TextField(blank=True, default='', editable=False)
+    # months, weekdays and monthdays where the rule may fire, see get_masks() and RuleQuerySet.may_fire_on
+    month_mask = models.PositiveSmallIntegerField(default=ALL_MONTHS, editable=False)
+    weekday_mask = models.PositiveSmallIntegerField(default=ALL_WEEKDAYS, editable=False)
+    monthday_mask = models.BigIntegerField(default=ALL_MONTHDAYS, editable=False)
     # naive_until_time = models.TimeField(blank=True, null=True, default=None)
     exclude = models.BooleanField(default=False)
 
+    objects = RuleQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['exclude', 'utc_dtstart', 'utc_last_occurrence']),
+            models.Index(fields=['exclude', 'utc_last_occurrence', 'utc_dtstart']),
+        ]
+
     def __str__(self):
         return self.rule_to_text(True)
 
     def clean(self):
-        byweekday = self.byweekday
-        freq = self.freq
-        check_pattern = self._get_byweekday_pattern
-        # patter regex with nth value e.g +1MO
-        pattern_weekday_with_nth = "^(?:[0-9]{1}|[-+][0-9]{1})?[AEOUMTHWSFR]{2}$"
-
-        if not self.year_month_mode and (freq == self.YEARLY or freq == self.MONTHLY):
-            raise ValidationError({'year_month_mode': _('mode field is required')}, code='mode_required')
-        elif self.year_month_mode and (freq != self.YEARLY and freq != self.MONTHLY):
-            raise ValidationError({'year_month_mode': _('mode field is unnecessary')}, code='mode_required')
-
-        if self.bymonthday and self.byweekday:
-            raise ValidationError(_('bymonth and byweekday fields are excluded from each other'),
-                                  code='bymonth_or_byweekday_forbidden')
-
-        if self.year_month_mode == self.BY_DATE and self.byweekday:
-            raise ValidationError(
-                {'byweekday': _(f'mode field must be {self.YEARLY_MONTH_MODE[self.BY_DAY][1]}')},
-                code='mode_required')
-
-        elif self.year_month_mode == self.BY_DAY and self.bymonthday:
-            raise ValidationError(
-                {'bymonthday': _(f'mode field must be {self.YEARLY_MONTH_MODE[self.BY_DATE][1]}')},
-                code='mode_required')
-
-        if freq == self.DAILY or freq == self.WEEKLY:
-            if self.bymonthday:
-                raise ValidationError({
-                    'bymonthday': _("Must not be specified when the Freq is set to WEEKLY or DAILY")
-                },
-                    code="unnecessary_bymonthday"
-                )
-
-        if freq == self.WEEKLY and not byweekday:
-            ValidationError({'byweekday': _('this field is required ')}, code='required')
-
-        if byweekday:
-            if freq == self.DAILY:
-                raise ValidationError({
-                    'byweekday': _("Can't specify by weekday With Freq DAILY")
-                },
-                    code="unnecessary_byweekday"
-                )
-            if not all(check_pattern(i) == check_pattern(byweekday[0]) for i in byweekday):
-                raise ValidationError({
-                    'byweekday': _("by weekday must be in the form (1MO, +1MO, -1MO) or (MO, WE)"
-                                   "you cannot use both formats at the same time")
-                },
-                    code="different_formats"
-                )
-
-            for value in byweekday:
-                s = re.search(pattern_weekday_with_nth, value)
-                if s is None:
-                    raise ValidationError({
-                        'byweekday': _("by weekday must be in the format (1MO, +1MO, -1MO, MO)")
-                    },
-                        code="wrong_value"
-                    )
-
-            if freq == self.WEEKLY:
-                for value in byweekday:
-                    s = re.search("^([AEOUMTHWSFR]{2}$)", value)
-                    if s is None:
-                        raise ValidationError({
-                            'byweekday': _("With Freq Weekly by weekday must be in the form (MO, WE)")
-                        },
-                            code="invalid_weekday"
-                        )
-
-        if self.count and self.until_date:
-            raise ValidationError(
-                _('count and until fields are excluded from each other'),
-                code='count_or_utc_forbidden'
-            )
-
-        if self.freq_type == self.FOREVER and (self.until_date or self.count):
-            raise ValidationError(
-                _('count or until values are unnecessary with forever freq type'),
-                code='unnecessary'
-            )
-        elif self.freq_type == self.UNTIL and not self.until_date:
-            raise ValidationError({'until_date': _('this field is required')}, code='until_required')
-        elif self.freq_type == self.COUNT and not self.count:
-            raise ValidationError({'count': _('this field is required')}, code='count_required')
-
-        if self.bysetpos and (not any([self.byweekday, self.bymonthday]) or self.freq == self.WEEKLY):
-            raise ValidationError({
-                'bysetpos': _(
-                    "Must be specified with the freq. YEARLY or MONTHLY with byweekday or bymonthday parameters")
-            },
-                code="unnecessary_bysetpos"
-            )
+        for error in rule_errors(rule_values(self)):
+            raise error
 
     def save(self, *args, **kwargs):
-        tzname = pytz.timezone(self.recurrence.timezone)
-        self.utc_dtstart = tzname.localize(datetime.combine(self.dtstart, self.recurrence.start_time))
+        self.set_derived_fields(self.recurrence.get_timezone(), self.recurrence.start_time)
+        super().save(*args, **kwargs)
+        self.recurrence.sync()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        self.recurrence.sync()
+        return result
+
+    def set_derived_fields(self, dt_tz, start_time):
+        """
+        compiled, masks and utc fields, without queries so bulk imports can use it
+        """
+        self.compiled = json.dumps(self.compiled_kwargs, separators=(',', ':'))
+        self.month_mask, self.weekday_mask, self.monthday_mask = self.get_masks()
+        self.utc_dtstart = localize(dt_tz, datetime.combine(self.dtstart, start_time))
         if self.until_date:
-            dt = datetime.combine(self.until_date, self.recurrence.start_time)
-            dt = tzname.localize(dt)
-            self.utc_until = dt
+            self.utc_until = localize(dt_tz, datetime.combine(self.until_date, start_time))
         else:
             self.utc_until = None
-        super().save(*args, **kwargs)
+        self.utc_last_occurrence = self.get_last_occurrence(dt_tz, start_time)
+
+    def get_last_occurrence(self, dt_tz, start_time):
+        """
+        upper bound of the occurrences, None if the rule repeats forever
+        """
+        if self.freq_type == self.UNTIL and self.until_date:
+            return localize(dt_tz, datetime.combine(self.until_date, start_time))
+        elif self.freq_type == self.COUNT and self.count:
+            last = None
+            for last in self.build_dateutil_rule(dt_tz, start_time):
+                pass
+            # a rule without occurrences never ends after its start
+            return last or localize(dt_tz, datetime.combine(self.dtstart, start_time))
+        return None
 
     @staticmethod
     def _get_byweekday_pattern(value):
-        pattern_weekday_with_nth = "^([0-9]{1}|[-+][0-9]{1})[AEOUMTHWSFR]{2}$"
-        pattern_weekday_without_nth = "^([AEOUMTHWSFR]{2}$)"
-        if re.search(pattern_weekday_with_nth, value) is not None:
-            return pattern_weekday_with_nth
-        elif re.search(pattern_weekday_without_nth, value) is not None:
-            return pattern_weekday_without_nth
-        else:
-            raise ValidationError({
-                'byweekday': _("by weekday must be in the form (1MO, +1MO, -1MO, MO)")
-            },
-                code="wrong_value"
-            )
+        return weekday_pattern(value)
 
-    @property
-    def handle_byweekday(self):
+    @staticmethod
+    def _parse_byweekday(values):
         """
-        a fork from dateutil.rrule source code
+        a fork from dateutil.rrule source code, [weekday, n] pairs of the byweekday strings
         """
-        if not self.byweekday:
-            return False
-
         weekday_dict = {
             "MO": 0, "TU": 1, "WE": 2, "TH": 3, "FR": 4,
             "SA": 5, "SU": 6
         }
 
         weekdays_constants = []
-        for wday in self.byweekday:
+        for wday in values:
             i = 0
             for i in range(len(wday)):
                 if wday[i] not in '+-0123456789':
@@ -536,207 +763,123 @@ class Rule(models.Model):
             w = wday[i:]
             if n:
                 n = int(n)
-            weekdays_constants.append(weekday(weekday_dict[w], n))
+            weekdays_constants.append([weekday_dict[w], n])
         return weekdays_constants
 
+    def compile(self):
+        """
+        normalized rrule kwargs of the rule (without dtstart and until),
+        every string of the MultiSelectFields is parsed here once
+        """
+        return {
+            'freq': self.freq,
+            'interval': self.interval,
+            'wkst': self.wkst,
+            'count': self.count or None,
+            'bymonth': [int(month) for month in self.bymonth] if self.bymonth else None,
+            'bymonthday': [int(day) for day in self.bymonthday] if self.bymonthday else None,
+            'byweekday': self._parse_byweekday(self.byweekday) if self.byweekday else None,
+            'bysetpos': [int(pos) for pos in self.bysetpos] if self.bysetpos else None,
+        }
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if instance.compiled and not instance.get_deferred_fields():
+            # the stored compiled is parsed by compiled_kwargs while the fields stay the same
+            instance._compiled_kwargs = (instance._compile_source(), None)
+        return instance
+
+    def _compile_source(self):
+        return tuple(
+            tuple(value) if isinstance(value, list) else value
+            for value in (self.freq, self.interval, self.wkst, self.count,
+                          self.bymonth, self.bymonthday, self.byweekday, self.bysetpos)
+        )
+
+    @property
+    def compiled_kwargs(self):
+        """
+        compile() of the rule, the stored compiled of a loaded rule is read back and
+        it's recomputed once a field changes on the instance. like the masks and the
+        utc fields, the stored compiled is stale after a QuerySet.update() of the fields
+        """
+        source = self._compile_source()
+        cached = self.__dict__.get('_compiled_kwargs')
+        if cached is None or cached[0] != source or (cached[1] is None and not self.compiled):
+            cached = self._compiled_kwargs = (source, self.compile())
+        elif cached[1] is None:
+            cached = self._compiled_kwargs = (source, json.loads(self.compiled))
+        return cached[1]
+
+    def get_masks(self):
+        """
+        (month, weekday, monthday) bitmasks of the dates the rule may fire on, with the
+        defaults of dateutil: YEARLY rules without by* values fire on the month and day
+        of dtstart, MONTHLY rules on the day of dtstart and WEEKLY rules on its weekday.
+        interval and bysetpos are ignored so the masks are a superset of the occurrences
+        """
+        kwargs = self.compiled_kwargs
+        bymonth, bymonthday, byweekday = kwargs['bymonth'], kwargs['bymonthday'], kwargs['byweekday']
+        fixed = not bymonthday and not byweekday
+        if self.freq == self.YEARLY and fixed and not bymonth:
+            bymonth = [self.dtstart.month]
+        if self.freq in (self.YEARLY, self.MONTHLY) and fixed:
+            bymonthday = [self.dtstart.day]
+        elif self.freq == self.WEEKLY and fixed:
+            byweekday = [[self.dtstart.weekday(), None]]
+
+        month_mask = sum(1 << (month - 1) for month in set(bymonth)) if bymonth else ALL_MONTHS
+        weekday_mask = sum(1 << day for day in {day for day, n in byweekday}) if byweekday else ALL_WEEKDAYS
+        monthday_mask = sum(monthday_bit(day) for day in set(bymonthday)) if bymonthday else ALL_MONTHDAYS
+        return month_mask, weekday_mask, monthday_mask
+
+    @staticmethod
+    def from_compiled(kwargs, dtstart, until=None):
+        """
+        dateutil rrule of the kwargs returned by compile(), nothing is parsed
+        """
+        byweekday = kwargs['byweekday']
+        return rrule(kwargs['freq'], dtstart=dtstart, until=until, interval=kwargs['interval'],
+                     wkst=kwargs['wkst'], count=kwargs['count'], bymonth=kwargs['bymonth'],
+                     bymonthday=kwargs['bymonthday'], bysetpos=kwargs['bysetpos'],
+                     byweekday=[weekday(day, n) for day, n in byweekday] if byweekday else None)
+
+    @property
+    def handle_byweekday(self):
+        """
+        dateutil weekday constants of byweekday, False without byweekday
+        """
+        byweekday = self.compiled_kwargs['byweekday']
+        if not byweekday:
+            return False
+        return [weekday(day, n) for day, n in byweekday]
+
     @property
     def to_dateutil_rule(self):
-        freq = self.freq
-        dt_tz = pytz.timezone(self.recurrence.timezone)
-        dtstart = datetime.combine(self.dtstart, self.recurrence.start_time)
-        dtstart = dt_tz.localize(dtstart)
-        count = self.count or None
+        with measure('to_dateutil_rule', self.recurrence_id) as metrics:
+            metrics['rules'] = 1
+            return self.build_dateutil_rule(self.recurrence.get_timezone(), self.recurrence.start_time)
 
+    def build_dateutil_rule(self, dt_tz, start_time):
+        """
+        dateutil rrule for the given timezone and start time of the recurrence
+        """
+        dtstart = localize(dt_tz, datetime.combine(self.dtstart, start_time))
         if self.freq_type == self.UNTIL:
-            until = datetime.combine(self.until_date, self.recurrence.start_time)
-            until = dt_tz.localize(until)
+            until = localize(dt_tz, datetime.combine(self.until_date, start_time))
         else:
             until = None
-
-        bymonth = None if not self.bymonth else [int(day) for day in self.bymonth]
-        bysetpos = self.bysetpos or None
-        bymonthday = None if not self.bymonthday else [int(day) for day in self.bymonthday]
-        byweekday = self.handle_byweekday or None
-        rule = rrule(freq, dtstart=dtstart, interval=self.interval, wkst=self.wkst, count=count, until=until,
-                     bymonth=bymonth, bymonthday=bymonthday, byweekday=byweekday, bysetpos=bysetpos)
-        return rule
+        return self.from_compiled(self.compiled_kwargs, dtstart, until)
 
     def rule_to_text(self, short=False):
-        rule = self
         """
-        fork from django recurrences
-        Render the given `Rule` as natural text.
+        Render the given `Rule` as natural text, see djangorrules.text
         :Parameters:
             `short` : bool
                 Use abbreviated labels, i.e. 'Fri' instead of 'Friday'.
         """
-        conjunction = 'and'  # use as last separator in join() method
-
-        frequencies = (
-            _('annually'), _('monthly'), _('weekly'), _('daily'),
-        )
-        time_intervals = (
-            _('years'), _('months'), _('weeks'), _('days')
-        )
-        weekdays_display = (
-            _('Monday'), _('Tuesday'), _('Wednesday'),
-            _('Thursday'), _('Friday'), _('Saturday'), _('Sunday'),
-        )
-
-        if short:
-            positional_display = {
-                1: _('1st %(weekday)s'),
-                2: _('2nd %(weekday)s'),
-                3: _('3rd %(weekday)s'),
-                4: _('4th %(weekday)s'),
-                -1: _('last %(weekday)s'),
-                -2: _('2nd last %(weekday)s'),
-                -3: _('3rd last %(weekday)s'),
-            }
-            # only this case only are permit from -3 up 4
-            bysetpos_nth_instances = {
-                1: _('1st'),
-                2: _('2nd'),
-                3: _('3rd'),
-                4: _('4th'),
-                -1: _('last'),
-                -2: _('2nd last'),
-                -3: _('3rd last'),
-            }
-            last_of_month_display = {
-                -1: _('last day'),
-                -2: _('2nd last day'),
-                -3: _('3rd last day'),
-                -4: _('4th last day'),
-            }
-
-            months_display = (
-                _('Jan'), _('Feb'), _('Mar'), _('Apr'),
-                _p('month name', 'May'), _('Jun'), _('Jul'), _('Aug'),
-                _('Sep'), _('Oct'), _('Nov'), _('Dec'),
-            )
-
-        else:
-            positional_display = {
-                1: _('first %(weekday)s'),
-                2: _('second %(weekday)s'),
-                3: _('third %(weekday)s'),
-                4: _('fourth %(weekday)s'),
-                -1: _('last %(weekday)s'),
-                -2: _('second last %(weekday)s'),
-                -3: _('third last %(weekday)s'),
-            }
-
-            bysetpos_nth_instances = {
-                1: _('first'),
-                2: _('second'),
-                3: _('third'),
-                4: _('fourth'),
-                -1: _('last'),
-                -2: _('second last'),
-                -3: _('third last'),
-            }
-
-            last_of_month_display = {
-                -1: _('last day'),
-                -2: _('second last day'),
-                -3: _('third last day'),
-                -4: _('fourth last day'),
-            }
-            months_display = (
-                _('January'), _('February'), _('March'), _('April'),
-                _p('month name', 'May'), _('June'), _('July'), _('August'),
-                _('September'), _('October'), _('November'), _('December'),
-            )
-
-        parts = []
-
-        if self.interval > 1:
-            parts.append(
-                _('every %(number)s %(freq)s') % {
-                    'number': rule.interval,
-                    'freq': time_intervals[self.freq]
-                })
-        else:
-            parts.append(frequencies[self.freq])
-
-        if self.bymonth:
-            # bymonth are 1-indexed (January is 1), months_display
-            # are 0-indexed (January is 0).
-            # change conjunction to 'and' with freq monthly and bysetpos
-            # bysetpos with monthly apply nth only to byweekday and bymonthday
-            # however with yearly apply to bymonth, byweekday and bymonth day
-            if self.bysetpos and self.freq == self.MONTHLY:
-                conjunction = 'and'
-            elif self.bysetpos and self.freq == self.YEARLY:
-                conjunction = 'or'
-
-            months = [months_display[int(month_index) - 1] for month_index in self.bymonth]
-            items = join_with_conjunction(months, conjunction)
-            parts.append(_('in %(items)s') % {'items': items})
-
-        if self.bysetpos:
-            conjunction = 'or'
-
-        if self.bymonthday and not self.bymonth:
-            if self.freq == self.YEARLY:
-                parts.append('each month')
-
-        if self.freq == self.YEARLY or self.freq == self.MONTHLY:
-            if self.bymonthday:
-                bymonthday = [int(day) for day in self.bymonthday]
-                items = [
-                    dateformat.format(datetime(1, 1, day), 'jS') if day > 0
-                    else last_of_month_display.get(day, day)
-                    for day in bymonthday
-                ]
-                items = join_with_conjunction(items, conjunction)
-                parts.append(_('on the %(items)s') % {'items': items})
-
-            elif self.byweekday:
-                items = []
-                for byday in rule.handle_byweekday:
-                    items.append(
-                        positional_display.get(byday.n, '%(weekday)s') % {
-                            'weekday': weekdays_display[byday.weekday]
-                        })
-                items = join_with_conjunction(items, conjunction)
-                parts.append(
-                    _('on the %(items)s') % {
-                        'items': items
-                    })
-
-        if self.freq == self.WEEKLY:
-            if self.byweekday:
-                items = [weekdays_display[day.weekday] for day in self.handle_byweekday]
-                items = join_with_conjunction(items, conjunction)
-                parts.append(_('each %(items)s') % {'items': items})
-
-        # daily frequencies has no additional formatting,
-
-        if self.bysetpos:
-            nth_text = ' instance'
-            items = []
-            for setpos in self.bysetpos:
-                items.append(bysetpos_nth_instances.get(int(setpos)))
-            items = join_with_conjunction(items, conjunction) + nth_text
-
-            parts.append(_('only the %(items)s') % {'items': items})
-
-        if self.count:
-            if self.count == 1:
-                parts.append(_('for once'))
-            else:
-                parts.append(_('for %(number)s occurrences') % {
-                    'number': self.count
-                })
-        elif self.until_date:
-            parts.append(_('until the %(date)s') % {
-                'date': dateformat.format(self.until_date, 'D d F Y')
-            })
-        else:
-            parts.append(_('forever'))
-        return _(', ').join(str(part) for part in parts)
+        return rule_text(self, short)
 
 
 class RDate(models.Model):
@@ -747,14 +890,50 @@ class RDate(models.Model):
     utc_dt = models.DateTimeField(editable=False)
     exclude = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['exclude', 'utc_dt']),
+        ]
+
     def __str__(self):
-        dt = datetime.combine(self.naive_dt, self.recurrence.start_time)
-        dt_tz = pytz.timezone(self.recurrence.timezone)
-        dt = dt_tz.localize(dt)
+        dt = self.recurrence.localize_date(self.naive_dt)
         return f"date: {dateformat.format(dt, 'D d F Y')} " \
                f"{'excluded from rule' if self.exclude else 'included in rule'}"
 
     def save(self, *args, **kwargs):
         if self.naive_dt:
-            self.utc_dt = datetime.combine(self.naive_dt, self.recurrence.start_time)
+            self.utc_dt = self.recurrence.localize_date(self.naive_dt)
         super().save(*args, **kwargs)
+        self.recurrence.sync()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        self.recurrence.sync()
+        return result
+
+
+class Occurrence(models.Model):
+    """
+    materialized occurrence of a recurrence, rebuilt by Recurrence.refresh_occurrences()
+    every time a rule or a date of the recurrence changes, range queries over this table
+    don't need to expand the rruleset
+    """
+    recurrence = models.ForeignKey(Recurrence, related_name='occurrences', related_query_name='occurrence',
+                                   on_delete=models.CASCADE)
+    utc_start = models.DateTimeField()
+    # date in the recurrence timezone
+    local_date = models.DateField()
+    # added by a RDate instead of a rule
+    is_exception = models.BooleanField(default=False)
+
+    objects = OccurrenceQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['utc_start']
+        indexes = [
+            models.Index(fields=['utc_start', 'recurrence']),
+            models.Index(fields=['recurrence', 'utc_start']),
+        ]
+
+    def __str__(self):
+        return f"{self.recurrence_id}: {self.utc_start.isoformat()}"
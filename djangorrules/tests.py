@@ -1,8 +1,47 @@
+import io
+import json
 import unittest
+from importlib import import_module
+from itertools import islice
+from unittest import mock
 import re
-from django.test import TestCase
+from datetime import date, datetime, time, timedelta
+
+import pytz
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+try:
+    from hypothesis import given, settings, strategies as st
+except ImportError:  # hypothesis is only needed by the property based tests
+    given = None
 from django.core.exceptions import ValidationError
-from .models import Recurrence, Rule
+from . import benchmark, diff, fastpath, instrumentation
+from .batch import expand_recurrences
+from .importer import import_recurrences
+from .materialize import extend_horizon
+from . import conflicts as conflicts_module
+from .cache import rule_text_cache, ruleset_cache
+from .diff import occurrences_changed
+from .models import Occurrence, Recurrence, RDate, Rule
+from .text import render_texts
+from .ical import from_ical
+from .timezones import get_timezone, zoneinfo
+from .utils import date_bits
+from .validators import WEEKDAY_TOKENS, rule_values, validate_many
+
+
+def migration_backfill(name):
+    """
+    backfill() of a data migration with the models of the project state after it
+    """
+    apps = MigrationLoader(connection).project_state(('djangorrules', name)).apps
+    backfill = import_module(f'djangorrules.migrations.{name}').backfill
+    return lambda: backfill(apps, None)
 
 
 class RuleTestCase(unittest.TestCase):
@@ -35,3 +74,1294 @@ class RuleTestCase(unittest.TestCase):
         self.assertRaises(ValidationError, Rule._get_byweekday_pattern, self.wrong_values[0])
         self.assertEqual(Rule._get_byweekday_pattern(byweekday[0]), self.pattern_weekday_with_nth)
         self.assertEqual(Rule._get_byweekday_pattern(byweekday[2]), self.pattern_weekday_without_nth)
+
+
+class OccurrenceTestCase(TestCase):
+
+    def setUp(self):
+        self.recurrence = Recurrence.objects.create(timezone='America/La_Paz', start_time=time(10, 0))
+
+    def test_rule_save_materializes_occurrences(self):
+        Rule.objects.create(recurrence=self.recurrence, dtstart=date(2020, 1, 1), freq=Rule.DAILY,
+                            interval=1, freq_type=Rule.COUNT, count=5)
+        occurrences = self.recurrence.occurrences.all()
+        self.assertEqual(occurrences.count(), 5)
+        self.assertEqual(occurrences[0].local_date, date(2020, 1, 1))
+        self.assertEqual(occurrences[0].utc_start, datetime(2020, 1, 1, 14, 0, tzinfo=pytz.utc))
+
+    def test_rdate_changes_refresh_occurrences(self):
+        Rule.objects.create(recurrence=self.recurrence, dtstart=date(2020, 1, 1), freq=Rule.DAILY,
+                            interval=1, freq_type=Rule.COUNT, count=5)
+        exdate = RDate.objects.create(recurrence=self.recurrence, naive_dt=date(2020, 1, 2), exclude=True)
+        RDate.objects.create(recurrence=self.recurrence, naive_dt=date(2020, 2, 1))
+        dates = list(self.recurrence.occurrences.values_list('local_date', 'is_exception'))
+        self.assertNotIn((date(2020, 1, 2), False), dates)
+        self.assertIn((date(2020, 2, 1), True), dates)
+        self.assertEqual(len(dates), 5)
+
+        exdate.delete()
+        self.assertEqual(self.recurrence.occurrences.count(), 6)
+
+    def test_between(self):
+        Rule.objects.create(recurrence=self.recurrence, dtstart=date(2020, 1, 1), freq=Rule.DAILY,
+                            interval=1, freq_type=Rule.COUNT, count=5)
+        after = datetime(2020, 1, 2, 14, 0, tzinfo=pytz.utc)
+        before = datetime(2020, 1, 4, 14, 0, tzinfo=pytz.utc)
+        self.assertEqual(Occurrence.objects.between(after, before).count(), 1)
+        self.assertEqual(Occurrence.objects.between(after, before, inc=True).count(), 3)
+
+
+    @override_settings(DJANGORRULES_OCCURRENCE_RETENTION=30)
+    def test_retention(self):
+        start = timezone.now().date() - timedelta(days=100)
+        rule = Rule.objects.create(recurrence=self.recurrence, dtstart=start, freq=Rule.DAILY, interval=1,
+                                   freq_type=Rule.COUNT, count=90)
+        first = self.recurrence.occurrences.earliest('utc_start').utc_start
+        self.assertGreaterEqual(first, timezone.now() - timedelta(days=30))
+        self.assertLess(first, timezone.now() - timedelta(days=29))
+        old = Occurrence.objects.create(recurrence=self.recurrence, utc_start=self.recurrence.localize_date(start),
+                                        local_date=start)
+        rule.count = 80
+        rule.save()
+        self.recurrence.refresh_occurrences()
+        self.assertTrue(Occurrence.objects.filter(pk=old.pk).exists())
+        since = timezone.now() - timedelta(days=30)
+        kept = [dt for dt in self.recurrence.to_dateutil_ruleset() if dt >= since]
+        self.assertEqual(self.recurrence.occurrences.count(), 1 + len(kept))
+
+
+class OccurrencesBetweenTestCase(TestCase):
+
+    def setUp(self):
+        for hour in (9, 8, 7):
+            recurrence = Recurrence.objects.create(timezone='UTC', start_time=time(hour, 0))
+            Rule.objects.create(recurrence=recurrence, dtstart=date(2020, 1, 1), freq=Rule.DAILY,
+                                interval=1, freq_type=Rule.FOREVER)
+            RDate.objects.create(recurrence=recurrence, naive_dt=date(2020, 1, 2), exclude=True)
+
+    def test_sorted_pairs(self):
+        after = datetime(2020, 1, 1, tzinfo=pytz.utc)
+        before = datetime(2020, 1, 4, tzinfo=pytz.utc)
+        with self.assertNumQueries(3):
+            pairs = list(Recurrence.objects.all().occurrences_between(after, before))
+        self.assertEqual(len(pairs), 6)
+        self.assertEqual([dt for pk, dt in pairs], sorted(dt for pk, dt in pairs))
+        self.assertEqual(pairs[0], (Recurrence.objects.get(start_time=time(7, 0)).pk,
+                                    datetime(2020, 1, 1, 7, 0, tzinfo=pytz.utc)))
+
+
+class RulesetQueriesTestCase(TestCase):
+
+    def setUp(self):
+        for hour in (9, 8):
+            recurrence = Recurrence.objects.create(timezone='America/La_Paz', start_time=time(hour, 0))
+            for freq in (Rule.DAILY, Rule.WEEKLY):
+                Rule.objects.create(recurrence=recurrence, dtstart=date(2020, 1, 1), freq=freq, interval=1,
+                                    byweekday=['MO'] if freq == Rule.WEEKLY else None,
+                                    freq_type=Rule.COUNT, count=3)
+            Rule.objects.create(recurrence=recurrence, dtstart=date(2020, 1, 1), freq=Rule.MONTHLY, interval=1,
+                                year_month_mode=Rule.BY_DAY, byweekday=['MO', 'FR'], bysetpos=['-1'],
+                                freq_type=Rule.COUNT, count=2, exclude=True)
+            RDate.objects.create(recurrence=recurrence, naive_dt=date(2020, 1, 2), exclude=True)
+        # build from the rules and dates instead of ical_text
+        Recurrence.objects.update(ical_text='')
+        ruleset_cache.clear()
+
+    def test_to_dateutil_ruleset_queries(self):
+        recurrence = Recurrence.objects.first()
+        # the stored version and ical_text, the rules and the dates
+        with self.assertNumQueries(3):
+            rule_set = recurrence.to_dateutil_ruleset()
+        self.assertEqual(len(list(rule_set)), 5)
+
+    def test_with_ruleset_data_queries(self):
+        with self.assertNumQueries(3):
+            rule_sets = [recurrence.to_dateutil_ruleset() for recurrence in Recurrence.objects.with_ruleset_data()]
+        self.assertEqual(len(rule_sets), 2)
+
+    def test_build_ruleset_matches_rule_property(self):
+        recurrence = Recurrence.objects.first()
+        rule = recurrence.rules.first()
+        built = rule.build_dateutil_rule(pytz.timezone(recurrence.timezone), recurrence.start_time)
+        self.assertEqual(list(built), list(rule.to_dateutil_rule))
+
+
+class RulesetCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.recurrence = Recurrence.objects.create(timezone='UTC', start_time=time(10, 0))
+        self.rule = Rule.objects.create(recurrence=self.recurrence, dtstart=date(2020, 1, 1), freq=Rule.DAILY,
+                                        interval=1, freq_type=Rule.COUNT, count=3)
+        ruleset_cache.clear()
+
+    def test_hit_and_miss(self):
+        first = list(self.recurrence.to_dateutil_ruleset())
+        # only the stored version is read
+        with self.assertNumQueries(1):
+            second = list(self.recurrence.to_dateutil_ruleset())
+        self.assertEqual(first, second)
+        self.assertEqual(ruleset_cache.stats()['hits'], 1)
+        self.assertEqual(ruleset_cache.stats()['misses'], 1)
+
+    def test_version_bump_invalidates(self):
+        version = self.recurrence.version
+        self.assertEqual(len(list(self.recurrence.to_dateutil_ruleset())), 3)
+        RDate.objects.create(recurrence=self.recurrence, naive_dt=date(2020, 1, 2), exclude=True)
+        self.assertEqual(self.recurrence.version, version + 1)
+        self.assertEqual(len(list(self.recurrence.to_dateutil_ruleset())), 2)
+
+    def test_size_limit(self):
+        with self.settings(DJANGORRULES_RULESET_CACHE_SIZE=0):
+            self.recurrence.to_dateutil_ruleset()
+            self.recurrence.to_dateutil_ruleset()
+        self.assertEqual(ruleset_cache.stats()['hits'], 0)
+        self.assertEqual(ruleset_cache.stats()['size'], 0)
+
+    def test_backend_tier(self):
+        with self.settings(DJANGORRULES_RULESET_CACHE_SIZE=0, DJANGORRULES_RULESET_CACHE_BACKEND='default'):
+            first = list(self.recurrence.to_dateutil_ruleset())
+            with self.assertNumQueries(1):
+                second = list(self.recurrence.to_dateutil_ruleset())
+        self.assertEqual(first, second)
+        self.assertEqual(ruleset_cache.stats()['backend_hits'], 1)
+
+    def test_held_instance(self):
+        held = Recurrence.objects.get(pk=self.recurrence.pk)
+        self.assertEqual(len(list(held.to_dateutil_ruleset())), 3)
+        Rule.objects.create(recurrence_id=self.recurrence.pk, dtstart=date(2020, 2, 1), freq=Rule.DAILY,
+                            interval=1, freq_type=Rule.COUNT, count=2)
+        self.assertEqual(len(list(held.to_dateutil_ruleset())), 5)
+
+
+class ICalTestCase(TestCase):
+
+    def setUp(self):
+        self.recurrence = Recurrence.objects.create(timezone='America/New_York', start_time=time(9, 30))
+        Rule.objects.create(recurrence=self.recurrence, dtstart=date(2020, 1, 1), freq=Rule.WEEKLY, interval=2,
+                            byweekday=['MO', 'TH'], freq_type=Rule.UNTIL, until_date=date(2020, 6, 1))
+        Rule.objects.create(recurrence=self.recurrence, dtstart=date(2020, 2, 1), freq=Rule.MONTHLY, interval=1,
+                            year_month_mode=Rule.BY_DAY, byweekday=['-1FR', '2TU'], freq_type=Rule.COUNT, count=6)
+        Rule.objects.create(recurrence=self.recurrence, dtstart=date(2020, 1, 1), freq=Rule.YEARLY, interval=1,
+                            year_month_mode=Rule.BY_DATE, bymonth=['3', '4'], bymonthday=['1', '-1'],
+                            bysetpos=['1'], freq_type=Rule.FOREVER)
+        Rule.objects.create(recurrence=self.recurrence, dtstart=date(2020, 3, 1), freq=Rule.DAILY, interval=3,
+                            freq_type=Rule.COUNT, count=4, exclude=True)
+        RDate.objects.create(recurrence=self.recurrence, naive_dt=date(2020, 1, 3))
+        RDate.objects.create(recurrence=self.recurrence, naive_dt=date(2020, 1, 13), exclude=True)
+        ruleset_cache.clear()
+
+    def test_ical_text_matches_orm(self):
+        self.assertIn('RRULE:FREQ=WEEKLY;INTERVAL=2;WKST=MO;UNTIL=20200601T133000Z;BYDAY=MO,TH',
+                      self.recurrence.ical_text)
+        end = datetime(2023, 1, 1, tzinfo=pytz.utc)
+        orm = self.recurrence.build_ruleset(self.recurrence.rules.all(), self.recurrence.r_dates.all())
+        parsed = Recurrence.from_ical(self.recurrence.ical_text)
+        self.assertEqual(orm.between(datetime(2019, 1, 1, tzinfo=pytz.utc), end),
+                         parsed.between(datetime(2019, 1, 1, tzinfo=pytz.utc), end))
+
+    def test_to_dateutil_ruleset_without_queries(self):
+        recurrence = Recurrence.objects.with_ruleset_data().get(pk=self.recurrence.pk)
+        with self.assertNumQueries(0):
+            recurrence.to_dateutil_ruleset()
+
+
+class ActiveBetweenTestCase(TestCase):
+
+    def create_recurrence(self, **rule_kwargs):
+        recurrence = Recurrence.objects.create(timezone='UTC', start_time=time(10, 0))
+        Rule.objects.create(recurrence=recurrence, dtstart=date(2020, 1, 1), freq=Rule.DAILY, interval=1,
+                            **rule_kwargs)
+        return recurrence
+
+    def test_active_between(self):
+        forever = self.create_recurrence(freq_type=Rule.FOREVER)
+        counted = self.create_recurrence(freq_type=Rule.COUNT, count=10)
+        until = self.create_recurrence(freq_type=Rule.UNTIL, until_date=date(2020, 3, 1))
+        only_date = Recurrence.objects.create(timezone='UTC', start_time=time(10, 0))
+        RDate.objects.create(recurrence=only_date, naive_dt=date(2021, 6, 1))
+
+        self.assertEqual(counted.rules.get().utc_last_occurrence, datetime(2020, 1, 10, 10, tzinfo=pytz.utc))
+
+        def active(after, before):
+            return set(Recurrence.objects.active_between(after, before))
+
+        self.assertEqual(active(datetime(2019, 1, 1, tzinfo=pytz.utc), datetime(2019, 12, 31, tzinfo=pytz.utc)),
+                         set())
+        self.assertEqual(active(datetime(2020, 1, 5, tzinfo=pytz.utc), datetime(2020, 1, 6, tzinfo=pytz.utc)),
+                         {forever, counted, until})
+        self.assertEqual(active(datetime(2020, 2, 1, tzinfo=pytz.utc), datetime(2020, 2, 2, tzinfo=pytz.utc)),
+                         {forever, until})
+        self.assertEqual(active(datetime(2021, 1, 1, tzinfo=pytz.utc), datetime(2022, 1, 1, tzinfo=pytz.utc)),
+                         {forever, only_date})
+
+    def test_timezone_change(self):
+        recurrence = self.create_recurrence(freq_type=Rule.COUNT, count=1)
+        RDate.objects.create(recurrence=recurrence, naive_dt=date(2020, 2, 1))
+        recurrence.timezone = 'America/La_Paz'
+        recurrence.start_time = time(22, 0)
+        recurrence.save()
+        # 2020-01-01 22:00 in La Paz is the next day in utc
+        after, before = datetime(2020, 1, 2, tzinfo=pytz.utc), datetime(2020, 1, 3, tzinfo=pytz.utc)
+        self.assertEqual(recurrence.rules.get().utc_last_occurrence, datetime(2020, 1, 2, 2, tzinfo=pytz.utc))
+        self.assertEqual(recurrence.r_dates.get().utc_dt, datetime(2020, 2, 2, 2, tzinfo=pytz.utc))
+        self.assertEqual(list(Recurrence.objects.occurrences_between(after, before)),
+                         [(recurrence.pk, recurrence.to_dateutil_ruleset().between(after, before)[0])])
+
+
+class NextOccurrenceTestCase(TestCase):
+
+    def setUp(self):
+        self.recurrence = Recurrence.objects.create(timezone='UTC', start_time=time(10, 0))
+        Rule.objects.create(recurrence=self.recurrence, dtstart=date(2020, 1, 1), freq=Rule.DAILY, interval=2,
+                            freq_type=Rule.FOREVER)
+
+    def test_sync_sets_next_occurrence(self):
+        now = timezone.now()
+        next_occurrence = Recurrence.objects.get(pk=self.recurrence.pk).next_occurrence_utc
+        self.assertTrue(now - timedelta(minutes=1) < next_occurrence <= now + timedelta(days=2))
+
+    def test_advance(self):
+        now = datetime(2020, 1, 3, 10, 0, tzinfo=pytz.utc)
+        self.recurrence.next_occurrence_utc = now
+        self.assertEqual(self.recurrence.advance(now), datetime(2020, 1, 5, 10, 0, tzinfo=pytz.utc))
+        self.assertEqual(Recurrence.objects.get(pk=self.recurrence.pk).next_occurrence_utc,
+                         datetime(2020, 1, 5, 10, 0, tzinfo=pytz.utc))
+
+    def test_advance_due(self):
+        other = Recurrence.objects.create(timezone='UTC', start_time=time(12, 0))
+        Rule.objects.create(recurrence=other, dtstart=date(2020, 1, 1), freq=Rule.DAILY, interval=1,
+                            freq_type=Rule.FOREVER)
+        Recurrence.objects.update(next_occurrence_utc=datetime(2020, 1, 1, 10, 0, tzinfo=pytz.utc))
+        now = datetime(2020, 1, 2, 11, 0, tzinfo=pytz.utc)
+        self.assertEqual(Recurrence.objects.due(now).count(), 2)
+        self.assertEqual(Recurrence.objects.advance_due(now, batch_size=1), 2)
+        self.assertEqual(Recurrence.objects.due(now).count(), 0)
+        self.assertEqual(Recurrence.objects.get(pk=other.pk).next_occurrence_utc,
+                         datetime(2020, 1, 2, 12, 0, tzinfo=pytz.utc))
+
+    def test_backfill(self):
+        other = Recurrence.objects.create(timezone='America/La_Paz', start_time=time(9, 0))
+        Rule.objects.create(recurrence=other, dtstart=date(2020, 1, 1), freq=Rule.MONTHLY, interval=1,
+                            year_month_mode=Rule.BY_DAY, byweekday=['-1FR'], bymonth=['1', '6'],
+                            freq_type=Rule.UNTIL, until_date=date(2099, 1, 1))
+        Rule.objects.create(recurrence=other, dtstart=date(2020, 1, 1), freq=Rule.DAILY, interval=1,
+                            freq_type=Rule.COUNT, count=3, exclude=True)
+        RDate.objects.create(recurrence=other, naive_dt=date(2098, 1, 2))
+        expected = list(Recurrence.objects.order_by('pk'))
+        Recurrence.objects.update(ical_text='', next_occurrence_utc=None)
+        migration_backfill('0033_backfill_next_occurrence_utc')()
+        for recurrence, stored in zip(expected, Recurrence.objects.order_by('pk')):
+            self.assertEqual(stored.ical_text, recurrence.ical_text)
+            self.assertEqual(stored.next_occurrence_utc, recurrence.next_occurrence_utc)
+        self.assertIsNotNone(expected[1].next_occurrence_utc)
+
+
+@unittest.skipIf(fastpath.np is None or given is None, "numpy and hypothesis are required")
+class NumpyEngineTestCase(unittest.TestCase):
+    timezones = ['UTC', 'America/La_Paz', 'America/New_York', 'Europe/Madrid', 'Australia/Sydney']
+
+    if given is not None:
+        @settings(max_examples=300, deadline=None)
+        @given(
+            freq=st.sampled_from([Rule.DAILY, Rule.WEEKLY]),
+            interval=st.integers(1, 10),
+            wkst=st.integers(0, 6),
+            weekdays=st.sets(st.sampled_from(['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU'])),
+            dtstart=st.dates(date(1960, 1, 1), date(2040, 1, 1)),
+            start_time=st.times(),
+            freq_type=st.sampled_from([Rule.FOREVER, Rule.UNTIL, Rule.COUNT]),
+            length=st.integers(1, 400),
+            tzname=st.sampled_from(timezones),
+            window_start=st.integers(-30, 400),
+            window_days=st.integers(0, 800),
+            inc=st.booleans(),
+        )
+        def test_same_occurrences_as_dateutil(self, freq, interval, wkst, weekdays, dtstart, start_time, freq_type,
+                                              length, tzname, window_start, window_days, inc):
+            rule = Rule(freq=freq, interval=interval, wkst=wkst, dtstart=dtstart, freq_type=freq_type,
+                        byweekday=sorted(weekdays) if freq == Rule.WEEKLY and weekdays else None,
+                        count=length if freq_type == Rule.COUNT else None,
+                        until_date=dtstart + timedelta(days=length) if freq_type == Rule.UNTIL else None)
+            dt_tz = pytz.timezone(tzname)
+            after = pytz.utc.localize(datetime.combine(dtstart, start_time) + timedelta(days=window_start))
+            before = after + timedelta(days=window_days, hours=window_start % 24)
+            self.assertIsNotNone(fastpath.simple_rule(rule, dt_tz, start_time))
+
+            expected = rule.build_dateutil_rule(dt_tz, start_time).between(after, before, inc=inc)
+            result = fastpath.expand_rule(rule, dt_tz, start_time, after, before, inc=inc)
+            self.assertEqual(result, expected)
+            self.assertTrue(all(a.tzinfo is b.tzinfo for a, b in zip(result, expected)))
+
+    def test_unsupported_shapes_fall_back(self):
+        dt_tz = pytz.timezone('UTC')
+        nth_weekday = Rule(freq=Rule.MONTHLY, interval=1, wkst=0, dtstart=date(2020, 1, 1), byweekday=['1MO'],
+                           freq_type=Rule.FOREVER)
+        bysetpos = Rule(freq=Rule.MONTHLY, interval=1, wkst=0, dtstart=date(2020, 1, 1), byweekday=['MO', 'FR'],
+                        bysetpos=['-1'], freq_type=Rule.FOREVER)
+        for rule in (nth_weekday, bysetpos):
+            self.assertIsNone(fastpath.simple_rule(rule, dt_tz, time(10)))
+            after, before = datetime(2020, 1, 1, tzinfo=pytz.utc), datetime(2021, 1, 1, tzinfo=pytz.utc)
+            self.assertEqual(fastpath.expand_rule(rule, dt_tz, time(10), after, before),
+                             rule.build_dateutil_rule(dt_tz, time(10)).between(after, before))
+
+
+@unittest.skipIf(given is None, "hypothesis is required")
+class CountTestCase(unittest.TestCase):
+    timezones = ['UTC', 'America/La_Paz', 'America/New_York', 'Europe/Madrid', 'Australia/Sydney']
+
+    if given is not None:
+        @settings(max_examples=300, deadline=None)
+        @given(
+            freq=st.sampled_from([Rule.MONTHLY, Rule.WEEKLY, Rule.DAILY]),
+            interval=st.integers(1, 10),
+            wkst=st.integers(0, 6),
+            weekdays=st.sets(st.sampled_from(['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU'])),
+            monthdays=st.sets(st.integers(1, 28).map(str)),
+            dtstart=st.dates(date(1960, 1, 1), date(2040, 1, 1)),
+            start_time=st.times(),
+            freq_type=st.sampled_from([Rule.FOREVER, Rule.UNTIL, Rule.COUNT]),
+            length=st.integers(1, 400),
+            tzname=st.sampled_from(timezones),
+            window_start=st.integers(-30, 400),
+            window_days=st.integers(0, 800),
+            inc=st.booleans(),
+        )
+        def test_same_count_as_dateutil(self, freq, interval, wkst, weekdays, monthdays, dtstart, start_time,
+                                        freq_type, length, tzname, window_start, window_days, inc):
+            if freq == Rule.MONTHLY and dtstart.day > 28 and not monthdays:
+                dtstart = dtstart.replace(day=28)
+            rule = Rule(freq=freq, interval=interval, wkst=wkst, dtstart=dtstart, freq_type=freq_type,
+                        byweekday=sorted(weekdays) if freq == Rule.WEEKLY and weekdays else None,
+                        bymonthday=sorted(monthdays) if freq == Rule.MONTHLY and monthdays else None,
+                        count=length if freq_type == Rule.COUNT else None,
+                        until_date=dtstart + timedelta(days=length * 7) if freq_type == Rule.UNTIL else None)
+            dt_tz = pytz.timezone(tzname)
+            after = pytz.utc.localize(datetime.combine(dtstart, start_time) + timedelta(days=window_start))
+            before = after + timedelta(days=window_days * 3, hours=window_start % 24)
+            simple = fastpath.simple_rule(rule, dt_tz, start_time, monthly=True)
+            self.assertIsNotNone(simple)
+
+            dateutil_rule = rule.build_dateutil_rule(dt_tz, start_time)
+            expected = dateutil_rule.between(after, before, inc=inc)
+            self.assertEqual(fastpath.count_between(simple, after, before, inc), len(expected))
+            for dt in expected[:3] + expected[-3:]:
+                self.assertTrue(fastpath.contains(simple, dt))
+                next_day = dt + timedelta(days=1)
+                self.assertEqual(fastpath.contains(simple, next_day), next_day in dateutil_rule)
+            self.assertEqual(fastpath.contains(simple, after), after in dateutil_rule)
+
+
+class RecurrenceCountTestCase(TestCase):
+
+    def setUp(self):
+        self.recurrence = Recurrence.objects.create(timezone='America/La_Paz', start_time=time(10, 0))
+        self.rule = Rule.objects.create(recurrence=self.recurrence, dtstart=date(2020, 1, 1), freq=Rule.MONTHLY,
+                                        interval=1, bymonthday=['1', '15'], freq_type=Rule.FOREVER)
+        RDate.objects.create(recurrence=self.recurrence, naive_dt=date(2020, 2, 3))
+        RDate.objects.create(recurrence=self.recurrence, naive_dt=date(2020, 2, 15), exclude=True)
+        # an exdate of an rdate removes it
+        RDate.objects.create(recurrence=self.recurrence, naive_dt=date(2020, 3, 3))
+        RDate.objects.create(recurrence=self.recurrence, naive_dt=date(2020, 3, 3), exclude=True)
+
+    def assertSameAsDateutil(self, after, before, inc=False):
+        expected = self.recurrence.to_dateutil_ruleset().between(after, before, inc=inc)
+        self.assertEqual(self.recurrence.count_between(after, before, inc), len(expected))
+
+    def test_count_between(self):
+        after = self.recurrence.localize_date(date(2020, 1, 1))
+        before = self.recurrence.localize_date(date(2021, 1, 1))
+        self.assertEqual(self.recurrence.count_between(after, before, inc=True), 24 + 1 - 1 + 1)
+        self.assertSameAsDateutil(after, before)
+        self.assertSameAsDateutil(after, before, inc=True)
+        self.assertSameAsDateutil(after + timedelta(days=40), before + timedelta(days=1000))
+
+    def test_count_between_falls_back(self):
+        Rule.objects.create(recurrence=self.recurrence, dtstart=date(2020, 1, 1), freq=Rule.MONTHLY, interval=1,
+                            byweekday=['FR'], bysetpos=['-1'], freq_type=Rule.FOREVER)
+        self.assertSameAsDateutil(self.recurrence.localize_date(date(2020, 1, 1)),
+                                  self.recurrence.localize_date(date(2021, 1, 1)))
+
+    def test_contains(self):
+        Rule.objects.create(recurrence=self.recurrence, dtstart=date(2020, 1, 1), freq=Rule.WEEKLY, interval=1,
+                            byweekday=['WE'], freq_type=Rule.FOREVER, exclude=True)
+        rule_set = self.recurrence.to_dateutil_ruleset()
+        for day in range(120):
+            dt = self.recurrence.localize_date(date(2020, 1, 1) + timedelta(days=day))
+            self.assertEqual(self.recurrence.contains(dt), dt in rule_set, dt)
+        self.assertFalse(self.recurrence.contains(self.recurrence.localize_date(date(2020, 1, 15)) +
+                                                  timedelta(hours=1)))
+
+
+@override_settings(ROOT_URLCONF='djangorrules.urls')
+class ExportOccurrencesTestCase(TestCase):
+
+    def setUp(self):
+        self.recurrence = Recurrence.objects.create(timezone='UTC', start_time=time(10, 0))
+        Rule.objects.create(recurrence=self.recurrence, dtstart=date(2020, 1, 1), freq=Rule.DAILY, interval=1,
+                            freq_type=Rule.COUNT, count=3)
+        self.url = reverse('export-recurrence-occurrences', args=[self.recurrence.pk])
+
+    def get(self, url, etag=None, **params):
+        params.setdefault('start', '2020-01-01')
+        params.setdefault('end', '2020-02-01')
+        if etag:
+            return self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        return self.client.get(url, params)
+
+    def test_ndjson(self):
+        response = self.get(self.url, format='ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'recurrence': self.recurrence.pk, 'start': f'2020-01-0{day}T10:00:00+00:00'} for day in (1, 2, 3)
+        ])
+
+    def test_ics(self):
+        response = self.get(reverse('export-occurrences'), ids=str(self.recurrence.pk))
+        content = b''.join(response.streaming_content).decode()
+        self.assertTrue(content.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertEqual(content.count('BEGIN:VEVENT'), 3)
+        self.assertIn('DTSTART:20200102T100000Z', content)
+
+    def test_etag(self):
+        etag = self.get(self.url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.get(self.url, etag=etag)
+        self.assertEqual(response.status_code, 304)
+        RDate.objects.create(recurrence=self.recurrence, naive_dt=date(2020, 1, 10))
+        response = self.get(self.url, etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content).decode().count('BEGIN:VEVENT'), 4)
+
+    def test_bad_request(self):
+        self.assertEqual(self.get(self.url, format='xml').status_code, 400)
+        self.assertEqual(self.get(self.url, start='tomorrow').status_code, 400)
+
+
+class TimezoneTestCase(unittest.TestCase):
+
+    def test_registry(self):
+        self.assertIs(get_timezone('America/La_Paz'), get_timezone('America/La_Paz'))
+        self.assertIn(('America/La_Paz', 'America/La_Paz'), Recurrence.TIME_ZONE_LIST)
+
+    @unittest.skipIf(zoneinfo is None, "zoneinfo is required")
+    def test_zoneinfo(self):
+        recurrence = Recurrence(timezone='Europe/Madrid', start_time=time(10, 0))
+        rule = Rule(recurrence=recurrence, freq=Rule.WEEKLY, interval=1, wkst=0, dtstart=date(2020, 3, 23),
+                    freq_type=Rule.COUNT, count=2)
+        with override_settings(DJANGORRULES_USE_ZONEINFO=True):
+            self.assertIsInstance(recurrence.get_timezone(), zoneinfo.ZoneInfo)
+            self.assertIsNone(fastpath.simple_rule(rule, recurrence.get_timezone(), recurrence.start_time))
+            # zoneinfo keeps the local time across the DST change
+            self.assertEqual([dt.hour for dt in rule.to_dateutil_rule], [10, 10])
+        self.assertEqual([dt.astimezone(get_timezone('Europe/Madrid')).hour for dt in rule.to_dateutil_rule],
+                         [10, 11])
+
+    @unittest.skipIf(zoneinfo is None, "zoneinfo is required")
+    def test_caches_follow_the_setting(self):
+        text = 'DTSTART;TZID=Europe/Madrid:20200323T100000\nRRULE:FREQ=WEEKLY;COUNT=2'
+        recurrence = Recurrence(pk=1, version=1, ical_text=text, timezone='Europe/Madrid', start_time=time(10, 0))
+        key = ruleset_cache.make_key(recurrence)
+        # pytz keeps the utc offset of dtstart, zoneinfo the local time
+        self.assertEqual([dt.astimezone(pytz.utc).hour for dt in from_ical(text)], [9, 9])
+        with override_settings(DJANGORRULES_USE_ZONEINFO=True):
+            self.assertNotEqual(ruleset_cache.make_key(recurrence), key)
+            self.assertEqual([dt.astimezone(pytz.utc).hour for dt in from_ical(text)], [9, 8])
+        self.assertEqual([dt.astimezone(pytz.utc).hour for dt in from_ical(text)], [9, 9])
+
+
+@unittest.skipIf(zoneinfo is None, "zoneinfo is required")
+class RecomputeTestCase(TestCase):
+
+    def test_recompute_recurrences(self):
+        recurrence = Recurrence.objects.create(timezone='Europe/Madrid', start_time=time(10, 0))
+        Rule.objects.create(recurrence=recurrence, dtstart=date(2020, 3, 23), freq=Rule.WEEKLY, interval=1,
+                            freq_type=Rule.COUNT, count=2)
+
+        def utc_hours():
+            rule = recurrence.rules.get()
+            starts = recurrence.occurrences.order_by('utc_start').values_list('utc_start', flat=True)
+            return rule.utc_last_occurrence.astimezone(pytz.utc).hour, [dt.astimezone(pytz.utc).hour for dt in starts]
+
+        self.assertEqual(utc_hours(), (9, [9, 9]))
+        with override_settings(DJANGORRULES_USE_ZONEINFO=True):
+            call_command('recompute_recurrences', stdout=io.StringIO())
+            self.assertEqual(utc_hours(), (8, [9, 8]))
+        call_command('recompute_recurrences', ids=[recurrence.pk], stdout=io.StringIO())
+        self.assertEqual(utc_hours(), (9, [9, 9]))
+
+
+class CompiledRuleTestCase(TestCase):
+
+    def test_compiled_on_save(self):
+        recurrence = Recurrence.objects.create(timezone='UTC', start_time=time(10, 0))
+        rule = Rule.objects.create(recurrence=recurrence, dtstart=date(2020, 1, 1), freq=Rule.MONTHLY, interval=1,
+                                   year_month_mode=Rule.BY_DAY, byweekday=['1MO', '-1FR'], bymonth=['1', '6'],
+                                   bysetpos=['1'], freq_type=Rule.COUNT, count=5)
+        rule = Rule.objects.get(pk=rule.pk)
+        self.assertEqual(json.loads(rule.compiled), {
+            'freq': Rule.MONTHLY, 'interval': 1, 'wkst': 0, 'count': 5, 'bymonth': [1, 6], 'bymonthday': None,
+            'byweekday': [[0, 1], [4, -1]], 'bysetpos': [1],
+        })
+        rule.compiled = ''
+        expected = list(rule.to_dateutil_rule)
+        self.assertEqual(list(Rule.objects.get(pk=rule.pk).to_dateutil_rule), expected)
+        self.assertEqual(len(expected), 5)
+
+    def test_compiled_follows_the_fields(self):
+        recurrence = Recurrence.objects.create(timezone='UTC', start_time=time(10, 0))
+        rule = Rule.objects.create(recurrence=recurrence, dtstart=date(2020, 1, 1), freq=Rule.WEEKLY, interval=1,
+                                   byweekday=['MO'], freq_type=Rule.FOREVER)
+        self.assertEqual(rule.compiled_kwargs['byweekday'], [[0, None]])
+        rule.interval = 2
+        rule.byweekday = ['TU', 'FR']
+        self.assertEqual(rule.compiled_kwargs['interval'], 2)
+        self.assertEqual(rule.compiled_kwargs['byweekday'], [[1, None], [4, None]])
+
+    def test_stored_compiled(self):
+        recurrence = Recurrence.objects.create(timezone='UTC', start_time=time(10, 0))
+        rule = Rule.objects.create(recurrence=recurrence, dtstart=date(2020, 1, 1), freq=Rule.WEEKLY, interval=1,
+                                   byweekday=['MO'], freq_type=Rule.FOREVER)
+        # the stored JSON is read back instead of compiling the fields again
+        Rule.objects.filter(pk=rule.pk).update(compiled=rule.compiled.replace('"interval":1', '"interval":3'))
+        loaded = Rule.objects.get(pk=rule.pk)
+        with mock.patch.object(Rule, 'compile', side_effect=AssertionError):
+            self.assertEqual(loaded.compiled_kwargs['interval'], 3)
+        loaded.interval = 2
+        self.assertEqual(loaded.compiled_kwargs['interval'], 2)
+        self.assertEqual(Rule.objects.only('freq').get(pk=rule.pk).compiled_kwargs['interval'], 1)
+
+    def test_backfill(self):
+        recurrence = Recurrence.objects.create(timezone='UTC', start_time=time(10, 0))
+        rule = Rule.objects.create(recurrence=recurrence, dtstart=date(2020, 1, 1), freq=Rule.MONTHLY, interval=1,
+                                   year_month_mode=Rule.BY_DAY, byweekday=['1MO', '-1FR'], bymonth=['1', '6'],
+                                   bysetpos=['+1'], freq_type=Rule.COUNT, count=5)
+        Rule.objects.update(compiled='')
+        migration_backfill('0034_backfill_rule_compiled')()
+        self.assertEqual(Rule.objects.get(pk=rule.pk).compiled, rule.compiled)
+
+
+class MayFireOnTestCase(TestCase):
+
+    def setUp(self):
+        self.recurrence = Recurrence.objects.create(timezone='America/La_Paz', start_time=time(10, 0))
+        self.tuesdays = Rule.objects.create(recurrence=self.recurrence, dtstart=date(2020, 1, 1), freq=Rule.WEEKLY,
+                                            interval=1, byweekday=['TU'], freq_type=Rule.FOREVER)
+        self.march = Rule.objects.create(recurrence=self.recurrence, dtstart=date(2020, 1, 1), freq=Rule.YEARLY,
+                                         interval=1, year_month_mode=Rule.BY_DATE, bymonth=['3'],
+                                         bymonthday=['-1'], freq_type=Rule.FOREVER)
+        self.yearly = Rule.objects.create(recurrence=self.recurrence, dtstart=date(2020, 7, 15), freq=Rule.YEARLY,
+                                          interval=1, freq_type=Rule.COUNT, count=2)
+
+    def may_fire_on(self, day):
+        return set(Rule.objects.may_fire_on(day))
+
+    def test_may_fire_on(self):
+        self.assertEqual(self.may_fire_on(date(2021, 3, 2)), {self.tuesdays})
+        self.assertEqual(self.may_fire_on(date(2021, 3, 31)), {self.march})
+        self.assertEqual(self.may_fire_on(date(2022, 7, 15)), set())
+        self.assertEqual(self.may_fire_on(date(2020, 7, 15)), {self.yearly})
+        self.assertEqual(self.may_fire_on(date(2019, 12, 31)), set())
+        self.assertEqual(set(Recurrence.objects.may_fire_on(date(2021, 3, 2))), {self.recurrence})
+
+    def test_backfill(self):
+        Rule.objects.create(recurrence=self.recurrence, dtstart=date(2020, 1, 1), freq=Rule.MONTHLY, interval=1,
+                            year_month_mode=Rule.BY_DAY, byweekday=['-1FR'], freq_type=Rule.UNTIL,
+                            until_date=date(2020, 6, 1))
+        fields = ('utc_last_occurrence', 'month_mask', 'weekday_mask', 'monthday_mask')
+        expected = list(Rule.objects.order_by('pk').values_list(*fields))
+        Rule.objects.update(utc_last_occurrence=None, month_mask=Rule._meta.get_field('month_mask').default,
+                            weekday_mask=Rule._meta.get_field('weekday_mask').default,
+                            monthday_mask=Rule._meta.get_field('monthday_mask').default)
+        migration_backfill('0035_backfill_rule_last_occurrence_and_masks')()
+        self.assertEqual(list(Rule.objects.order_by('pk').values_list(*fields)), expected)
+
+    def test_masks_cover_the_occurrences(self):
+        rules = [
+            Rule(recurrence=self.recurrence, dtstart=date(2020, 1, 31), freq=freq, interval=interval, **kwargs)
+            for freq, interval, kwargs in [
+                (Rule.DAILY, 3, {'bymonth': ['2', '12']}),
+                (Rule.WEEKLY, 2, {}),
+                (Rule.MONTHLY, 1, {}),
+                (Rule.MONTHLY, 1, {'byweekday': ['-1FR', '2MO']}),
+                (Rule.MONTHLY, 2, {'bymonthday': ['-3', '5'], 'bysetpos': ['1']}),
+                (Rule.YEARLY, 1, {'bymonth': ['3', '5']}),
+            ]
+        ]
+        for rule in rules:
+            month_mask, weekday_mask, monthday_mask = rule.get_masks()
+            occurrences = rule.build_dateutil_rule(pytz.utc, time(10)).between(
+                datetime(2020, 1, 1, tzinfo=pytz.utc), datetime(2023, 1, 1, tzinfo=pytz.utc))
+            self.assertTrue(occurrences)
+            for dt in occurrences:
+                month_bit, weekday_bit, monthday_bits = date_bits(dt.date())
+                self.assertTrue(month_mask & month_bit and weekday_mask & weekday_bit and
+                                monthday_mask & monthday_bits, (rule.compile(), dt))
+
+
+class BenchmarkTestCase(TestCase):
+
+    def test_run_and_compare(self):
+        recurrences = benchmark.seed(len(benchmark.RULE_SHAPES))
+        report = benchmark.run(recurrences, repeat=1)
+        self.assertEqual(set(report['results']), set(benchmark.operations(recurrences)))
+        self.assertEqual(report['results']['between_12m']['queries'], 0)
+        self.assertEqual(benchmark.compare(report, report), [])
+        slower = {'results': {name: dict(result, best=result['best'] * 2 + 1)
+                              for name, result in report['results'].items()}}
+        self.assertEqual(len(benchmark.compare(report, slower)), len(report['results']))
+
+
+@override_settings(DJANGORRULES_INSTRUMENTATION_BACKEND='djangorrules.instrumentation.InMemoryBackend')
+class InstrumentationTestCase(TestCase):
+
+    def setUp(self):
+        self.recurrence = Recurrence.objects.create(timezone='UTC', start_time=time(10, 0))
+        Rule.objects.create(recurrence=self.recurrence, dtstart=date(2020, 1, 1), freq=Rule.DAILY, interval=1,
+                            freq_type=Rule.COUNT, count=10)
+        RDate.objects.create(recurrence=self.recurrence, naive_dt=date(2020, 1, 3), exclude=True)
+        self.backend = instrumentation.get_backend()
+        self.backend.reset()
+        ruleset_cache.clear()
+
+    def test_backend(self):
+        self.recurrence.to_dateutil_ruleset()
+        list(Recurrence.objects.occurrences_between(datetime(2020, 1, 1, tzinfo=pytz.utc),
+                                                    datetime(2020, 2, 1, tzinfo=pytz.utc)))
+        stats = self.backend.stats()
+        self.assertEqual(stats['operations']['occurrences_between']['occurrences'], 9)
+        self.assertEqual(stats['operations']['occurrences_between']['queries'], 3)
+        self.assertEqual(stats['operations']['to_dateutil_ruleset']['calls'], 2)
+        ruleset_call = next(call for call in stats['slowest'] if call['operation'] == 'to_dateutil_ruleset')
+        self.assertEqual((ruleset_call['recurrence_id'], ruleset_call['rules'], ruleset_call['r_dates']),
+                         (self.recurrence.pk, 1, 1))
+
+    def test_signal(self):
+        received = []
+
+        def receiver(**metrics):
+            received.append(metrics)
+
+        instrumentation.ruleset_measured.connect(receiver)
+        try:
+            Rule.objects.get(recurrence=self.recurrence).to_dateutil_rule
+        finally:
+            instrumentation.ruleset_measured.disconnect(receiver)
+        self.assertEqual([(item['operation'], item['queries']) for item in received], [('to_dateutil_rule', 1)])
+
+    def test_statsd_format(self):
+        backend = instrumentation.StatsdBackend(prefix='app')
+        self.assertEqual(backend.format('refresh_occurrences', 0.0015, 2, occurrences=10, rules=None), '\n'.join([
+            'app.refresh_occurrences.time:1.500|ms',
+            'app.refresh_occurrences.queries:2|c',
+            'app.refresh_occurrences.occurrences:10|h',
+        ]))
+
+    @override_settings(DJANGORRULES_INSTRUMENTATION_BACKEND=None)
+    def test_disabled(self):
+        self.assertFalse(instrumentation.is_enabled())
+        self.recurrence.to_dateutil_ruleset()
+        self.assertEqual(self.backend.stats()['operations'], {})
+
+
+class RuleTextTestCase(TestCase):
+
+    def setUp(self):
+        recurrence = Recurrence.objects.create(timezone='UTC', start_time=time(10, 0))
+        self.rule = Rule.objects.create(recurrence=recurrence, dtstart=date(2020, 1, 1), freq=Rule.WEEKLY,
+                                        interval=1, byweekday=['MO', 'FR'], freq_type=Rule.FOREVER)
+        rule_text_cache.clear()
+
+    def test_cached_by_values(self):
+        self.assertEqual(self.rule.rule_to_text(), 'weekly, each Monday and Friday, forever')
+        self.rule.interval = 2
+        self.rule.save()
+        self.assertEqual(str(Rule.objects.get(pk=self.rule.pk)), 'every 2 weeks, each Monday and Friday, forever')
+
+        # another instance and an edit in memory
+        other = Rule.objects.get(pk=self.rule.pk)
+        other.interval = 5
+        other.save()
+        self.rule.save()
+        self.assertEqual(str(Rule.objects.get(pk=self.rule.pk)), 'every 2 weeks, each Monday and Friday, forever')
+        self.rule.byweekday = ['TU']
+        self.assertEqual(str(self.rule), 'every 2 weeks, each Tuesday, forever')
+
+    def test_render_texts(self):
+        unsaved = Rule(dtstart=date(2020, 1, 1), freq=Rule.MONTHLY, interval=1, year_month_mode=Rule.BY_DAY,
+                       byweekday=['-1FR'], freq_type=Rule.COUNT, count=3)
+        self.assertEqual(render_texts([self.rule, unsaved], short=True), [
+            'weekly, each Monday and Friday, forever',
+            'monthly, on the last Friday, for 3 occurrences',
+        ])
+
+
+class AsyncTestCase(TestCase):
+
+    def setUp(self):
+        self.recurrence = Recurrence.objects.create(timezone='America/La_Paz', start_time=time(10, 0))
+        Rule.objects.create(recurrence=self.recurrence, dtstart=date(2020, 1, 1), freq=Rule.WEEKLY, interval=1,
+                            byweekday=['MO', 'TH'], freq_type=Rule.COUNT, count=20)
+        RDate.objects.create(recurrence=self.recurrence, naive_dt=date(2020, 1, 6), exclude=True)
+        other = Recurrence.objects.create(timezone='UTC', start_time=time(8, 0))
+        Rule.objects.create(recurrence=other, dtstart=date(2020, 1, 1), freq=Rule.DAILY, interval=3,
+                            freq_type=Rule.FOREVER)
+        self.after = datetime(2020, 1, 1, tzinfo=pytz.utc)
+        self.before = datetime(2020, 3, 1, tzinfo=pytz.utc)
+        self.expected = list(Recurrence.objects.occurrences_between(self.after, self.before))
+        ruleset_cache.clear()
+
+    async def test_aget_ruleset(self):
+        recurrence = await Recurrence.objects.aget(pk=self.recurrence.pk)
+        rule_set = await recurrence.aget_ruleset()
+        self.assertEqual(len(list(rule_set)), 19)
+        # the stored text is read again, without it the rules and dates are read with the async ORM
+        await Recurrence.objects.filter(pk=self.recurrence.pk).aupdate(ical_text='')
+        ruleset_cache.clear()
+        self.assertEqual(list(await recurrence.aget_ruleset()), list(rule_set))
+        self.assertEqual(recurrence.ical_text, '')
+
+    async def test_aoccurrences_between(self):
+        result = [item async for item in Recurrence.objects.aoccurrences_between(self.after, self.before)]
+        self.assertEqual(result, self.expected)
+
+    async def test_aoccurrences_between_streams(self):
+        result = [item async for item in Recurrence.objects.aoccurrences_between(self.after, self.before,
+                                                                                 chunk_size=2)]
+        self.assertEqual(result, self.expected)
+        # only the first chunks of the forever rule are expanded
+        occurrences = Recurrence.objects.aoccurrences_between(self.after, datetime(9000, 1, 1, tzinfo=pytz.utc),
+                                                              chunk_size=4)
+        result = []
+        with mock.patch('djangorrules.managers.islice', wraps=islice) as chunks:
+            async for item in occurrences:
+                result.append(item)
+                if len(result) == 10:
+                    break
+        await occurrences.aclose()
+        self.assertEqual(result, self.expected[:10])
+        self.assertLess(chunks.call_count, 10)
+
+
+class ExpandRecurrencesTestCase(TestCase):
+
+    def setUp(self):
+        now = timezone.now()
+        shapes = [(Rule.DAILY, None), (Rule.WEEKLY, None), (Rule.MONTHLY, Rule.BY_DATE), (Rule.YEARLY, Rule.BY_DATE)]
+        for i, (freq, mode) in enumerate(shapes):
+            recurrence = Recurrence.objects.create(timezone='America/La_Paz', start_time=time(10 + i))
+            Rule.objects.create(recurrence=recurrence, dtstart=now.date() - timedelta(days=30), freq=freq,
+                                interval=1, year_month_mode=mode, freq_type=Rule.FOREVER)
+            RDate.objects.create(recurrence=recurrence, naive_dt=now.date() + timedelta(days=3))
+        # a recurrence saved before ical_text existed
+        Recurrence.objects.filter(pk=recurrence.pk).update(ical_text='')
+
+    def occurrences(self):
+        return list(Occurrence.objects.order_by('recurrence_id', 'utc_start').values_list(
+            'recurrence_id', 'utc_start', 'local_date', 'is_exception'))
+
+    def test_same_as_refresh_occurrences(self):
+        expected = self.occurrences()
+        Occurrence.objects.all().delete()
+        self.assertEqual(expand_recurrences(workers=0, chunk_size=3)[0], 4)
+        self.assertEqual(self.occurrences(), expected)
+        Occurrence.objects.all().delete()
+        recurrences, occurrences = expand_recurrences(workers=2, chunk_size=1)
+        self.assertEqual((recurrences, occurrences), (4, len(expected)))
+        self.assertEqual(self.occurrences(), expected)
+
+
+class ImportRecurrencesTestCase(TestCase):
+
+    def setUp(self):
+        self.start = timezone.now().date() - timedelta(days=10)
+        self.rows = [
+            {
+                'timezone': 'America/La_Paz',
+                'start_time': '10:00',
+                'rules': [
+                    f"DTSTART:{self.start:%Y%m%d}\nRRULE:FREQ=WEEKLY;INTERVAL=1;WKST=MO;COUNT=10;BYDAY=MO,WE",
+                    {'freq': Rule.MONTHLY, 'dtstart': self.start, 'year_month_mode': Rule.BY_DATE,
+                     'bymonthday': [1, -1]},
+                ],
+                'r_dates': [
+                    self.start + timedelta(days=2),
+                    {'naive_dt': self.start + timedelta(days=4), 'exclude': True},
+                ],
+            },
+            {'timezone': 'Mars/Olympus', 'start_time': '10:00'},
+            {
+                'timezone': 'UTC',
+                'start_time': '08:00',
+                'rules': ['RRULE:FREQ=DAILY', f"DTSTART:{self.start:%Y%m%d}\nRRULE:FREQ=WEEKLY;BYHOUR=1"],
+            },
+        ]
+
+    def test_same_as_save(self):
+        (recurrence,), errors = import_recurrences(self.rows, batch_size=1)
+        self.assertEqual(sorted(errors), [1, 2])
+        self.assertTrue(errors[1][0].startswith('recurrence.timezone'))
+        self.assertEqual(errors[2], ['rules[0]: DTSTART is required', 'rules[1]: unsupported property BYHOUR'])
+
+        recurrence.refresh_from_db()
+        imported_occurrences = list(recurrence.occurrences.values_list('utc_start', 'is_exception'))
+        rules = list(recurrence.rules.order_by('pk').values())
+        self.assertTrue(imported_occurrences)
+
+        # the same data saved one by one
+        saved = Recurrence.objects.create(timezone='America/La_Paz', start_time=time(10))
+        Rule.objects.create(recurrence=saved, dtstart=self.start, freq=Rule.WEEKLY, interval=1, byweekday=['MO', 'WE'],
+                            freq_type=Rule.COUNT, count=10)
+        Rule.objects.create(recurrence=saved, dtstart=self.start, freq=Rule.MONTHLY, interval=1,
+                            year_month_mode=Rule.BY_DATE, bymonthday=['1', '-1'], freq_type=Rule.FOREVER)
+        RDate.objects.create(recurrence=saved, naive_dt=self.start + timedelta(days=2))
+        RDate.objects.create(recurrence=saved, naive_dt=self.start + timedelta(days=4), exclude=True)
+        saved.refresh_from_db()
+
+        self.assertEqual(recurrence.ical_text, saved.ical_text)
+        self.assertEqual(recurrence.next_occurrence_utc, saved.next_occurrence_utc)
+        ignored = ('id', 'recurrence_id')
+        self.assertEqual(
+            [{key: value for key, value in rule.items() if key not in ignored} for rule in rules],
+            [{key: value for key, value in rule.items() if key not in ignored}
+             for rule in saved.rules.order_by('pk').values()]
+        )
+        self.assertEqual(imported_occurrences, list(saved.occurrences.values_list('utc_start', 'is_exception')))
+
+    def test_all_or_nothing(self):
+        recurrences, errors = import_recurrences(self.rows, skip_invalid=False)
+        self.assertEqual(recurrences, [])
+        self.assertEqual(sorted(errors), [1, 2])
+        self.assertFalse(Recurrence.objects.exists())
+
+    def test_validated_like_clean(self):
+        rows = [{'timezone': 'UTC', 'start_time': '08:00', 'rules': [
+            {'freq': Rule.DAILY, 'dtstart': self.start, 'byweekday': ['MO']},
+            {'freq': Rule.MONTHLY, 'dtstart': self.start},
+        ], 'r_dates': [{'exclude': True}]}]
+        recurrences, errors = import_recurrences(rows)
+        self.assertEqual(errors[0], [
+            "rules[0].byweekday: Can't specify by weekday With Freq DAILY",
+            'rules[1].year_month_mode: mode field is required',
+            'r_dates[0].naive_dt: this field is required',
+        ])
+
+    def test_rejected_values(self):
+        rows = [
+            {'timezone': 'Europe/Madrid', 'start_time': '08:00', 'rules': [
+                'DTSTART;TZID=Europe/Madrid:20200101T080000\nRRULE:FREQ=DAILY;COUNT=2',
+                'DTSTART;TZID=Europe/Madrid:20200101T090000\nRRULE:FREQ=DAILY;COUNT=2',
+                'DTSTART;TZID=UTC:20200101T080000\nRRULE:FREQ=DAILY;COUNT=2',
+                'DTSTART:20200101T070000Z\nRRULE:FREQ=HOURLY;COUNT=2',
+            ]},
+            {'timezone': 'UTC', 'start_time': '08:00', 'rules': 'DTSTART:20200101\nRRULE:FREQ=DAILY'},
+        ]
+        recurrences, errors = import_recurrences(rows)
+        self.assertEqual(recurrences, [])
+        self.assertEqual(errors, {
+            0: [
+                'rules[1]: DTSTART time 09:00:00 is not the start time of the recurrence',
+                'rules[2]: DTSTART timezone UTC is not the timezone of the recurrence',
+                'rules[3]: unsupported FREQ HOURLY',
+            ],
+            1: ['rules: must be a list'],
+        })
+
+    def test_until_before_the_start_time(self):
+        # 7:00 and 8:00 in Madrid, the occurrence of the 5th at 8:00 is after the first UNTIL
+        rows = [{'timezone': 'Europe/Madrid', 'start_time': '08:00', 'rules': [
+            f'DTSTART;TZID=Europe/Madrid:20200101T080000\nRRULE:FREQ=DAILY;UNTIL={until}'
+            for until in ('20200105T060000Z', '20200105T070000Z', '20200105T075959')
+        ]}]
+        recurrences, errors = import_recurrences(rows)
+        self.assertEqual(errors, {})
+        rules = recurrences[0].rules.order_by('pk')
+        self.assertEqual([rule.until_date for rule in rules], [date(2020, 1, 4), date(2020, 1, 5), date(2020, 1, 4)])
+        last = max(recurrences[0].to_dateutil_ruleset())
+        self.assertEqual(last, datetime(2020, 1, 5, 7, 0, tzinfo=pytz.utc))
+
+
+class RecurrenceDiffTestCase(TestCase):
+
+    def setUp(self):
+        self.start = timezone.now().date() - timedelta(days=20)
+        self.recurrence = Recurrence.objects.create(timezone='America/La_Paz', start_time=time(10))
+        self.rule = Rule.objects.create(recurrence=self.recurrence, dtstart=self.start, freq=Rule.WEEKLY, interval=1,
+                                        byweekday=['MO', 'TH'], freq_type=Rule.UNTIL,
+                                        until_date=self.start + timedelta(days=200))
+        self.deltas = []
+        occurrences_changed.connect(self.receiver)
+
+    def tearDown(self):
+        occurrences_changed.disconnect(self.receiver)
+
+    def receiver(self, recurrence, start, end, added, removed, **kwargs):
+        self.deltas.append((start, end, added, removed))
+
+    def assertMaterialized(self):
+        occurrences = list(self.recurrence.occurrences.order_by('utc_start').values_list('utc_start', 'is_exception'))
+        self.recurrence.refresh_occurrences()
+        expected = list(self.recurrence.occurrences.order_by('utc_start').values_list('utc_start', 'is_exception'))
+        self.assertEqual(occurrences, expected)
+
+    def test_exdate(self):
+        day = next(dt for dt in self.recurrence.to_dateutil_ruleset() if dt.date() > self.start + timedelta(days=30))
+        RDate.objects.create(recurrence=self.recurrence, naive_dt=day.date(), exclude=True)
+        start, end, added, removed = self.deltas[-1]
+        self.assertEqual((start, end, added, removed), (day, day, [], [(day, False)]))
+        self.assertMaterialized()
+
+    def test_until(self):
+        self.rule.until_date = self.start + timedelta(days=100)
+        self.rule.save()
+        start, end, added, removed = self.deltas[-1]
+        self.assertEqual(start.date(), self.start + timedelta(days=100))
+        self.assertEqual(added, [])
+        self.assertTrue(removed and all(dt.date() > self.start + timedelta(days=100) for dt, is_exception in removed))
+        self.assertMaterialized()
+
+    def test_included_date_on_an_occurrence(self):
+        day = next(dt for dt in self.recurrence.to_dateutil_ruleset() if dt.date() > self.start + timedelta(days=30))
+        RDate.objects.create(recurrence=self.recurrence, naive_dt=day.date())
+        self.assertEqual(self.deltas[-1][2:], ([(day, True)], [(day, False)]))
+        self.assertMaterialized()
+
+    def test_rules_added_and_deleted(self):
+        rule = Rule.objects.create(recurrence=self.recurrence, dtstart=self.start, freq=Rule.DAILY, interval=3,
+                                   freq_type=Rule.COUNT, count=15)
+        self.assertMaterialized()
+        rule.interval = 4
+        rule.save()
+        self.assertMaterialized()
+        rule.delete()
+        self.assertMaterialized()
+        self.rule.freq_type, self.rule.until_date = Rule.FOREVER, None
+        self.rule.save()
+        self.assertMaterialized()
+
+    def test_unchanged(self):
+        count = len(self.deltas)
+        self.rule.save()
+        self.assertEqual(len(self.deltas), count)
+        self.assertEqual(diff.components(self.recurrence.ical_text), diff.components(self.recurrence.to_ical()))
+
+
+class MaterializeTestCase(TestCase):
+
+    def setUp(self):
+        now = timezone.now()
+        for i in range(5):
+            recurrence = Recurrence.objects.create(timezone='Europe/Madrid', start_time=time(8 + i))
+            Rule.objects.create(recurrence=recurrence, dtstart=now.date() - timedelta(days=10), freq=Rule.DAILY,
+                                interval=i + 1, freq_type=Rule.FOREVER)
+            RDate.objects.create(recurrence=recurrence, naive_dt=now.date() + timedelta(days=2), exclude=True)
+
+    def occurrences(self):
+        return list(Occurrence.objects.order_by('recurrence_id', 'utc_start').values_list(
+            'recurrence_id', 'utc_start', 'is_exception'))
+
+    def test_extend_horizon(self):
+        until = Recurrence.objects.first().expanded_until
+        self.assertIsNotNone(until)
+        # nothing is behind the horizon yet
+        self.assertEqual(list(extend_horizon(horizon=365)), [])
+
+        chunks = list(extend_horizon(horizon=400, slack=0, chunk_size=2))
+        self.assertEqual([recurrences for recurrences, occurrences in chunks], [2, 2, 1])
+        extended = self.occurrences()
+        self.assertTrue(all(recurrence.expanded_until > until for recurrence in Recurrence.objects.all()))
+
+        for recurrence in Recurrence.objects.all():
+            recurrence.refresh_occurrences(until=recurrence.expanded_until)
+        self.assertEqual(extended, self.occurrences())
+
+    def test_resume(self):
+        Recurrence.objects.update(expanded_until=None)
+        Occurrence.objects.filter(recurrence_id__in=Recurrence.objects.order_by('-pk').values('pk')[:3]).delete()
+        horizon = extend_horizon(horizon=30, chunk_size=2)
+        self.assertEqual(next(horizon)[0], 2)
+        horizon.close()
+        # the first chunk is committed, the next run only does the rest
+        self.assertEqual(sum(recurrences for recurrences, occurrences in extend_horizon(horizon=30)), 3)
+        self.assertEqual(Occurrence.objects.filter(utc_start__gt=timezone.now() + timedelta(days=31)).count(), 0)
+        self.assertEqual(Recurrence.objects.filter(expanded_until__isnull=True).count(), 0)
+        self.assertEqual(len(set(self.occurrences())), len(self.occurrences()))
+
+    @override_settings(DJANGORRULES_OCCURRENCE_RETENTION=5)
+    def test_resume_keeps_the_retained(self):
+        old = Occurrence.objects.filter(utc_start__lt=timezone.now() - timedelta(days=6)).count()
+        self.assertGreater(old, 0)
+        Recurrence.objects.update(expanded_until=None)
+        self.assertEqual(sum(recurrences for recurrences, occurrences in extend_horizon(horizon=30)), 5)
+        self.assertEqual(Occurrence.objects.filter(utc_start__lt=timezone.now() - timedelta(days=6)).count(), old)
+        self.assertEqual(len(set(self.occurrences())), len(self.occurrences()))
+
+    def test_changes_stay_below_the_watermark(self):
+        recurrence = Recurrence.objects.first()
+        Recurrence.objects.filter(pk=recurrence.pk).update(expanded_until=timezone.now() + timedelta(days=20))
+        Occurrence.objects.filter(recurrence=recurrence, utc_start__gt=timezone.now() + timedelta(days=20)).delete()
+        RDate.objects.create(recurrence=recurrence, naive_dt=timezone.now().date() + timedelta(days=100))
+        self.assertFalse(recurrence.occurrences.filter(utc_start__gt=timezone.now() + timedelta(days=21)).exists())
+
+
+class HistogramTestCase(TestCase):
+
+    def setUp(self):
+        start = date(2020, 1, 1)
+        shapes = [
+            [{'freq': Rule.DAILY, 'interval': 3}],
+            [{'freq': Rule.WEEKLY, 'byweekday': ['MO', 'FR'], 'freq_type': Rule.COUNT, 'count': 40},
+             {'freq': Rule.DAILY, 'interval': 5},
+             {'freq': Rule.WEEKLY, 'byweekday': ['FR'], 'exclude': True}],
+            [{'freq': Rule.MONTHLY, 'year_month_mode': Rule.BY_DATE, 'bymonthday': ['3', '20'],
+              'freq_type': Rule.UNTIL, 'until_date': date(2020, 11, 1)}],
+            [{'freq': Rule.MONTHLY, 'year_month_mode': Rule.BY_DAY, 'byweekday': ['-1FR']},
+             {'freq': Rule.DAILY, 'interval': 2, 'exclude': True}],
+        ]
+        for i, rules in enumerate(shapes):
+            recurrence = Recurrence.objects.create(timezone=['Europe/Madrid', 'America/La_Paz'][i % 2],
+                                                   start_time=time(1 + i * 7))
+            for fields in rules:
+                fields = dict({'interval': 1, 'freq_type': Rule.FOREVER}, **fields)
+                Rule.objects.create(recurrence=recurrence, dtstart=start + timedelta(days=i), **fields)
+            RDate.objects.create(recurrence=recurrence, naive_dt=date(2020, 3, 10), exclude=True)
+            RDate.objects.create(recurrence=recurrence, naive_dt=date(2020, 3, 11))
+            RDate.objects.create(recurrence=recurrence, naive_dt=date(2020, 4, 24), exclude=True)
+
+    def expected(self, start, end, bucket, tz):
+        from .histogram import bucket_edges
+
+        edges = [tz.localize(datetime.combine(day, time())) for day in bucket_edges(start, end, bucket)]
+        counts = [0] * (len(edges) - 1)
+        for recurrence in Recurrence.objects.all():
+            for dt in recurrence.to_dateutil_ruleset().between(edges[0], edges[-1], inc=True):
+                if dt < edges[-1]:
+                    counts[sum(1 for edge in edges[1:] if edge <= dt)] += 1
+        return counts
+
+    def test_same_as_expanding(self):
+        for bucket in ('day', 'week', 'month'):
+            for tz in ('UTC', 'Europe/Madrid'):
+                with self.subTest(bucket=bucket, tz=tz):
+                    counts = Recurrence.objects.histogram(date(2020, 2, 10), date(2020, 12, 5), bucket, tz)
+                    expected = self.expected(date(2020, 2, 10), date(2020, 12, 5), bucket, pytz.timezone(tz))
+                    self.assertEqual(counts.tolist(), expected)
+                    self.assertEqual(counts.typecode, 'q')
+                    with mock.patch.object(fastpath, 'np', None):
+                        counts = Recurrence.objects.histogram(date(2020, 2, 10), date(2020, 12, 5), bucket, tz)
+                    self.assertEqual(counts.tolist(), expected)
+
+    def test_intersect(self):
+        madrid = get_timezone('Europe/Madrid')
+        rules = [
+            Rule(dtstart=date(2020, 1, 1), freq=Rule.DAILY, interval=4, freq_type=Rule.COUNT, count=30),
+            Rule(dtstart=date(2020, 1, 2), freq=Rule.WEEKLY, interval=1, byweekday=['MO', 'TH']),
+            Rule(dtstart=date(2020, 1, 1), freq=Rule.WEEKLY, interval=3, byweekday=['SU', 'TH'], wkst=6),
+        ]
+        for a, b in [(0, 1), (1, 2), (0, 2)]:
+            first = fastpath.simple_rule(rules[a], madrid, time(10))
+            second = fastpath.simple_rule(rules[b], madrid, time(10))
+            both = fastpath.intersect(first, second)
+            after, before = madrid.localize(datetime(2019, 12, 1)), madrid.localize(datetime(2021, 6, 1))
+            expected = set(rules[a].build_dateutil_rule(madrid, time(10)).between(after, before)) & set(
+                rules[b].build_dateutil_rule(madrid, time(10)).between(after, before))
+            self.assertEqual(fastpath.count_between(both, after, before), len(expected))
+        # different times of day never match
+        other = fastpath.simple_rule(rules[1], madrid, time(11))
+        self.assertEqual(fastpath.count_upto(fastpath.intersect(first, other), before), 0)
+
+
+class ConflictsTestCase(TestCase):
+
+    def create(self, tz, hour, rule_fields=(), r_dates=()):
+        recurrence = Recurrence.objects.create(timezone=tz, start_time=time(hour))
+        for fields in rule_fields:
+            fields = dict({'interval': 1, 'freq_type': Rule.FOREVER, 'dtstart': date(2020, 1, 1)}, **fields)
+            Rule.objects.create(recurrence=recurrence, **fields)
+        for day in r_dates:
+            RDate.objects.create(recurrence=recurrence, naive_dt=day)
+        return recurrence
+
+    def setUp(self):
+        # every wednesday at 10 in Madrid
+        self.room = self.create('Europe/Madrid', 10, [{'freq': Rule.WEEKLY, 'byweekday': ['WE']}])
+        self.odd_days = self.create('Europe/Madrid', 10, [{'freq': Rule.DAILY, 'interval': 2}])
+        self.even_days = self.create('Europe/Madrid', 10, [{'freq': Rule.DAILY, 'interval': 2,
+                                                            'dtstart': date(2020, 1, 2)}])
+        self.weekends = self.create('Europe/Madrid', 10, [{'freq': Rule.WEEKLY, 'byweekday': ['SA', 'SU']}])
+        # 4:00 in La Paz is 9:00 in Madrid in winter, 10:00 in summer (pytz keeps the offset of dtstart)
+        self.la_paz = self.create('America/La_Paz', 5, [{'freq': Rule.MONTHLY, 'year_month_mode': Rule.BY_DAY,
+                                                         'byweekday': ['1WE']}])
+        self.once = self.create('Europe/Madrid', 10, r_dates=[date(2020, 1, 22)])
+        self.after = pytz.utc.localize(datetime(2020, 1, 1))
+        self.before = pytz.utc.localize(datetime(2020, 6, 1))
+
+    def expected(self, duration=None):
+        own = self.room.to_dateutil_ruleset().between(self.after, self.before, inc=True)
+        result = []
+        for other in Recurrence.objects.exclude(pk=self.room.pk):
+            occurrences = other.to_dateutil_ruleset().between(self.after - timedelta(days=1), self.before, inc=True)
+            for dt in own:
+                if any(abs(dt - value) < (duration or timedelta(microseconds=1)) for value in occurrences):
+                    result.append((dt, other.pk))
+        return [(pk, dt) for dt, pk in sorted(result)]
+
+    def test_conflicts_with(self):
+        seen = []
+        find_conflicts = conflicts_module.find_conflicts
+
+        def spy(recurrence, candidates, *args):
+            seen.extend(candidates)
+            return find_conflicts(recurrence, seen, *args)
+
+        with mock.patch('djangorrules.managers.find_conflicts', spy):
+            found = Recurrence.objects.conflicts_with(self.room, self.after, self.before, limit=100)
+        self.assertEqual(found, self.expected())
+        self.assertIn((self.once.pk, Recurrence.objects.get(pk=self.once.pk).to_dateutil_ruleset()[0]), found)
+        # the weekends are pruned by the masks
+        self.assertNotIn(self.weekends.pk, [recurrence.pk for recurrence in seen])
+
+        self.assertEqual(Recurrence.objects.conflicts_with(self.room, self.after, self.before, limit=3),
+                         self.expected()[:3])
+
+    def test_duration(self):
+        found = Recurrence.objects.conflicts_with(self.room, self.after, self.before, limit=100,
+                                                  duration=timedelta(hours=2))
+        self.assertEqual(found, self.expected(timedelta(hours=2)))
+        self.assertIn(self.la_paz.pk, {pk for pk, dt in found})
+
+    def test_timezones_two_days_apart(self):
+        # monday 1:00 in UTC+14 and saturday 23:00 in UTC-12 are the same instant
+        kiritimati = self.create('Pacific/Kiritimati', 1, [{'freq': Rule.WEEKLY, 'byweekday': ['MO']}])
+        other = self.create('Etc/GMT+12', 23, [{'freq': Rule.WEEKLY, 'byweekday': ['SA']}])
+        after = pytz.utc.localize(datetime(2030, 1, 1))
+        before = pytz.utc.localize(datetime(2030, 3, 1))
+        found = Recurrence.objects.conflicts_with(kiritimati, after, before, limit=100)
+        self.assertEqual(len(found), 8)
+        self.assertEqual({pk for pk, dt in found}, {other.pk})
+
+    def test_periodicity(self):
+        odd = conflicts_module.simple_rules(self.odd_days)
+        even = conflicts_module.simple_rules(self.even_days)
+        self.assertFalse(conflicts_module.may_coincide(odd, even, self.after, self.before))
+        self.assertTrue(conflicts_module.may_coincide(odd, conflicts_module.simple_rules(self.room),
+                                                      self.after, self.before))
+        self.assertIsNone(conflicts_module.simple_rules(self.once))
+        self.assertEqual(Recurrence.objects.filter(pk=self.even_days.pk).conflicts_with(self.odd_days), [])
+
+    def test_timeout(self):
+        with self.assertRaises(conflicts_module.ConflictsTimeout) as raised:
+            Recurrence.objects.conflicts_with(self.room, self.after, self.before, limit=100, timeout=-1)
+        self.assertEqual((raised.exception.conflicts, raised.exception.checked), ([], 0))
+        self.assertEqual(Recurrence.objects.conflicts_with(self.room, self.after, self.before, limit=100, timeout=60),
+                         self.expected())
+
+
+class CompactOccurrencesTestCase(TestCase):
+
+    def setUp(self):
+        start = date(2020, 1, 1)
+        self.simple = Recurrence.objects.create(timezone='Europe/Madrid', start_time=time(9, 30))
+        Rule.objects.create(recurrence=self.simple, dtstart=start, freq=Rule.WEEKLY, interval=1,
+                            byweekday=['MO', 'TH'], freq_type=Rule.FOREVER)
+        Rule.objects.create(recurrence=self.simple, dtstart=start, freq=Rule.DAILY, interval=10,
+                            freq_type=Rule.COUNT, count=20)
+        Rule.objects.create(recurrence=self.simple, dtstart=start, freq=Rule.WEEKLY, interval=2, byweekday=['TH'],
+                            freq_type=Rule.FOREVER, exclude=True)
+        RDate.objects.create(recurrence=self.simple, naive_dt=date(2020, 2, 2))
+        RDate.objects.create(recurrence=self.simple, naive_dt=date(2020, 2, 3), exclude=True)
+        self.other = Recurrence.objects.create(timezone='America/La_Paz', start_time=time(18))
+        Rule.objects.create(recurrence=self.other, dtstart=start, freq=Rule.MONTHLY, interval=1,
+                            year_month_mode=Rule.BY_DAY, byweekday=['-1FR'], freq_type=Rule.FOREVER)
+        self.after = pytz.utc.localize(datetime(2020, 1, 6))
+        self.before = pytz.utc.localize(datetime(2022, 1, 6))
+
+    def test_same_as_between(self):
+        for use_numpy in (True, False):
+            for recurrence in (self.simple, self.other):
+                with self.subTest(use_numpy=use_numpy, recurrence=recurrence.pk):
+                    occurrences = recurrence.expand_compact(self.after, self.before, use_numpy=use_numpy)
+                    expected = recurrence.to_dateutil_ruleset().between(self.after, self.before)
+                    self.assertEqual(list(occurrences), expected)
+                    self.assertEqual(occurrences.nbytes, 8 * len(expected))
+                    self.assertEqual(occurrences[3], expected[3])
+                    self.assertEqual(occurrences[3].tzinfo.zone, recurrence.timezone)
+
+    def test_without_numpy(self):
+        expected = self.simple.to_dateutil_ruleset().between(self.after, self.before)
+        with mock.patch.object(fastpath, 'np', None):
+            occurrences = self.simple.expand_compact(self.after, self.before, use_numpy=True)
+        self.assertIsInstance(occurrences.seconds, memoryview)
+        self.assertEqual(list(occurrences), expected)
+
+    def test_slicing(self):
+        occurrences = self.simple.expand_compact(self.after, self.before, inc=True, use_numpy=False)
+        expected = self.simple.to_dateutil_ruleset().between(self.after, self.before, inc=True)
+        after, before = expected[5], expected[40]
+        for inc in (True, False):
+            view = occurrences.between(after, before, inc=inc)
+            self.assertEqual(list(view), [
+                dt for dt in expected if (after <= dt <= before if inc else after < dt < before)
+            ])
+            self.assertIs(view.seconds.obj, occurrences.seconds.obj)
+        self.assertEqual(len(occurrences.between(before, after)), 0)
+
+    def test_queryset(self):
+        result = {item.recurrence_id: item for item in Recurrence.objects.expand_compact(self.after, self.before)}
+        self.assertEqual(set(result), {self.simple.pk, self.other.pk})
+        self.assertEqual(len(result[self.other.pk]), 24)
+
+
+class ValidateManyTestCase(unittest.TestCase):
+    base = {'freq': Rule.MONTHLY, 'year_month_mode': Rule.BY_DAY, 'dtstart': date(2020, 1, 1), 'interval': 1,
+            'wkst': Rule.MONDAY, 'byweekday': ['MO'], 'freq_type': Rule.FOREVER}
+    invalid = [
+        {'year_month_mode': None},
+        {'freq': Rule.DAILY, 'year_month_mode': None},
+        {'bymonthday': ['5']},
+        {'byweekday': ['1MO', 'TU']},
+        {'freq': Rule.WEEKLY, 'year_month_mode': None, 'byweekday': ['1MO']},
+        {'freq_type': Rule.UNTIL},
+        {'freq_type': Rule.COUNT, 'count': 3, 'until_date': date(2021, 1, 1)},
+        {'byweekday': None, 'year_month_mode': Rule.BY_DATE, 'bymonthday': ['1'], 'bysetpos': ['9']},
+        {'interval': 0},
+        {'byweekday': ['XX']},
+    ]
+
+    def test_same_as_clean(self):
+        rule_dicts = [dict(self.base, **changes) for changes in self.invalid]
+        errors = validate_many([self.base] + rule_dicts)
+        self.assertEqual(sorted(errors), list(range(1, len(rule_dicts) + 1)))
+        for index, data in enumerate(rule_dicts, 1):
+            rule = Rule(**data)
+            with self.subTest(data=data), self.assertRaises(ValidationError) as raised:
+                rule.clean_fields(exclude=['recurrence', 'utc_dtstart'])
+                rule.clean()
+            # validate_many finds the error of clean_fields() or clean() and the ones after it
+            found = ValidationError(raised.exception.update_error_dict({}))
+            for field, messages in found.message_dict.items():
+                self.assertTrue(set(messages) <= set(errors[index][field]), (messages, errors[index]))
+
+    def test_converted_values(self):
+        rows = [
+            {'freq': Rule.DAILY, 'interval': '2'},
+            {'freq': str(Rule.MONTHLY), 'interval': 1},
+            {'freq': 'x', 'interval': 1},
+        ]
+        Rule(**rows[0]).full_clean(exclude=['recurrence', 'utc_dtstart'])
+        errors = validate_many(rows)
+        self.assertEqual(sorted(errors), [1, 2])
+        self.assertEqual(errors[1], {'year_month_mode': ['mode field is required']})
+        self.assertEqual(list(errors[2]), ['freq'])
+
+    def test_rule_values(self):
+        rule = Rule(**self.base)
+        self.assertEqual(validate_many([rule_values(rule)]), {})
+        self.assertIn('bysetpos', validate_many([dict(self.base, bysetpos=['-4'])])[0])
+
+    def test_weekday_tokens(self):
+        for value in ['MO', '1MO', '+2FR', '-1SU']:
+            pattern = Rule._get_byweekday_pattern(value)
+            self.assertEqual(WEEKDAY_TOKENS[value], pattern == RuleTestCase.pattern_weekday_with_nth)
+        for value in RuleTestCase.wrong_values:
+            self.assertNotIn(value, WEEKDAY_TOKENS)
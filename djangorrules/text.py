@@ -0,0 +1,233 @@
+"""
+natural text of a Rule, a fork from django recurrences
+
+the labels are defined once at module level and resolved once per language
+(see get_labels), rule_text() caches the rendered text by the values of the rendered
+fields, language and short, render_texts() renders a list of rules in one pass
+"""
+from datetime import datetime
+from functools import lru_cache
+
+from django.utils import dateformat
+from django.utils.translation import get_language, gettext, gettext_lazy as _, pgettext_lazy as _p
+
+from .cache import rule_text_cache
+from .utils import join_with_conjunction
+
+FREQUENCIES = (_('annually'), _('monthly'), _('weekly'), _('daily'))
+TIME_INTERVALS = (_('years'), _('months'), _('weeks'), _('days'))
+WEEKDAYS = (
+    _('Monday'), _('Tuesday'), _('Wednesday'),
+    _('Thursday'), _('Friday'), _('Saturday'), _('Sunday'),
+)
+
+# labels by short (abbreviated labels, i.e. 'Fri' instead of 'Friday')
+LABELS = {
+    True: {
+        'positional': {
+            1: _('1st %(weekday)s'),
+            2: _('2nd %(weekday)s'),
+            3: _('3rd %(weekday)s'),
+            4: _('4th %(weekday)s'),
+            -1: _('last %(weekday)s'),
+            -2: _('2nd last %(weekday)s'),
+            -3: _('3rd last %(weekday)s'),
+        },
+        # only this case only are permit from -3 up 4
+        'bysetpos': {
+            1: _('1st'),
+            2: _('2nd'),
+            3: _('3rd'),
+            4: _('4th'),
+            -1: _('last'),
+            -2: _('2nd last'),
+            -3: _('3rd last'),
+        },
+        'last_of_month': {
+            -1: _('last day'),
+            -2: _('2nd last day'),
+            -3: _('3rd last day'),
+            -4: _('4th last day'),
+        },
+        'months': (
+            _('Jan'), _('Feb'), _('Mar'), _('Apr'),
+            _p('month name', 'May'), _('Jun'), _('Jul'), _('Aug'),
+            _('Sep'), _('Oct'), _('Nov'), _('Dec'),
+        ),
+    },
+    False: {
+        'positional': {
+            1: _('first %(weekday)s'),
+            2: _('second %(weekday)s'),
+            3: _('third %(weekday)s'),
+            4: _('fourth %(weekday)s'),
+            -1: _('last %(weekday)s'),
+            -2: _('second last %(weekday)s'),
+            -3: _('third last %(weekday)s'),
+        },
+        'bysetpos': {
+            1: _('first'),
+            2: _('second'),
+            3: _('third'),
+            4: _('fourth'),
+            -1: _('last'),
+            -2: _('second last'),
+            -3: _('third last'),
+        },
+        'last_of_month': {
+            -1: _('last day'),
+            -2: _('second last day'),
+            -3: _('third last day'),
+            -4: _('fourth last day'),
+        },
+        'months': (
+            _('January'), _('February'), _('March'), _('April'),
+            _p('month name', 'May'), _('June'), _('July'), _('August'),
+            _('September'), _('October'), _('November'), _('December'),
+        ),
+    },
+}
+
+
+def _resolve(value):
+    if isinstance(value, dict):
+        return {key: str(item) for key, item in value.items()}
+    return tuple(str(item) for item in value)
+
+
+@lru_cache(maxsize=None)
+def get_labels(language, short):
+    """
+    the labels as plain strings of the language, must be called while the language is active
+    """
+    labels = {name: _resolve(value) for name, value in LABELS[short].items()}
+    labels.update(
+        frequencies=_resolve(FREQUENCIES),
+        time_intervals=_resolve(TIME_INTERVALS),
+        weekdays=_resolve(WEEKDAYS),
+        monthdays={day: dateformat.format(datetime(1, 1, day), 'jS') for day in range(1, 32)},
+    )
+    return labels
+
+
+def render(rule, labels):
+    """
+    render the given `Rule` as natural text with the labels of get_labels()
+    """
+    conjunction = 'and'  # use as last separator in join() method
+    kwargs = rule.compiled_kwargs
+    parts = []
+
+    if rule.interval > 1:
+        parts.append(
+            gettext('every %(number)s %(freq)s') % {
+                'number': rule.interval,
+                'freq': labels['time_intervals'][rule.freq]
+            })
+    else:
+        parts.append(labels['frequencies'][rule.freq])
+
+    if kwargs['bymonth']:
+        # bymonth are 1-indexed (January is 1), months
+        # are 0-indexed (January is 0).
+        # change conjunction to 'and' with freq monthly and bysetpos
+        # bysetpos with monthly apply nth only to byweekday and bymonthday
+        # however with yearly apply to bymonth, byweekday and bymonth day
+        if kwargs['bysetpos'] and rule.freq == rule.MONTHLY:
+            conjunction = 'and'
+        elif kwargs['bysetpos'] and rule.freq == rule.YEARLY:
+            conjunction = 'or'
+
+        months = [labels['months'][month_index - 1] for month_index in kwargs['bymonth']]
+        items = join_with_conjunction(months, conjunction)
+        parts.append(gettext('in %(items)s') % {'items': items})
+
+    if kwargs['bysetpos']:
+        conjunction = 'or'
+
+    if kwargs['bymonthday'] and not kwargs['bymonth']:
+        if rule.freq == rule.YEARLY:
+            parts.append('each month')
+
+    if rule.freq == rule.YEARLY or rule.freq == rule.MONTHLY:
+        if kwargs['bymonthday']:
+            items = [
+                labels['monthdays'][day] if day > 0 else labels['last_of_month'].get(day, day)
+                for day in kwargs['bymonthday']
+            ]
+            items = join_with_conjunction(items, conjunction)
+            parts.append(gettext('on the %(items)s') % {'items': items})
+
+        elif kwargs['byweekday']:
+            items = [
+                labels['positional'].get(n, '%(weekday)s') % {'weekday': labels['weekdays'][day]}
+                for day, n in kwargs['byweekday']
+            ]
+            items = join_with_conjunction(items, conjunction)
+            parts.append(gettext('on the %(items)s') % {'items': items})
+
+    if rule.freq == rule.WEEKLY:
+        if kwargs['byweekday']:
+            items = [labels['weekdays'][day] for day, n in kwargs['byweekday']]
+            items = join_with_conjunction(items, conjunction)
+            parts.append(gettext('each %(items)s') % {'items': items})
+
+    # daily frequencies has no additional formatting,
+
+    if kwargs['bysetpos']:
+        nth_text = ' instance'
+        items = [labels['bysetpos'].get(setpos) for setpos in kwargs['bysetpos']]
+        items = join_with_conjunction(items, conjunction) + nth_text
+
+        parts.append(gettext('only the %(items)s') % {'items': items})
+
+    if rule.count:
+        if rule.count == 1:
+            parts.append(gettext('for once'))
+        else:
+            parts.append(gettext('for %(number)s occurrences') % {
+                'number': rule.count
+            })
+    elif rule.until_date:
+        parts.append(gettext('until the %(date)s') % {
+            'date': dateformat.format(rule.until_date, 'D d F Y')
+        })
+    else:
+        parts.append(gettext('forever'))
+    return gettext(', ').join(str(part) for part in parts)
+
+
+# the fields read by render(), their values are the cache key so two instances of
+# a rule or an instance edited in memory never get the text of other values
+TEXT_FIELDS = ('freq', 'interval', 'bymonth', 'bymonthday', 'byweekday', 'bysetpos', 'count', 'until_date')
+
+
+def _text_key(rule, short, language):
+    values = (getattr(rule, name) for name in TEXT_FIELDS)
+    return (language, short) + tuple(tuple(value) if isinstance(value, list) else value for value in values)
+
+
+def _cached_render(rule, short, language, labels):
+    key = _text_key(rule, short, language)
+    text = rule_text_cache.get(key)
+    if text is None:
+        text = render(rule, labels)
+        rule_text_cache.set(key, text)
+    return text
+
+
+def rule_text(rule, short=False):
+    """
+    text of the rule in the active language, cached by the rendered values, language and short
+    """
+    language = get_language()
+    return _cached_render(rule, short, language, get_labels(language, short))
+
+
+def render_texts(rules, short=False):
+    """
+    list with the text of every rule, the labels are resolved once for all of them
+    """
+    language = get_language()
+    labels = get_labels(language, short)
+    return [_cached_render(rule, short, language, labels) for rule in rules]
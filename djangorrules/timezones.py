@@ -0,0 +1,77 @@
+"""
+shared timezone registry
+
+get_timezone() keeps the tzinfo of every name, so building thousands of rules
+doesn't look up the same zone again. with DJANGORRULES_USE_ZONEINFO = True the
+zoneinfo module (python 3.9+) is used instead of pytz, localize() works with both.
+
+pytz and zoneinfo don't give the same occurrences: dateutil keeps the utc offset
+of dtstart with pytz and the local time of dtstart across DST changes with zoneinfo
+"""
+import pytz
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .conf import app_settings
+
+try:
+    import zoneinfo
+except ImportError:  # python < 3.9
+    zoneinfo = None
+
+
+# name -> tzinfo, cleared when DJANGORRULES_USE_ZONEINFO changes
+_registry = {}
+
+
+def get_timezone(name):
+    """
+    tzinfo of the timezone name, the same object is returned for the same name
+    """
+    try:
+        return _registry[name]
+    except KeyError:
+        pass
+    if app_settings.USE_ZONEINFO and zoneinfo is not None:
+        tz = zoneinfo.ZoneInfo(name)
+    else:
+        tz = pytz.timezone(name)
+    _registry[name] = tz
+    return tz
+
+
+@receiver(setting_changed)
+def _clear_registry(setting, **kwargs):
+    if setting == 'DJANGORRULES_USE_ZONEINFO':
+        from .ical import _parse
+
+        _registry.clear()
+        # the parsed rulesets hold the tzinfos of the other module
+        _parse.cache_clear()
+
+
+def is_pytz(tz):
+    return hasattr(tz, 'localize')
+
+
+def localize(tz, naive):
+    """
+    aware datetime of a naive datetime in tz, pytz timezones need localize()
+    to pick the right offset, zoneinfo timezones are just attached
+    """
+    if is_pytz(tz):
+        return tz.localize(naive)
+    return naive.replace(tzinfo=tz)
+
+
+class TimezoneChoices:
+    """
+    lazy (name, name) choices of every timezone, pytz.all_timezones
+    is only read the first time the choices are iterated
+    """
+
+    def __iter__(self):
+        return ((name, name) for name in pytz.all_timezones)
+
+    def __len__(self):
+        return len(pytz.all_timezones)
@@ -1,6 +1,8 @@
 from django.urls import path
-from .views import test_form
+from .views import export_occurrences, test_form
 
 urlpatterns = [
-    path('rule', test_form, name='create-rule')
+    path('rule', test_form, name='create-rule'),
+    path('occurrences', export_occurrences, name='export-occurrences'),
+    path('recurrences/<int:pk>/occurrences', export_occurrences, name='export-recurrence-occurrences'),
 ]
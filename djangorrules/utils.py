@@ -1,3 +1,6 @@
+import calendar
+
+from dateutil.rrule import rruleset
 from django.utils.translation import gettext_lazy as _
 
 
@@ -8,3 +11,72 @@ def join_with_conjunction(value_list, conjunction='and'):
         value_list = value_list[:-1]
     items = _(', '.join(str(value) for value in value_list) + last)
     return items
+
+
+def xbetween(rule_set, after, before, inc=False):
+    """
+    lazy version of rruleset.between, yields the occurrences
+    between after and before instead of building a list
+    """
+    for dt in rule_set.xafter(after, inc=inc):
+        if dt > before or (not inc and dt == before):
+            return
+        yield dt
+
+
+def copy_ruleset(rule_set, cache=False):
+    """
+    shallow copy of a ruleset, rruleset sorts its dates while iterating
+    so a shared instance must never be handed out. rrule instances are
+    immutable and are shared between the copies
+    """
+    new = rruleset(cache=cache)
+    new._rrule = list(rule_set._rrule)
+    new._exrule = list(rule_set._exrule)
+    new._rdate = list(rule_set._rdate)
+    new._exdate = list(rule_set._exdate)
+    return new
+
+
+# bitmasks of Rule.month_mask, weekday_mask and monthday_mask, the monthdays
+# use bits 0-30 for the days 1 to 31 and bits 31-61 for the days -1 to -31
+ALL_MONTHS = (1 << 12) - 1
+ALL_WEEKDAYS = (1 << 7) - 1
+ALL_MONTHDAYS = (1 << 62) - 1
+
+
+def monthday_bit(day):
+    return 1 << (day - 1) if day > 0 else 1 << (30 - day)
+
+
+def date_bits(day):
+    """
+    month, weekday and monthday bits of a date, the monthday bits
+    include the positive and the negative (from the month end) day
+    """
+    days_in_month = calendar.monthrange(day.year, day.month)[1]
+    return (
+        1 << (day.month - 1),
+        1 << day.weekday(),
+        monthday_bit(day.day) | monthday_bit(day.day - days_in_month - 1),
+    )
+
+
+def _rotate(mask, shift, size):
+    shift %= size
+    return ((mask << shift) | (mask >> (size - shift))) & ((1 << size) - 1)
+
+
+def widen_masks(month_mask, weekday_mask, days=2):
+    """
+    month and weekday masks with the months and weekdays up to days before or after
+    every bit, a local date can be 2 days before or after in another timezone
+    (UTC+14 and UTC-12) and more once a duration is added
+    """
+    if days >= 28:
+        return ALL_MONTHS, ALL_WEEKDAYS
+    months = month_mask | _rotate(month_mask, 1, 12) | _rotate(month_mask, -1, 12)
+    weekdays = weekday_mask
+    for shift in range(1, min(days, 3) + 1):
+        weekdays |= _rotate(weekday_mask, shift, 7) | _rotate(weekday_mask, -shift, 7)
+    return months & ALL_MONTHS, weekdays & ALL_WEEKDAYS
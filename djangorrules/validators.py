@@ -1,6 +1,35 @@
-from django.core.exceptions import ValidationError
+"""
+validation of the rule fields, shared by Rule.clean(), BaseRuleFormSet and validate_many()
+
+the checks run on plain dicts of field values, so a spreadsheet of rules can be
+validated without building model or form instances. the byweekday tokens are
+looked up in a table and the patterns are compiled once
+"""
+import re
+from functools import lru_cache
+
+from django.core.exceptions import NON_FIELD_ERRORS, ValidationError
+from django.core.validators import MinValueValidator
 from django.utils.translation import gettext_lazy as _
 
+PATTERN_WEEKDAY_WITH_NTH = "^([0-9]{1}|[-+][0-9]{1})[AEOUMTHWSFR]{2}$"
+PATTERN_WEEKDAY_WITHOUT_NTH = "^([AEOUMTHWSFR]{2}$)"
+WEEKDAY_WITH_NTH_RE = re.compile(PATTERN_WEEKDAY_WITH_NTH)
+WEEKDAY_WITHOUT_NTH_RE = re.compile(PATTERN_WEEKDAY_WITHOUT_NTH)
+
+WEEKDAY_CODES = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+# byweekday token -> True for the nth weekdays (1MO, +1MO, -1MO), False for the plain ones (MO)
+WEEKDAY_TOKENS = dict.fromkeys(WEEKDAY_CODES, False)
+WEEKDAY_TOKENS.update(dict.fromkeys(
+    (f'{sign}{n}{code}' for sign in ('', '+', '-') for n in range(10) for code in WEEKDAY_CODES), True
+))
+
+RULE_FIELDS = (
+    'freq', 'year_month_mode', 'dtstart', 'interval', 'wkst', 'bymonth', 'bymonthday',
+    'byweekday', 'bysetpos', 'freq_type', 'count', 'until_date',
+)
+MULTIPLE_FIELDS = ('bymonth', 'bymonthday', 'byweekday', 'bysetpos')
+
 
 def validate_nonzero(value):
     if value == 0:
@@ -8,3 +37,251 @@ def validate_nonzero(value):
             _('Quantity %(value)s is not allowed'),
             params={'value': value},
         )
+
+
+def validate_bysetpos(values):
+    """
+    every selected bysetpos between Rule.MIN_BYSETPOS and Rule.MAX_BYSETPOS
+    """
+    from .models import Rule
+
+    for value in values or ():
+        if not Rule.MIN_BYSETPOS <= int(value) <= Rule.MAX_BYSETPOS:
+            raise ValidationError(
+                _('%(value)s is not between %(min)s and %(max)s'),
+                code='invalid_bysetpos',
+                params={'value': value, 'min': Rule.MIN_BYSETPOS, 'max': Rule.MAX_BYSETPOS},
+            )
+
+
+def weekday_pattern(value):
+    """
+    the pattern (with or without nth) matching a byweekday value
+    """
+    if WEEKDAY_WITH_NTH_RE.match(value) is not None:
+        return PATTERN_WEEKDAY_WITH_NTH
+    elif WEEKDAY_WITHOUT_NTH_RE.match(value) is not None:
+        return PATTERN_WEEKDAY_WITHOUT_NTH
+    raise ValidationError({
+        'byweekday': _("by weekday must be in the form (1MO, +1MO, -1MO, MO)")
+    },
+        code="wrong_value"
+    )
+
+
+@lru_cache(maxsize=None)
+def _choices():
+    """
+    (field, set of the allowed values as strings) of the fields with choices
+    """
+    from .models import Rule
+
+    choices = {}
+    for name in ('freq', 'year_month_mode', 'wkst', 'freq_type') + MULTIPLE_FIELDS:
+        field = Rule._meta.get_field(name)
+        choices[name] = (field, {str(value) for value, label in field.flatchoices})
+    return choices
+
+
+def rule_values(rule):
+    """
+    dict with the RULE_FIELDS of a Rule
+    """
+    return {name: getattr(rule, name) for name in RULE_FIELDS}
+
+
+def field_errors(data):
+    """
+    yield a ValidationError with the message of clean_fields() for every field of data
+    (converted by to_python()) with a wrong value, only the checks of the choices,
+    the nulls and the minimum values
+    """
+    from .models import Rule
+
+    for name, (field, allowed) in _choices().items():
+        value = data.get(name)
+        if not value and value != 0:
+            if name == 'freq':
+                yield ValidationError({name: field.error_messages['null']}, code='null')
+            continue
+        values = value if name in MULTIPLE_FIELDS else [value]
+        if any(str(item) not in allowed for item in values):
+            yield ValidationError({name: field.error_messages['invalid_choice'] % {'value': value}},
+                                  code='invalid_choice')
+    for name in ('interval', 'count'):
+        value = data.get(name)
+        if value is None:
+            if name == 'interval':
+                yield ValidationError({name: Rule._meta.get_field(name).error_messages['null']}, code='null')
+        elif value < 1:
+            yield ValidationError({name: MinValueValidator.message % {'limit_value': 1}}, code='min_value')
+
+
+def rule_errors(data):
+    """
+    yield the errors of Rule.clean() for a dict of field values, Rule.clean() raises the first one
+    """
+    from .models import Rule
+
+    freq = data.get('freq')
+    mode = data.get('year_month_mode')
+    byweekday = data.get('byweekday')
+    bymonthday = data.get('bymonthday')
+    until_date = data.get('until_date')
+    count = data.get('count')
+    freq_type = data.get('freq_type', Rule.FOREVER)
+
+    if not mode and (freq == Rule.YEARLY or freq == Rule.MONTHLY):
+        yield ValidationError({'year_month_mode': _('mode field is required')}, code='mode_required')
+    elif mode and (freq != Rule.YEARLY and freq != Rule.MONTHLY):
+        yield ValidationError({'year_month_mode': _('mode field is unnecessary')}, code='mode_required')
+
+    if bymonthday and byweekday:
+        yield ValidationError(_('bymonth and byweekday fields are excluded from each other'),
+                              code='bymonth_or_byweekday_forbidden')
+
+    if mode == Rule.BY_DATE and byweekday:
+        yield ValidationError(
+            {'byweekday': _(f'mode field must be {Rule.YEARLY_MONTH_MODE[Rule.BY_DAY][1]}')},
+            code='mode_required')
+    elif mode == Rule.BY_DAY and bymonthday:
+        yield ValidationError(
+            {'bymonthday': _(f'mode field must be {Rule.YEARLY_MONTH_MODE[Rule.BY_DATE][1]}')},
+            code='mode_required')
+
+    if (freq == Rule.DAILY or freq == Rule.WEEKLY) and bymonthday:
+        yield ValidationError({
+            'bymonthday': _("Must not be specified when the Freq is set to WEEKLY or DAILY")
+        },
+            code="unnecessary_bymonthday"
+        )
+
+    if byweekday:
+        error = _byweekday_error(freq, byweekday)
+        if error is not None:
+            yield error
+
+    if count and until_date:
+        yield ValidationError(
+            _('count and until fields are excluded from each other'),
+            code='count_or_utc_forbidden'
+        )
+
+    if freq_type == Rule.FOREVER and (until_date or count):
+        yield ValidationError(
+            _('count or until values are unnecessary with forever freq type'),
+            code='unnecessary'
+        )
+    elif freq_type == Rule.UNTIL and not until_date:
+        yield ValidationError({'until_date': _('this field is required')}, code='until_required')
+    elif freq_type == Rule.COUNT and not count:
+        yield ValidationError({'count': _('this field is required')}, code='count_required')
+
+    if data.get('bysetpos') and (not any([byweekday, bymonthday]) or freq == Rule.WEEKLY):
+        yield ValidationError({
+            'bysetpos': _(
+                "Must be specified with the freq. YEARLY or MONTHLY with byweekday or bymonthday parameters")
+        },
+            code="unnecessary_bysetpos"
+        )
+
+
+def _byweekday_error(freq, byweekday):
+    from .models import Rule
+
+    if freq == Rule.DAILY:
+        return ValidationError({
+            'byweekday': _("Can't specify by weekday With Freq DAILY")
+        },
+            code="unnecessary_byweekday"
+        )
+    kinds = [WEEKDAY_TOKENS.get(value) for value in byweekday]
+    if None in kinds:
+        return ValidationError({
+            'byweekday': _("by weekday must be in the form (1MO, +1MO, -1MO, MO)")
+        },
+            code="wrong_value"
+        )
+    if len(set(kinds)) > 1:
+        return ValidationError({
+            'byweekday': _("by weekday must be in the form (1MO, +1MO, -1MO) or (MO, WE)"
+                           "you cannot use both formats at the same time")
+        },
+            code="different_formats"
+        )
+    if freq == Rule.WEEKLY and kinds[0]:
+        return ValidationError({
+            'byweekday': _("With Freq Weekly by weekday must be in the form (MO, WE)")
+        },
+            code="invalid_weekday"
+        )
+    return None
+
+
+def missing_fields(data):
+    """
+    fields the rule form requires for the freq and the mode of data and are empty
+    """
+    from .models import Rule
+
+    freq = data.get('freq')
+    required = []
+    if freq == Rule.YEARLY or freq == Rule.MONTHLY:
+        mode = data.get('year_month_mode')
+        if mode == Rule.BY_DATE:
+            required = ['bymonthday']
+        elif mode == Rule.BY_DAY:
+            required = ['byweekday']
+        else:
+            required = ['year_month_mode']
+    elif freq == Rule.WEEKLY:
+        required = ['byweekday']
+    return [field for field in required if not data.get(field)]
+
+
+def _messages(error):
+    if hasattr(error, 'error_dict'):
+        return error.message_dict
+    return {NON_FIELD_ERRORS: error.messages}
+
+
+def to_python(data):
+    """
+    (values, errors) of a dict of rule fields converted with the to_python() of the model
+    fields like clean_fields(), the fields missing from data get their default
+    """
+    from .models import Rule
+
+    values = {}
+    errors = []
+    for name in RULE_FIELDS:
+        field = Rule._meta.get_field(name)
+        try:
+            values[name] = field.to_python(data[name] if name in data else field.get_default())
+        except ValidationError as error:
+            values[name] = None
+            errors.append(ValidationError({name: error.messages}, code='invalid'))
+    return values, errors
+
+
+def validate_many(rule_dicts):
+    """
+    {index: {field: [messages]}} with every error of the rule dicts (keys of RULE_FIELDS),
+    the field checks and the ones of Rule.clean() in one pass, '__all__' holds the errors
+    of no field. the values are converted first, so strings like '2' are accepted.
+    the rules without errors are left out
+    """
+    errors = {}
+    for index, data in enumerate(rule_dicts):
+        values, found = to_python(data)
+        failed = set().union(*(error.message_dict for error in found))
+        found.extend(error for error in field_errors(values) if not failed.intersection(error.message_dict))
+        if not found:
+            # the checks of clean() expect valid values
+            found = list(rule_errors(values))
+        if found:
+            messages = errors[index] = {}
+            for error in found:
+                for field, items in _messages(error).items():
+                    messages.setdefault(field, []).extend(items)
+    return errors
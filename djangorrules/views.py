@@ -1,10 +1,30 @@
-from django.http import HttpResponseRedirect
+import hashlib
+import json
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+import pytz
+
+from django.db.models import Count, Max, Min, Sum
+from django.http import HttpResponseBadRequest, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import render
 from django.urls import reverse
 
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.views.decorators.http import condition, require_GET
 
+from djangorrules.conf import app_settings
 from djangorrules.forms import RulseFormSet
+from djangorrules.ical import occurrences_to_vcalendar
+from djangorrules.models import Recurrence
+
+EXPORT_FORMATS = {
+    'ics': 'text/calendar; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+# lines sent in each chunk of the streaming response
+EXPORT_CHUNK_SIZE = 500
 
 
 def test_form(request):
@@ -21,3 +41,91 @@ def test_form(request):
     else:
         formset = RulseFormSet(prefix='rule-form')
     return render(request, "djangorrules/templates/djangorrules/create-rule.html", {'formset': formset})
+
+
+def _parse_limit(value):
+    """
+    aware datetime of an ISO date or datetime, naive values are taken as UTC
+    """
+    dt = parse_datetime(value)
+    if dt is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        dt = datetime.combine(day, time())
+    if timezone.is_naive(dt):
+        dt = pytz.utc.localize(dt)
+    return dt
+
+
+def _export_params(request, pk=None):
+    """
+    recurrences, start, end and format of an export request,
+    start defaults to today (UTC) and end to start + DJANGORRULES_OCCURRENCE_HORIZON days
+    """
+    params = request.GET
+    if 'start' in params:
+        start = _parse_limit(params['start'])
+    else:
+        start = datetime.combine(timezone.now().date(), time(), tzinfo=pytz.utc)
+    if 'end' in params:
+        end = _parse_limit(params['end'])
+    else:
+        end = start + timedelta(days=app_settings.OCCURRENCE_HORIZON)
+    export_format = params.get('format', 'ics')
+    if export_format not in EXPORT_FORMATS or end < start:
+        raise ValueError(export_format)
+    recurrences = Recurrence.objects.all()
+    if pk is not None:
+        recurrences = recurrences.filter(pk=pk)
+    elif params.get('ids'):
+        recurrences = recurrences.filter(pk__in=[int(item) for item in params['ids'].split(',')])
+    return recurrences, start, end, export_format
+
+
+def _export_etag(request, pk=None):
+    """
+    the request parameters and one aggregate row of the recurrences (count, pk range
+    and sum of the versions, bumped on every change), without expanding any rule
+    """
+    try:
+        recurrences, start, end, export_format = _export_params(request, pk)
+    except ValueError:
+        return None
+    state = recurrences.order_by().aggregate(Count('pk'), Min('pk'), Max('pk'), Sum('version'))
+    data = f"{start.isoformat()}|{end.isoformat()}|{export_format}|{sorted(state.items())}"
+    return hashlib.md5(data.encode()).hexdigest()
+
+
+def _chunks(lines):
+    lines = iter(lines)
+    while True:
+        chunk = list(islice(lines, EXPORT_CHUNK_SIZE))
+        if not chunk:
+            return
+        yield ''.join(chunk)
+
+
+@require_GET
+@condition(etag_func=_export_etag)
+def export_occurrences(request, pk=None):
+    """
+    stream the occurrences between the start and end parameters of one recurrence
+    or of the recurrences in the ids parameter (all when missing) as text/calendar
+    (format=ics) or as one JSON object per line (format=ndjson).
+    the ETag changes with the version of the recurrences, a client sending
+    If-None-Match gets a 304 before any rule is expanded
+    """
+    try:
+        recurrences, start, end, export_format = _export_params(request, pk)
+    except ValueError:
+        return HttpResponseBadRequest('invalid start, end, ids or format')
+    occurrences = recurrences.occurrences_between(start, end, inc=True)
+    if export_format == 'ics':
+        lines = (f'{line}\r\n' for line in occurrences_to_vcalendar(occurrences, timezone.now()))
+    else:
+        lines = (
+            json.dumps({'recurrence': recurrence_id, 'start': dt.isoformat()}) + '\n'
+            for recurrence_id, dt in occurrences
+        )
+    return StreamingHttpResponse(_chunks(lines), content_type=EXPORT_FORMATS[export_format])
@@ -4,5 +4,8 @@ setup(
     name='djangorrules',
     version='0.1',
     install_requires=["django-multiselectfield==0.1.12", "python-dateutil", "django-select2"],
+    extras_require={
+        "numpy": ["numpy"],
+    },
     python_requires='>=3.6'
 )